@@ -8,8 +8,9 @@ from datetime import datetime, timedelta
 import os
 
 from database import get_db, User
+from profiling import TimedRoute, phase
 
-router = APIRouter()
+router = APIRouter(route_class=TimedRoute)
 security = HTTPBearer()
 
 SECRET_KEY = os.getenv("SECRET_KEY", "your-secret-key-change-in-production")
@@ -78,29 +79,30 @@ async def get_current_user(
         headers={"WWW-Authenticate": "Bearer"},
     )
     
-    try:
-        token = credentials.credentials
-        if not token:
+    with phase("auth"):
+        try:
+            token = credentials.credentials
+            if not token:
+                raise credentials_exception
+                
+            payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+            user_id_str = payload.get("sub")
+            if user_id_str is None:
+                raise credentials_exception
+            # Convert string user_id back to int for database query
+            user_id = int(user_id_str)
+        except JWTError as e:
+            print(f"JWT Error: {str(e)}")
             raise credentials_exception
-            
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        user_id_str = payload.get("sub")
-        if user_id_str is None:
+        except Exception as e:
+            print(f"Auth Error: {str(e)}")
             raise credentials_exception
-        # Convert string user_id back to int for database query
-        user_id = int(user_id_str)
-    except JWTError as e:
-        print(f"JWT Error: {str(e)}")
-        raise credentials_exception
-    except Exception as e:
-        print(f"Auth Error: {str(e)}")
-        raise credentials_exception
-    
-    user = db.query(User).filter(User.id == user_id).first()
-    if user is None:
-        raise credentials_exception
-    
-    return user
+        
+        user = db.query(User).filter(User.id == user_id).first()
+        if user is None:
+            raise credentials_exception
+        
+        return user
 
 @router.post("/register", response_model=Token)
 async def register(user_data: UserRegister, db: Session = Depends(get_db)):
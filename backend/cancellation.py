@@ -0,0 +1,172 @@
+from contextlib import asynccontextmanager, suppress
+from fastapi import HTTPException, Request
+from sqlalchemy.orm import Session
+from datetime import datetime
+import asyncio
+import time
+
+from database import SessionLocal, GenerationCancellation
+
+# How often a running model call checks whether its client is still there
+DISCONNECT_POLL_SECONDS = 0.25
+# How often it checks for a cancel issued through another worker process
+CANCEL_POLL_SECONDS = 1.0
+
+REASON_DISCONNECTED = "client disconnected"
+REASON_CANCELLED = "cancelled by user"
+REASON_SHUTDOWN = "server shutting down"
+REASON_BUDGET = "daily token budget exhausted"
+
+# Sent as Retry-After with work refused or stopped by a shutdown; by then the
+# load balancer sends the retry to another worker
+RETRY_AFTER_SECONDS = 5
+
+class GenerationCancelled(Exception):
+    def __init__(self, reason: str):
+        super().__init__(reason)
+        self.reason = reason
+
+    def to_http(self) -> HTTPException:
+        # 499 is the de facto "client closed request" status; nobody reads it
+        # but it keeps disconnects apart from real failures in access logs
+        if self.reason == REASON_DISCONNECTED:
+            return HTTPException(status_code=499, detail="Client closed request")
+        if self.reason == REASON_BUDGET:
+            return HTTPException(status_code=429, detail="Daily token budget exhausted. Try again later.")
+        if self.reason == REASON_SHUTDOWN:
+            return HTTPException(
+                status_code=503,
+                detail="Server is shutting down, please retry",
+                headers={"Retry-After": str(RETRY_AFTER_SECONDS)}
+            )
+        return HTTPException(status_code=409, detail="Generation cancelled")
+
+class CancelScope:
+    """Cancellation state for one generation or refinement request.
+
+    Set when the client disconnects or when the user cancels the project's
+    generation explicitly. Work started through run() is abandoned as soon as
+    either happens, and loops check cancelled before starting the next call.
+    """
+
+    def __init__(self, request: Request, project_id: int):
+        self.request = request
+        self.project_id = project_id
+        self.started_at = datetime.utcnow()
+        self.reason = None
+        self._event = asyncio.Event()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def cancel(self, reason: str = REASON_CANCELLED):
+        if not self.cancelled:
+            self.reason = reason
+            self._event.set()
+
+    def _cancel_requested(self) -> bool:
+        db = SessionLocal()
+        try:
+            requested_at = db.query(GenerationCancellation.requested_at).filter(
+                GenerationCancellation.project_id == self.project_id
+            ).scalar()
+            return requested_at is not None and requested_at >= self.started_at
+        finally:
+            db.close()
+
+    async def _poll(self, check_cancels: bool):
+        if self.cancelled:
+            return
+        if await self.request.is_disconnected():
+            self.cancel(REASON_DISCONNECTED)
+        elif check_cancels and await asyncio.to_thread(self._cancel_requested):
+            self.cancel(REASON_CANCELLED)
+
+    async def check(self):
+        """Raise GenerationCancelled if the request should stop"""
+        await self._poll(check_cancels=True)
+        if self.cancelled:
+            raise GenerationCancelled(self.reason)
+
+    async def _watch(self):
+        last_cancel_check = time.monotonic()
+        while not self.cancelled:
+            check_cancels = time.monotonic() - last_cancel_check >= CANCEL_POLL_SECONDS
+            if check_cancels:
+                last_cancel_check = time.monotonic()
+            await self._poll(check_cancels)
+            with suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(self._event.wait(), DISCONNECT_POLL_SECONDS)
+
+    async def run(self, start):
+        """Await start(), cancelling it and raising GenerationCancelled if the request stops first.
+
+        start is called only once the request is known to be live, so no
+        coroutine is created (and left unawaited) for one already cancelled.
+        The started task never outlives this call.
+        """
+        await self.check()
+        task = asyncio.ensure_future(start())
+        watcher = asyncio.ensure_future(self._watch())
+        try:
+            await asyncio.wait({task, watcher}, return_when=asyncio.FIRST_COMPLETED)
+            if task.done():
+                return task.result()
+            raise GenerationCancelled(self.reason)
+        finally:
+            watcher.cancel()
+            if not task.done():
+                # Stopped by the scope, or the request's own task was cancelled:
+                # either way the call must not keep running (and holding its
+                # scheduler slot) on its own
+                task.cancel()
+                await asyncio.wait({task})
+
+# project_id -> scopes of the requests currently generating or refining it
+_active = {}
+
+@asynccontextmanager
+async def cancel_scope(request: Request, project_id: int):
+    scope = CancelScope(request, project_id)
+    _active.setdefault(project_id, set()).add(scope)
+    try:
+        yield scope
+    finally:
+        scopes = _active.get(project_id)
+        if scopes is not None:
+            scopes.discard(scope)
+            if not scopes:
+                del _active[project_id]
+
+def active_requests() -> int:
+    """Generation and refinement requests currently running in this process"""
+    return sum(len(scopes) for scopes in _active.values())
+
+def cancel_all(reason: str) -> int:
+    """Cancel every in-flight generation and refinement in this process"""
+    scopes = [scope for scopes in _active.values() for scope in scopes]
+    for scope in scopes:
+        scope.cancel(reason)
+    return len(scopes)
+
+def cancel_project(db: Session, project_id: int) -> int:
+    """Cancel every in-flight generation and refinement of a project.
+
+    Requests in this process stop immediately; the stored marker reaches the
+    ones running in other workers within CANCEL_POLL_SECONDS. Returns how many
+    requests were stopped in this process.
+    """
+    marker = db.query(GenerationCancellation).filter(
+        GenerationCancellation.project_id == project_id
+    ).first()
+    if marker:
+        marker.requested_at = datetime.utcnow()
+    else:
+        db.add(GenerationCancellation(project_id=project_id))
+    db.commit()
+    
+    scopes = list(_active.get(project_id, ()))
+    for scope in scopes:
+        scope.cancel()
+    return len(scopes)
@@ -1,31 +1,125 @@
-from sqlalchemy import create_engine, Column, Integer, String, Text, DateTime, ForeignKey, JSON, Boolean
+from sqlalchemy import create_engine, event, inspect, text, Column, Integer, String, Text, DateTime, ForeignKey, JSON, Boolean, LargeBinary, UniqueConstraint, Index
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker, relationship
+from sqlalchemy.orm import sessionmaker, relationship, deferred
+from sqlalchemy.types import TypeDecorator
 from datetime import datetime
 import os
+import zlib
+
+try:
+    import zstandard
+except ImportError:  # Optional, zlib is used without it
+    zstandard = None
 
 # Support both SQLite (development) and PostgreSQL (production)
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./documents.db")
 
-# Handle PostgreSQL connection string (Railway, Render, etc. use postgres://)
-if DATABASE_URL.startswith("postgres://"):
-    DATABASE_URL = DATABASE_URL.replace("postgres://", "postgresql://", 1)
+def normalize_database_url(url: str) -> str:
+    """Pin PostgreSQL URLs to psycopg2, the driver in requirements.txt.
+
+    Railway, Render, etc. hand out postgres:// URLs, and SQLAlchemy 2.1 maps a
+    bare postgresql:// to psycopg 3, which is not installed.
+    """
+    for prefix in ("postgres://", "postgresql://"):
+        if url.startswith(prefix):
+            return "postgresql+psycopg2://" + url[len(prefix):]
+    return url
+
+DATABASE_URL = normalize_database_url(DATABASE_URL)
+
+# Total connections the app may hold open on the database, shared by all
+# server workers (WEB_CONCURRENCY, set by gunicorn.conf.py)
+DB_CONNECTION_BUDGET = int(os.getenv("DB_CONNECTION_BUDGET", "20"))
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", "1"))
+# Connections each worker may hold per database (primary and every replica).
+# A generation or refinement holds two, the request's session and the flight's
+# own (which also carries its cross-process lock, see singleflight.py), so a
+# smaller pool could leave every request waiting on its second connection.
+POOL_SIZE = max(2, DB_CONNECTION_BUDGET // WEB_CONCURRENCY)
+
+# Read replicas, comma separated. Read-only endpoints are routed to them,
+# see replicas.py; empty means everything goes to DATABASE_URL.
+REPLICA_DATABASE_URLS = [
+    normalize_database_url(url.strip())
+    for url in os.getenv("REPLICA_DATABASE_URLS", "").split(",") if url.strip()
+]
 
-if DATABASE_URL.startswith("postgresql"):
-    # PostgreSQL (production)
-    SQLALCHEMY_DATABASE_URL = DATABASE_URL
-    engine = create_engine(SQLALCHEMY_DATABASE_URL)
-else:
+def make_engine(url: str, **connect_args):
+    """Engine for the primary or a replica, each with its own connection budget"""
+    if url.startswith("postgresql"):
+        # PostgreSQL (production)
+        return create_engine(
+            url,
+            pool_size=POOL_SIZE,
+            max_overflow=0,
+            pool_pre_ping=True,
+            pool_recycle=1800,
+            connect_args=connect_args
+        )
+    
     # SQLite (local development)
-    SQLALCHEMY_DATABASE_URL = DATABASE_URL
-    engine = create_engine(
-        SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
+    sqlite_engine = create_engine(
+        url, connect_args={"check_same_thread": False}
     )
+    
+    # SQLite ignores foreign keys, and so ON DELETE CASCADE, unless asked per connection
+    @event.listens_for(sqlite_engine, "connect")
+    def enable_sqlite_foreign_keys(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA foreign_keys=ON")
+        cursor.close()
+    
+    return sqlite_engine
+
+SQLALCHEMY_DATABASE_URL = DATABASE_URL
+engine = make_engine(SQLALCHEMY_DATABASE_URL)
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 Base = declarative_base()
 
+# First byte of a CompressedText value says how the rest is encoded
+CODEC_RAW = b"\x00"
+CODEC_ZLIB = b"\x01"
+CODEC_ZSTD = b"\x02"
+# Shorter values are stored as plain UTF-8, compression would not pay off
+COMPRESS_MIN_BYTES = 128
+
+class CompressedText(TypeDecorator):
+    """Text stored compressed in a binary column.
+
+    New values are written with zstd when the zstandard package is installed
+    and zlib otherwise; values written either way (or as plain text by older
+    versions) read back transparently.
+    """
+    impl = LargeBinary
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        data = value.encode("utf-8")
+        if len(data) < COMPRESS_MIN_BYTES:
+            return CODEC_RAW + data
+        if zstandard is not None:
+            return CODEC_ZSTD + zstandard.ZstdCompressor(level=6).compress(data)
+        return CODEC_ZLIB + zlib.compress(data, 6)
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        if isinstance(value, str):
+            return value
+        value = bytes(value)
+        codec, data = value[:1], value[1:]
+        if codec == CODEC_ZLIB:
+            data = zlib.decompress(data)
+        elif codec == CODEC_ZSTD:
+            data = zstandard.ZstdDecompressor().decompress(data)
+        elif codec != CODEC_RAW:
+            data = value
+        return data.decode("utf-8")
+
 class User(Base):
     __tablename__ = "users"
     
@@ -35,7 +129,7 @@ class User(Base):
     hashed_password = Column(String, nullable=False)
     created_at = Column(DateTime, default=datetime.utcnow)
     
-    projects = relationship("Project", back_populates="owner", cascade="all, delete-orphan")
+    projects = relationship("Project", back_populates="owner", cascade="all, delete-orphan", passive_deletes=True)
 
 class Project(Base):
     __tablename__ = "projects"
@@ -44,20 +138,23 @@ class Project(Base):
     title = Column(String, nullable=False)
     document_type = Column(String, nullable=False)  # "docx" or "pptx"
     topic = Column(Text, nullable=False)
-    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    deleted_at = Column(DateTime, nullable=True, index=True)  # Set on delete, rows are purged in the background
     
+    # Child rows are removed by ON DELETE CASCADE in the database; passive_deletes
+    # stops SQLAlchemy from loading them all just to delete them one by one
     owner = relationship("User", back_populates="projects")
-    structure = relationship("DocumentStructure", back_populates="project", uselist=False, cascade="all, delete-orphan")
-    sections = relationship("DocumentSection", back_populates="project", cascade="all, delete-orphan")
-    refinements = relationship("Refinement", back_populates="project", cascade="all, delete-orphan")
+    structure = relationship("DocumentStructure", back_populates="project", uselist=False, cascade="all, delete-orphan", passive_deletes=True)
+    sections = relationship("DocumentSection", back_populates="project", cascade="all, delete-orphan", passive_deletes=True)
+    refinements = relationship("Refinement", back_populates="project", cascade="all, delete-orphan", passive_deletes=True)
 
 class DocumentStructure(Base):
     __tablename__ = "document_structures"
     
     id = Column(Integer, primary_key=True, index=True)
-    project_id = Column(Integer, ForeignKey("projects.id"), unique=True, nullable=False)
+    project_id = Column(Integer, ForeignKey("projects.id", ondelete="CASCADE"), unique=True, nullable=False)
     structure_data = Column(JSON, nullable=False)  # For docx: list of section headers, for pptx: list of slide titles
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
@@ -66,35 +163,162 @@ class DocumentStructure(Base):
 
 class DocumentSection(Base):
     __tablename__ = "document_sections"
+    __table_args__ = (
+        Index("ix_document_sections_project_index", "project_id", "section_index"),
+        # Lets the project ETag find the newest section write without touching content
+        Index("ix_document_sections_project_updated", "project_id", "updated_at"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
-    project_id = Column(Integer, ForeignKey("projects.id"), nullable=False)
+    project_id = Column(Integer, ForeignKey("projects.id", ondelete="CASCADE"), nullable=False)
     section_index = Column(Integer, nullable=False)  # Order of section/slide
     title = Column(String, nullable=False)
-    content = Column(Text, nullable=True)  # Generated content
+    # Compressed, and only loaded when read so metadata queries stay small
+    content = deferred(Column(CompressedText, nullable=True))  # Generated content
+    current_revision = Column(Integer, nullable=False, default=0)  # Latest SectionRevision number, 0 if none
+    input_fingerprint = Column(String(64), nullable=True)  # Hash of the inputs the content was generated from
     generated_at = Column(DateTime, nullable=True)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
     project = relationship("Project", back_populates="sections")
-    refinements = relationship("Refinement", back_populates="section", cascade="all, delete-orphan")
+    refinements = relationship("Refinement", back_populates="section", cascade="all, delete-orphan", passive_deletes=True)
+    revisions = relationship("SectionRevision", back_populates="section", cascade="all, delete-orphan", passive_deletes=True)
+    
+    # ORM updates only apply WHERE current_revision is still the version read
+    # with the row, so a generation or refinement that read the section before
+    # a long model call cannot overwrite an edit committed meanwhile (they get
+    # StaleDataError). record_revision sets the new number itself.
+    __mapper_args__ = {"version_id_col": current_revision, "version_id_generator": False}
+
+class SectionRevision(Base):
+    __tablename__ = "section_revisions"
+    __table_args__ = (UniqueConstraint("section_id", "revision_number"),)
+    
+    id = Column(Integer, primary_key=True, index=True)
+    section_id = Column(Integer, ForeignKey("document_sections.id", ondelete="CASCADE"), nullable=False)
+    revision_number = Column(Integer, nullable=False)
+    is_snapshot = Column(Boolean, nullable=False, default=False)
+    data = Column(LargeBinary, nullable=False)  # zlib-compressed full text (snapshot) or delta from the previous revision
+    created_at = Column(DateTime, default=datetime.utcnow)
+    
+    section = relationship("DocumentSection", back_populates="revisions")
 
 class Refinement(Base):
     __tablename__ = "refinements"
+    __table_args__ = (
+        # History pages are keyset scans in created_at order, per section or per project
+        Index("ix_refinements_project_section_created", "project_id", "section_id", "created_at"),
+        Index("ix_refinements_project_created", "project_id", "created_at"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
-    project_id = Column(Integer, ForeignKey("projects.id"), nullable=False)
-    section_id = Column(Integer, ForeignKey("document_sections.id"), nullable=False)
+    project_id = Column(Integer, ForeignKey("projects.id", ondelete="CASCADE"), nullable=False)
+    section_id = Column(Integer, ForeignKey("document_sections.id", ondelete="CASCADE"), nullable=False)
+    revision_id = Column(Integer, ForeignKey("section_revisions.id", ondelete="SET NULL"), nullable=True)  # Section revision produced or rated
     refinement_prompt = Column(Text, nullable=True)
-    refined_content = Column(Text, nullable=False)
+    refined_content = Column(Text, nullable=True)  # Legacy full copy, new rows reference revision_id instead
     feedback = Column(String, nullable=True)  # "like" or "dislike"
     comment = Column(Text, nullable=True)
+    input_tokens = Column(Integer, nullable=True)  # Estimated prompt tokens sent to the model
+    output_tokens = Column(Integer, nullable=True)  # Estimated tokens in the model response
     created_at = Column(DateTime, default=datetime.utcnow)
     
     project = relationship("Project", back_populates="refinements")
     section = relationship("DocumentSection", back_populates="refinements")
+    revision = relationship("SectionRevision")
+
+class GenerationCancellation(Base):
+    __tablename__ = "generation_cancellations"
+    
+    # Not a foreign key: rows are only signals between workers and may outlive the project
+    project_id = Column(Integer, primary_key=True)
+    requested_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+
+class GenerationCheckpoint(Base):
+    __tablename__ = "generation_checkpoints"
+    
+    # What is left of the project's last /generate run that stopped early
+    project_id = Column(Integer, ForeignKey("projects.id", ondelete="CASCADE"), primary_key=True)
+    section_indices = Column(JSON, nullable=True)  # As requested by that run, null for all sections
+    only_stale = Column(Boolean, nullable=False, default=False)
+    pending_indices = Column(JSON, nullable=False)  # Requested sections it did not get to
+    reason = Column(String, nullable=False)  # Why it stopped, see cancellation.py
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+
+class TokenUsage(Base):
+    __tablename__ = "token_usage"
+    __table_args__ = (Index("ix_token_usage_user_created", "user_id", "created_at"),)
+    
+    # Estimated tokens of one generation model call; refinements are counted on their Refinement row
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    # Not a foreign key: usage still counts towards the budget after the project is deleted
+    project_id = Column(Integer, nullable=True)
+    kind = Column(String, nullable=False)  # "section" or "template"
+    input_tokens = Column(Integer, nullable=False, default=0)
+    output_tokens = Column(Integer, nullable=False, default=0)
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+
+class IdempotencyRecord(Base):
+    __tablename__ = "idempotency_records"
+    __table_args__ = (UniqueConstraint("user_id", "key"),)
+    
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    key = Column(String(255), nullable=False)  # Idempotency-Key header, unique per user
+    request_hash = Column(String(64), nullable=False)  # Method, path and parameters the key was first used with
+    status = Column(String, nullable=False, default="pending")  # "pending" while the first request runs, then "completed"
+    response_body = Column(Text, nullable=True)  # JSON returned by the first request once completed
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)  # Start of the current attempt
+    expires_at = Column(DateTime, nullable=False, index=True)  # Purged after this, the key can then be reused
+
+def upgrade_schema(conn):
+    """Bring tables created by older versions up to date, create_all only adds missing tables.
+
+    Missing columns are added, NOT NULL is dropped where the model now allows
+    NULL, and CompressedText columns still declared as text are converted to
+    binary, old values getting the raw codec byte. SQLite keeps its text
+    column: it stores the new blobs as they are and old values read back as
+    text. Changes that cannot be made in place raise instead of letting
+    writes fail later.
+    """
+    inspector = inspect(conn)
+    dialect = conn.dialect.name
+    for table in Base.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {column["name"]: column for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            current = existing.get(column.name)
+            if current is None:
+                ddl = f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column.type.compile(dialect=conn.dialect)}"
+                if not column.nullable:
+                    default = column.default.arg if column.default is not None and column.default.is_scalar else None
+                    if default is None:
+                        raise RuntimeError(f"Cannot add NOT NULL column {table.name}.{column.name} without a default")
+                    literal = str(default).upper() if isinstance(default, bool) else repr(default)
+                    ddl += f" DEFAULT {literal} NOT NULL"
+                conn.execute(text(ddl))
+                continue
+            if column.nullable and not current["nullable"]:
+                if dialect != "postgresql":
+                    raise RuntimeError(f"{table.name}.{column.name} must allow NULL, recreate the table to upgrade it")
+                conn.execute(text(f"ALTER TABLE {table.name} ALTER COLUMN {column.name} DROP NOT NULL"))
+            if isinstance(column.type, CompressedText) and not isinstance(current["type"], LargeBinary):
+                if dialect == "postgresql":
+                    conn.execute(text(
+                        f"ALTER TABLE {table.name} ALTER COLUMN {column.name} TYPE BYTEA "
+                        f"USING '\\x00'::bytea || convert_to({column.name}, 'UTF8')"
+                    ))
+                elif dialect != "sqlite":
+                    raise RuntimeError(f"{table.name}.{column.name} must be converted to a binary column")
+        for index in table.indexes:
+            index.create(conn, checkfirst=True)
 
 def init_db():
     Base.metadata.create_all(bind=engine)
+    with engine.begin() as conn:
+        upgrade_schema(conn)
 
 def get_db():
     db = SessionLocal()
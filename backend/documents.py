@@ -1,19 +1,28 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Request
+from sqlalchemy import update
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
-from pydantic import BaseModel, ConfigDict
+from pydantic import BaseModel, ConfigDict, Field
 from typing import List, Optional
 from datetime import datetime
 
 from database import get_db, User, Project, DocumentSection, DocumentStructure
+from profiling import TimedRoute
 from auth import get_current_user
+from projects import section_rows, project_etag
+from replicas import get_read_db
+from responses import FastJSONResponse, is_not_modified, not_modified
+from revisions import build_revision, CONFLICT_DETAIL
+from search import index_section
 
-router = APIRouter()
+router = APIRouter(route_class=TimedRoute)
 
 class SectionResponse(BaseModel):
     id: int
     section_index: int
     title: str
-    content: str
+    content: Optional[str] = None
+    version: int = 0  # Base version for content patches
     generated_at: Optional[datetime] = None
     updated_at: datetime
     
@@ -22,22 +31,49 @@ class SectionResponse(BaseModel):
 class AddSectionRequest(BaseModel):
     title: str
 
+class ContentOperation(BaseModel):
+    start: int = Field(..., ge=0)  # Offsets in Unicode code points into the base content
+    end: int = Field(..., ge=0)  # Exclusive; equal to start for a pure insert
+    text: str = ""  # Replacement for base[start:end], empty for a delete
+
+class ContentPatchRequest(BaseModel):
+    base_version: int  # Section version the operations were made against
+    operations: List[ContentOperation]
+
+def apply_content_operations(base: str, operations: List[ContentOperation]) -> str:
+    """Apply splice operations given in base-content offsets.
+
+    Operations must be sorted and must not overlap, so each one can be
+    interpreted against the base text independently of the others.
+    """
+    parts = []
+    pos = 0
+    for i, op in enumerate(operations):
+        if op.end < op.start or op.start < pos or op.end > len(base):
+            raise HTTPException(
+                status_code=400,
+                detail=f"Invalid operation #{i}: [{op.start}, {op.end}) must be in order, non-overlapping and within {len(base)} characters"
+            )
+        parts.append(base[pos:op.start])
+        parts.append(op.text)
+        pos = op.end
+    parts.append(base[pos:])
+    return "".join(parts)
+
 @router.get("/{project_id}/sections", response_model=List[SectionResponse])
 async def get_project_sections(
     project_id: int,
+    request: Request,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db)
 ):
-    project = db.query(Project).filter(
-        Project.id == project_id,
-        Project.user_id == current_user.id
-    ).first()
-    
-    if not project:
+    etag = project_etag(db, project_id, current_user.id)
+    if etag is None:
         raise HTTPException(status_code=404, detail="Project not found")
+    if is_not_modified(request, etag):
+        return not_modified(etag)
     
-    sections = sorted(project.sections, key=lambda x: x.section_index)
-    return sections
+    return FastJSONResponse(section_rows(db, project_id), headers={"ETag": etag})
 
 @router.post("/{project_id}/sections")
 async def add_section(
@@ -49,7 +85,8 @@ async def add_section(
     """Add a new section to the project structure"""
     project = db.query(Project).filter(
         Project.id == project_id,
-        Project.user_id == current_user.id
+        Project.user_id == current_user.id,
+        Project.deleted_at.is_(None)
     ).first()
     
     if not project:
@@ -79,3 +116,64 @@ async def add_section(
         "structure_data": structure_data
     }
 
+
+@router.patch("/{project_id}/sections/{section_id}/content")
+async def patch_section_content(
+    project_id: int,
+    section_id: int,
+    request: ContentPatchRequest,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Apply an editor's changes to a section's content.
+
+    Clients send only the edited ranges against the version they last saw and
+    get the new version back. If the section changed since base_version the
+    patch is rejected with 409 and the client must reload and rebase.
+    """
+    section = db.query(DocumentSection).join(Project, Project.id == DocumentSection.project_id).filter(
+        DocumentSection.id == section_id,
+        DocumentSection.project_id == project_id,
+        Project.user_id == current_user.id,
+        Project.deleted_at.is_(None)
+    ).first()
+    
+    if not section:
+        raise HTTPException(status_code=404, detail="Section not found")
+    
+    if section.current_revision != request.base_version:
+        raise HTTPException(
+            status_code=409,
+            detail=f"Section is at version {section.current_revision}, not {request.base_version}"
+        )
+    
+    previous_content = section.content or ""
+    content = apply_content_operations(previous_content, request.operations)
+    new_version = request.base_version + 1
+    
+    # Conditional on the version so a concurrent write between the read above
+    # and this statement is detected instead of silently overwritten
+    result = db.execute(
+        update(DocumentSection).where(
+            DocumentSection.id == section.id,
+            DocumentSection.current_revision == request.base_version
+        ).values(
+            content=content,
+            current_revision=new_version,
+            updated_at=datetime.utcnow()
+        ).execution_options(synchronize_session=False)
+    )
+    if result.rowcount != 1:
+        db.rollback()
+        raise HTTPException(status_code=409, detail=CONFLICT_DETAIL)
+    
+    try:
+        db.add(build_revision(section.id, new_version, content, previous_content if request.base_version else None))
+        index_section(db, section.id, project_id, current_user.id, content)
+        db.commit()
+    except IntegrityError:
+        # Another writer recorded this revision number first
+        db.rollback()
+        raise HTTPException(status_code=409, detail=CONFLICT_DETAIL)
+    
+    return {"version": new_version}
@@ -0,0 +1,111 @@
+from fastapi import HTTPException
+import asyncio
+import os
+import signal
+import threading
+import time
+
+from cancellation import active_requests, cancel_all, REASON_SHUTDOWN, RETRY_AFTER_SECONDS
+
+# Generations still running this long after SIGTERM are stopped, leaving time
+# to answer and checkpoint before gunicorn's GRACEFUL_TIMEOUT (60) kills the worker
+DRAIN_TIMEOUT_SECONDS = float(os.getenv("DRAIN_TIMEOUT_SECONDS", "45"))
+# How long the worker keeps accepting connections after SIGTERM, answering 503
+# on /api/health, so the load balancer takes it out before it stops listening
+DRAIN_NOTICE_SECONDS = float(os.getenv("DRAIN_NOTICE_SECONDS", "0"))
+
+class Drain:
+    """Shutdown of this worker process without losing in-flight generations.
+
+    On SIGTERM new generation and export work is refused, health checks
+    report not ready, and running generations finish the section they are on.
+    Whatever is still running at the deadline is cancelled; /generate runs
+    checkpoint their remaining sections either way so a retry resumes them.
+    """
+
+    def __init__(self):
+        self.started = None
+        self.deadline = None
+        self.rejected = 0
+        self.stopped = 0
+        self._deadline_task = None
+
+    def reset(self):
+        """Serve again, for an app started more than once in one process (tests)"""
+        self.__init__()
+
+    @property
+    def draining(self) -> bool:
+        return self.started is not None
+
+    def begin(self):
+        if self.draining:
+            return
+        self.started = time.monotonic()
+        self.deadline = self.started + DRAIN_TIMEOUT_SECONDS
+        print(f"Draining: {active_requests()} generation requests in flight")
+
+    def _start(self):
+        self.begin()
+        if self._deadline_task is None:
+            self._deadline_task = asyncio.create_task(self._enforce_deadline())
+
+    async def _enforce_deadline(self):
+        await asyncio.sleep(max(0.0, self.deadline - time.monotonic()))
+        self._stop_remaining()
+
+    def _stop_remaining(self):
+        stopped = cancel_all(REASON_SHUTDOWN)
+        if stopped:
+            self.stopped += stopped
+            print(f"Drain deadline reached, stopped {stopped} generation requests")
+
+    def install_signal_handler(self):
+        """Drain on SIGTERM, then hand the signal to the server's own handler.
+
+        The server stops listening and waits for open requests once it gets
+        the signal, DRAIN_NOTICE_SECONDS later. Nothing is installed outside
+        the main thread or when no server handler is there to hand over to.
+        """
+        if threading.current_thread() is not threading.main_thread():
+            return
+        previous = signal.getsignal(signal.SIGTERM)
+        if not callable(previous):
+            return
+        loop = asyncio.get_running_loop()
+
+        def handle_sigterm(sig, frame):
+            self.begin()
+            loop.call_soon_threadsafe(self._start)
+            loop.call_soon_threadsafe(loop.call_later, DRAIN_NOTICE_SECONDS, previous, sig, frame)
+        
+        signal.signal(signal.SIGTERM, handle_sigterm)
+
+    def shutdown(self):
+        """Called once the server has stopped: anything left is stopped now"""
+        self.begin()
+        if self._deadline_task is not None:
+            self._deadline_task.cancel()
+        self._stop_remaining()
+
+    def stats(self) -> dict:
+        return {
+            "draining": self.draining,
+            "seconds_left": max(0.0, round(self.deadline - time.monotonic(), 1)) if self.draining else None,
+            "in_flight": active_requests(),
+            "rejected": self.rejected,
+            "stopped": self.stopped
+        }
+
+drain = Drain()
+
+def accepting_work():
+    """Dependency of endpoints that start generation or export work, refused while draining"""
+    if drain.draining:
+        drain.rejected += 1
+        # Connection: close so the client's retry opens a connection to another worker
+        raise HTTPException(
+            status_code=503,
+            detail="Server is shutting down, please retry",
+            headers={"Retry-After": str(RETRY_AFTER_SECONDS), "Connection": "close"}
+        )
@@ -1,23 +1,37 @@
-from fastapi import APIRouter, Depends, HTTPException
-from fastapi.responses import FileResponse
-from sqlalchemy.orm import Session
-from docx import Document
-from docx.shared import Pt, Inches, RGBColor
-from docx.enum.text import WD_ALIGN_PARAGRAPH, WD_LINE_SPACING
-from docx.enum.style import WD_STYLE_TYPE
-from pptx import Presentation
-from pptx.util import Pt as PPTXPt, Inches as PPTXInches
-from pptx.enum.text import PP_ALIGN, MSO_ANCHOR
-from pptx.dml.color import RGBColor as PPTXRGBColor
-from io import BytesIO
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import FileResponse, StreamingResponse
+from sqlalchemy.orm import Session, undefer
+from typing import List, Optional
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import io
 import os
 import re
+import zipfile
+from urllib.parse import quote
 from datetime import datetime
 
-from database import get_db, User, Project, DocumentSection
+from database import SessionLocal, User, Project, DocumentSection
+from profiling import TimedRoute, phase
+from replicas import get_read_db
 from auth import get_current_user
+from draining import accepting_work
 
-router = APIRouter()
+router = APIRouter(route_class=TimedRoute)
+
+# Documents rendered at once by a bulk export. Each holds one rendered file
+# in memory until it is written to the archive, so this bounds its memory.
+EXPORT_WORKERS = int(os.getenv("EXPORT_WORKERS", "4"))
+# "stream" writes single downloads part by part instead of building them with
+# python-docx/python-pptx first, see ooxml.py. Can be overridden per request.
+EXPORT_ENGINE = os.getenv("EXPORT_ENGINE", "library")
+
+MEDIA_TYPES = {
+    "docx": "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+    "pptx": "application/vnd.openxmlformats-officedocument.presentationml.presentation"
+}
+
+# python-docx and python-pptx (and their enum trees) are imported inside the
+# render functions so workers that never export do not pay for them at startup
 
 def format_paragraph_text(text):
     """Clean and format text, preserving structure"""
@@ -27,8 +41,48 @@ def format_paragraph_text(text):
     text = re.sub(r'\n\s*[-•*]\s*', '\n• ', text)
     return text.strip()
 
+def content_blocks(content):
+    """Split section content the way Word exports lay it out.
+
+    Returns (has_bullets, blocks): bullet items when the content has bullet
+    markers, paragraphs otherwise. Shared with the preview renderer.
+    """
+    content_text = format_paragraph_text(content)
+    
+    # Check if content has bullet points
+    has_bullets = bool('•' in content_text or re.search(r'^\s*[-*]\s', content_text, re.MULTILINE))
+    
+    blocks = []
+    if has_bullets:
+        for line in re.split(r'\n\s*[-•*]\s*', content_text):
+            line = line.strip()
+            if line:
+                # Remove leading bullet if present
+                blocks.append(re.sub(r'^[-•*]\s*', '', line))
+    else:
+        for para_text in content_text.split('\n\n'):
+            para_text = para_text.strip()
+            if para_text:
+                blocks.append(para_text)
+    return has_bullets, blocks
+
+def slide_lines(content):
+    """Split section content into the body lines of a slide, as (has_bullets, lines)"""
+    content_text = format_paragraph_text(content)
+    has_bullets = bool('•' in content_text or re.search(r'^\s*[-*]\s', content_text, re.MULTILINE))
+    lines = []
+    for line in re.split(r'\n+', content_text):
+        line = line.strip()
+        if line:
+            # Remove bullet markers
+            lines.append(re.sub(r'^[-•*]\s*', '', line))
+    return has_bullets, lines
+
 def add_formatted_content_to_paragraph(para, text, is_bullet=False):
     """Add formatted content to a paragraph with proper styling"""
+    from docx.shared import Pt, RGBColor
+    from docx.enum.text import WD_LINE_SPACING
+    
     if is_bullet:
         para.style = 'List Bullet'
     else:
@@ -59,22 +113,272 @@ def add_formatted_content_to_paragraph(para, text, is_bullet=False):
         run.font.name = 'Calibri'
         run.font.color.rgb = RGBColor(33, 33, 33)
 
-@router.get("/{project_id}/download")
+def render_docx(project, db_sections, fileobj):
+    """Write a project as a formatted Word document to a path or file object"""
+    from docx import Document
+    from docx.shared import Pt, Inches, RGBColor
+    from docx.enum.text import WD_ALIGN_PARAGRAPH, WD_LINE_SPACING
+    
+    # Create Word document with professional formatting
+    doc = Document()
+    
+    # Set document margins
+    doc_sections = doc.sections
+    for section in doc_sections:
+        section.top_margin = Inches(1)
+        section.bottom_margin = Inches(1)
+        section.left_margin = Inches(1)
+        section.right_margin = Inches(1)
+    
+    # Add title page
+    title_para = doc.add_paragraph()
+    title_run = title_para.add_run(project.title if project.title != "Untitled Project" else project.topic)
+    title_run.font.size = Pt(28)
+    title_run.font.bold = True
+    title_run.font.name = 'Calibri Light'
+    title_run.font.color.rgb = RGBColor(31, 78, 121)
+    title_para.alignment = WD_ALIGN_PARAGRAPH.CENTER
+    title_para_format = title_para.paragraph_format
+    title_para_format.space_after = Pt(12)
+    
+    # Add subtitle (topic)
+    if project.title != "Untitled Project":
+        subtitle_para = doc.add_paragraph()
+        subtitle_run = subtitle_para.add_run(project.topic)
+        subtitle_run.font.size = Pt(14)
+        subtitle_run.font.italic = True
+        subtitle_run.font.name = 'Calibri'
+        subtitle_run.font.color.rgb = RGBColor(100, 100, 100)
+        subtitle_para.alignment = WD_ALIGN_PARAGRAPH.CENTER
+        subtitle_para_format = subtitle_para.paragraph_format
+        subtitle_para_format.space_after = Pt(24)
+    
+    # Add date
+    date_para = doc.add_paragraph()
+    date_run = date_para.add_run(f"Generated on {datetime.now().strftime('%B %d, %Y')}")
+    date_run.font.size = Pt(10)
+    date_run.font.name = 'Calibri'
+    date_run.font.color.rgb = RGBColor(128, 128, 128)
+    date_para.alignment = WD_ALIGN_PARAGRAPH.CENTER
+    date_para_format = date_para.paragraph_format
+    date_para_format.space_after = Pt(24)
+    
+    # Page break after title
+    doc.add_page_break()
+    
+    # Add table of contents header
+    toc_para = doc.add_heading('Table of Contents', level=1)
+    toc_para_format = toc_para.paragraph_format
+    toc_para_format.space_before = Pt(0)
+    toc_para_format.space_after = Pt(12)
+    
+    # Add table of contents
+    for idx, db_section in enumerate(db_sections, 1):
+        toc_item = doc.add_paragraph(f"{idx}. {db_section.title}", style='List Number')
+        toc_item_format = toc_item.paragraph_format
+        toc_item_format.left_indent = Inches(0.25)
+        toc_item_format.space_after = Pt(6)
+    
+    doc.add_page_break()
+    
+    # Add content sections
+    for idx, db_section in enumerate(db_sections, 1):
+        # Section heading
+        heading = doc.add_heading(f"{idx}. {db_section.title}", level=1)
+        heading_format = heading.paragraph_format
+        heading_format.space_before = Pt(18)
+        heading_format.space_after = Pt(12)
+        
+        # Format heading runs
+        for run in heading.runs:
+            run.font.size = Pt(18)
+            run.font.bold = True
+            run.font.name = 'Calibri'
+            run.font.color.rgb = RGBColor(31, 78, 121)
+        
+        # Add content
+        if db_section.content:
+            has_bullets, blocks = content_blocks(db_section.content)
+            
+            if has_bullets:
+                # Handle bullet points
+                for line in blocks:
+                    para = doc.add_paragraph(line, style='List Bullet')
+                    para_format = para.paragraph_format
+                    para_format.line_spacing_rule = WD_LINE_SPACING.MULTIPLE
+                    para_format.line_spacing = 1.15
+                    para_format.left_indent = Inches(0.5)
+                    para_format.space_after = Pt(6)
+                    
+                    for run in para.runs:
+                        run.font.size = Pt(11)
+                        run.font.name = 'Calibri'
+            else:
+                # Regular paragraphs
+                for para_text in blocks:
+                    para = doc.add_paragraph(para_text)
+                    para_format = para.paragraph_format
+                    para_format.line_spacing_rule = WD_LINE_SPACING.MULTIPLE
+                    para_format.line_spacing = 1.15
+                    para_format.first_line_indent = Inches(0.25)
+                    para_format.space_after = Pt(12)
+                    
+                    for run in para.runs:
+                        run.font.size = Pt(11)
+                        run.font.name = 'Calibri'
+                        run.font.color.rgb = RGBColor(33, 33, 33)
+        
+        # Add spacing between sections
+        if idx < len(db_sections):
+            doc.add_paragraph()
+    
+    # Add footer with page numbers
+    section = doc.sections[0]
+    footer = section.footer
+    footer_para = footer.paragraphs[0]
+    footer_para.alignment = WD_ALIGN_PARAGRAPH.CENTER
+    footer_run = footer_para.add_run()
+    footer_run.font.size = Pt(9)
+    footer_run.font.name = 'Calibri'
+    footer_run.font.color.rgb = RGBColor(128, 128, 128)
+    # Note: python-docx doesn't support page numbers directly, but this structure is ready
+    
+    doc.save(fileobj)
+
+def render_pptx(project, db_sections, fileobj):
+    """Write a project as a formatted PowerPoint presentation to a path or file object"""
+    from pptx import Presentation
+    from pptx.util import Pt as PPTXPt, Inches as PPTXInches
+    from pptx.enum.text import PP_ALIGN, MSO_ANCHOR
+    from pptx.dml.color import RGBColor as PPTXRGBColor
+    
+    # Create PowerPoint presentation with professional formatting
+    prs = Presentation()
+    prs.slide_width = PPTXInches(10)
+    prs.slide_height = PPTXInches(7.5)
+    
+    # Title slide
+    title_slide_layout = prs.slide_layouts[0]
+    slide = prs.slides.add_slide(title_slide_layout)
+    
+    # Title
+    title_shape = slide.shapes.title
+    title_shape.text = project.title if project.title != "Untitled Project" else project.topic
+    title_frame = title_shape.text_frame
+    title_frame.vertical_anchor = MSO_ANCHOR.MIDDLE
+    
+    # Format title
+    for paragraph in title_frame.paragraphs:
+        paragraph.font.size = PPTXPt(44)
+        paragraph.font.bold = True
+        paragraph.font.name = 'Calibri'
+        paragraph.font.color.rgb = PPTXRGBColor(31, 78, 121)
+        paragraph.alignment = PP_ALIGN.CENTER
+    
+    # Subtitle
+    if len(slide.placeholders) > 1:
+        subtitle = slide.placeholders[1]
+        subtitle.text = project.topic if project.title != "Untitled Project" else f"Generated on {datetime.now().strftime('%B %d, %Y')}"
+        subtitle_frame = subtitle.text_frame
+        
+        for paragraph in subtitle_frame.paragraphs:
+            paragraph.font.size = PPTXPt(18)
+            paragraph.font.name = 'Calibri'
+            paragraph.font.color.rgb = PPTXRGBColor(100, 100, 100)
+            paragraph.alignment = PP_ALIGN.CENTER
+    
+    # Content slides
+    content_layout = prs.slide_layouts[1]
+    
+    for idx, db_section in enumerate(db_sections, 1):
+        slide = prs.slides.add_slide(content_layout)
+        
+        # Slide title
+        title_shape = slide.shapes.title
+        title_shape.text = f"Slide {idx}: {db_section.title}"
+        title_frame = title_shape.text_frame
+        
+        for paragraph in title_frame.paragraphs:
+            paragraph.font.size = PPTXPt(32)
+            paragraph.font.bold = True
+            paragraph.font.name = 'Calibri'
+            paragraph.font.color.rgb = PPTXRGBColor(31, 78, 121)
+        
+        # Content
+        if len(slide.placeholders) > 1:
+            content_shape = slide.placeholders[1]
+            text_frame = content_shape.text_frame
+            text_frame.word_wrap = True
+            text_frame.margin_left = PPTXInches(0.5)
+            text_frame.margin_right = PPTXInches(0.5)
+            text_frame.margin_top = PPTXInches(0.5)
+            text_frame.margin_bottom = PPTXInches(0.5)
+            
+            if db_section.content:
+                has_bullets, lines = slide_lines(db_section.content)
+                first_line = True
+                
+                for line in lines:
+                    if first_line:
+                        p = text_frame.paragraphs[0]
+                        p.text = line
+                        p.font.size = PPTXPt(18)
+                        p.font.name = 'Calibri'
+                        p.level = 0
+                        if has_bullets:
+                            p.font.bold = True
+                        first_line = False
+                    else:
+                        p = text_frame.add_paragraph()
+                        p.text = line
+                        p.font.size = PPTXPt(16) if has_bullets else PPTXPt(18)
+                        p.font.name = 'Calibri'
+                        p.level = 0
+                        if has_bullets:
+                            p.font.bold = True
+    
+    prs.save(fileobj)
+
+@router.get("/{project_id}/download", dependencies=[Depends(accepting_work)])
 async def export_document(
     project_id: int,
+    engine: Optional[str] = Query(None, pattern="^(library|stream)$"),
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db)
 ):
     project = db.query(Project).filter(
         Project.id == project_id,
-        Project.user_id == current_user.id
+        Project.user_id == current_user.id,
+        Project.deleted_at.is_(None)
     ).first()
     
     if not project:
         raise HTTPException(status_code=404, detail="Project not found")
     
+    if (engine or EXPORT_ENGINE) == "stream":
+        has_sections = db.query(DocumentSection.id).filter(
+            DocumentSection.project_id == project.id
+        ).first()
+        if not has_sections:
+            raise HTTPException(status_code=400, detail="No content to export")
+        
+        # Imported here because ooxml builds its templates with this module's renderers
+        from ooxml import stream_document
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        filename = f"{project.title.replace(' ', '_')}_{timestamp}.{project.document_type}"
+        # Same header FileResponse sends, titles may hold characters a plain filename cannot
+        quoted = quote(filename)
+        disposition = f'attachment; filename="{filename}"' if quoted == filename else f"attachment; filename*=utf-8''{quoted}"
+        return StreamingResponse(
+            stream_document(project.id, db.get_bind()),
+            media_type=MEDIA_TYPES[project.document_type],
+            headers={"Content-Disposition": disposition}
+        )
+    
     db_sections = sorted(
-        db.query(DocumentSection).filter(DocumentSection.project_id == project.id).all(),
+        db.query(DocumentSection).options(undefer(DocumentSection.content)).filter(
+            DocumentSection.project_id == project.id
+        ).all(),
         key=lambda x: x.section_index
     )
     
@@ -89,143 +393,9 @@ async def export_document(
     filename = f"{project.title.replace(' ', '_')}_{timestamp}"
     
     if project.document_type == "docx":
-        # Create Word document with professional formatting
-        doc = Document()
-        
-        # Set document margins
-        doc_sections = doc.sections
-        for section in doc_sections:
-            section.top_margin = Inches(1)
-            section.bottom_margin = Inches(1)
-            section.left_margin = Inches(1)
-            section.right_margin = Inches(1)
-        
-        # Add title page
-        title_para = doc.add_paragraph()
-        title_run = title_para.add_run(project.title if project.title != "Untitled Project" else project.topic)
-        title_run.font.size = Pt(28)
-        title_run.font.bold = True
-        title_run.font.name = 'Calibri Light'
-        title_run.font.color.rgb = RGBColor(31, 78, 121)
-        title_para.alignment = WD_ALIGN_PARAGRAPH.CENTER
-        title_para_format = title_para.paragraph_format
-        title_para_format.space_after = Pt(12)
-        
-        # Add subtitle (topic)
-        if project.title != "Untitled Project":
-            subtitle_para = doc.add_paragraph()
-            subtitle_run = subtitle_para.add_run(project.topic)
-            subtitle_run.font.size = Pt(14)
-            subtitle_run.font.italic = True
-            subtitle_run.font.name = 'Calibri'
-            subtitle_run.font.color.rgb = RGBColor(100, 100, 100)
-            subtitle_para.alignment = WD_ALIGN_PARAGRAPH.CENTER
-            subtitle_para_format = subtitle_para.paragraph_format
-            subtitle_para_format.space_after = Pt(24)
-        
-        # Add date
-        date_para = doc.add_paragraph()
-        date_run = date_para.add_run(f"Generated on {datetime.now().strftime('%B %d, %Y')}")
-        date_run.font.size = Pt(10)
-        date_run.font.name = 'Calibri'
-        date_run.font.color.rgb = RGBColor(128, 128, 128)
-        date_para.alignment = WD_ALIGN_PARAGRAPH.CENTER
-        date_para_format = date_para.paragraph_format
-        date_para_format.space_after = Pt(24)
-        
-        # Page break after title
-        doc.add_page_break()
-        
-        # Add table of contents header
-        toc_para = doc.add_heading('Table of Contents', level=1)
-        toc_para_format = toc_para.paragraph_format
-        toc_para_format.space_before = Pt(0)
-        toc_para_format.space_after = Pt(12)
-        
-        # Add table of contents
-        for idx, db_section in enumerate(db_sections, 1):
-            toc_item = doc.add_paragraph(f"{idx}. {db_section.title}", style='List Number')
-            toc_item_format = toc_item.paragraph_format
-            toc_item_format.left_indent = Inches(0.25)
-            toc_item_format.space_after = Pt(6)
-        
-        doc.add_page_break()
-        
-        # Add content sections
-        for idx, db_section in enumerate(db_sections, 1):
-            # Section heading
-            heading = doc.add_heading(f"{idx}. {db_section.title}", level=1)
-            heading_format = heading.paragraph_format
-            heading_format.space_before = Pt(18)
-            heading_format.space_after = Pt(12)
-            
-            # Format heading runs
-            for run in heading.runs:
-                run.font.size = Pt(18)
-                run.font.bold = True
-                run.font.name = 'Calibri'
-                run.font.color.rgb = RGBColor(31, 78, 121)
-            
-            # Add content
-            if db_section.content:
-                content_text = format_paragraph_text(db_section.content)
-                
-                # Check if content has bullet points
-                has_bullets = '•' in content_text or re.search(r'^\s*[-*]\s', content_text, re.MULTILINE)
-                
-                if has_bullets:
-                    # Handle bullet points
-                    lines = re.split(r'\n\s*[-•*]\s*', content_text)
-                    for line in lines:
-                        line = line.strip()
-                        if line:
-                            # Remove leading bullet if present
-                            line = re.sub(r'^[-•*]\s*', '', line)
-                            para = doc.add_paragraph(line, style='List Bullet')
-                            para_format = para.paragraph_format
-                            para_format.line_spacing_rule = WD_LINE_SPACING.MULTIPLE
-                            para_format.line_spacing = 1.15
-                            para_format.left_indent = Inches(0.5)
-                            para_format.space_after = Pt(6)
-                            
-                            for run in para.runs:
-                                run.font.size = Pt(11)
-                                run.font.name = 'Calibri'
-                else:
-                    # Regular paragraphs
-                    paragraphs = content_text.split('\n\n')
-                    for para_text in paragraphs:
-                        para_text = para_text.strip()
-                        if para_text:
-                            para = doc.add_paragraph(para_text)
-                            para_format = para.paragraph_format
-                            para_format.line_spacing_rule = WD_LINE_SPACING.MULTIPLE
-                            para_format.line_spacing = 1.15
-                            para_format.first_line_indent = Inches(0.25)
-                            para_format.space_after = Pt(12)
-                            
-                            for run in para.runs:
-                                run.font.size = Pt(11)
-                                run.font.name = 'Calibri'
-                                run.font.color.rgb = RGBColor(33, 33, 33)
-            
-            # Add spacing between sections
-            if idx < len(db_sections):
-                doc.add_paragraph()
-        
-        # Add footer with page numbers
-        section = doc.sections[0]
-        footer = section.footer
-        footer_para = footer.paragraphs[0]
-        footer_para.alignment = WD_ALIGN_PARAGRAPH.CENTER
-        footer_run = footer_para.add_run()
-        footer_run.font.size = Pt(9)
-        footer_run.font.name = 'Calibri'
-        footer_run.font.color.rgb = RGBColor(128, 128, 128)
-        # Note: python-docx doesn't support page numbers directly, but this structure is ready
-        
         filepath = os.path.join(temp_dir, f"{filename}.docx")
-        doc.save(filepath)
+        with phase("render"):
+            render_docx(project, db_sections, filepath)
         
         return FileResponse(
             filepath,
@@ -234,108 +404,148 @@ async def export_document(
         )
     
     else:  # pptx
-        # Create PowerPoint presentation with professional formatting
-        prs = Presentation()
-        prs.slide_width = PPTXInches(10)
-        prs.slide_height = PPTXInches(7.5)
-        
-        # Title slide
-        title_slide_layout = prs.slide_layouts[0]
-        slide = prs.slides.add_slide(title_slide_layout)
-        
-        # Title
-        title_shape = slide.shapes.title
-        title_shape.text = project.title if project.title != "Untitled Project" else project.topic
-        title_frame = title_shape.text_frame
-        title_frame.vertical_anchor = MSO_ANCHOR.MIDDLE
-        
-        # Format title
-        for paragraph in title_frame.paragraphs:
-            paragraph.font.size = PPTXPt(44)
-            paragraph.font.bold = True
-            paragraph.font.name = 'Calibri'
-            paragraph.font.color.rgb = PPTXRGBColor(31, 78, 121)
-            paragraph.alignment = PP_ALIGN.CENTER
-        
-        # Subtitle
-        if len(slide.placeholders) > 1:
-            subtitle = slide.placeholders[1]
-            subtitle.text = project.topic if project.title != "Untitled Project" else f"Generated on {datetime.now().strftime('%B %d, %Y')}"
-            subtitle_frame = subtitle.text_frame
-            
-            for paragraph in subtitle_frame.paragraphs:
-                paragraph.font.size = PPTXPt(18)
-                paragraph.font.name = 'Calibri'
-                paragraph.font.color.rgb = PPTXRGBColor(100, 100, 100)
-                paragraph.alignment = PP_ALIGN.CENTER
-        
-        # Content slides
-        content_layout = prs.slide_layouts[1]
-        
-        for idx, db_section in enumerate(db_sections, 1):
-            slide = prs.slides.add_slide(content_layout)
-            
-            # Slide title
-            title_shape = slide.shapes.title
-            title_shape.text = f"Slide {idx}: {db_section.title}"
-            title_frame = title_shape.text_frame
-            
-            for paragraph in title_frame.paragraphs:
-                paragraph.font.size = PPTXPt(32)
-                paragraph.font.bold = True
-                paragraph.font.name = 'Calibri'
-                paragraph.font.color.rgb = PPTXRGBColor(31, 78, 121)
-            
-            # Content
-            if len(slide.placeholders) > 1:
-                content_shape = slide.placeholders[1]
-                text_frame = content_shape.text_frame
-                text_frame.word_wrap = True
-                text_frame.margin_left = PPTXInches(0.5)
-                text_frame.margin_right = PPTXInches(0.5)
-                text_frame.margin_top = PPTXInches(0.5)
-                text_frame.margin_bottom = PPTXInches(0.5)
-                
-                if db_section.content:
-                    content_text = format_paragraph_text(db_section.content)
-                    
-                    # Check for bullet points
-                    has_bullets = '•' in content_text or re.search(r'^\s*[-*]\s', content_text, re.MULTILINE)
-                    
-                    lines = re.split(r'\n+', content_text)
-                    first_line = True
-                    
-                    for line in lines:
-                        line = line.strip()
-                        if not line:
-                            continue
-                        
-                        # Remove bullet markers
-                        line = re.sub(r'^[-•*]\s*', '', line)
-                        
-                        if first_line:
-                            p = text_frame.paragraphs[0]
-                            p.text = line
-                            p.font.size = PPTXPt(18)
-                            p.font.name = 'Calibri'
-                            p.level = 0
-                            if has_bullets:
-                                p.font.bold = True
-                            first_line = False
-                        else:
-                            p = text_frame.add_paragraph()
-                            p.text = line
-                            p.font.size = PPTXPt(16) if has_bullets else PPTXPt(18)
-                            p.font.name = 'Calibri'
-                            p.level = 0
-                            if has_bullets:
-                                p.font.bold = True
-        
         filepath = os.path.join(temp_dir, f"{filename}.pptx")
-        prs.save(filepath)
+        with phase("render"):
+            render_pptx(project, db_sections, filepath)
         
         return FileResponse(
             filepath,
             media_type="application/vnd.openxmlformats-officedocument.presentationml.presentation",
             filename=f"{filename}.pptx"
         )
+
+class _ZipStream(io.RawIOBase):
+    """Write-only sink for ZipFile that hands out what was written so far.
+
+    It has no tell() or seek(), so ZipFile writes a data descriptor after each
+    entry instead of seeking back to patch the local header, which is what lets
+    the archive go out over the wire while it is being built.
+    """
+
+    def __init__(self):
+        self._chunks = []
+        self.buffered = 0  # Bytes written since the last drain()
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self.buffered += len(data)
+        return len(data)
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks = []
+        self.buffered = 0
+        return data
+
+def archive_name(title: str, project_id: int, document_type: str) -> str:
+    safe = re.sub(r"[^\w\- ]+", "", title).strip().replace(" ", "_")[:80] or "project"
+    return f"{safe}_{project_id}.{document_type}"
+
+def render_project(project_id: int, bind) -> bytes:
+    """Render one project from its own session on bind, for use in the export pool"""
+    db = SessionLocal(bind=bind)
+    try:
+        project = db.query(Project.title, Project.topic, Project.document_type).filter(
+            Project.id == project_id
+        ).one()
+        db_sections = db.query(DocumentSection.title, DocumentSection.content).filter(
+            DocumentSection.project_id == project_id
+        ).order_by(DocumentSection.section_index).all()
+    finally:
+        db.close()
+    
+    buffer = io.BytesIO()
+    if project.document_type == "docx":
+        render_docx(project, db_sections, buffer)
+    else:
+        render_pptx(project, db_sections, buffer)
+    return buffer.getvalue()
+
+def stream_archive(projects, bind):
+    """Yield a ZIP of the given (id, title, document_type) projects as documents finish rendering.
+
+    Documents are read through bind, the engine the request's own reads went to.
+    """
+    sink = _ZipStream()
+    archive = zipfile.ZipFile(sink, "w", compression=zipfile.ZIP_STORED)
+    pending = {}
+    todo = iter(projects)
+    failed = []
+    executor = ThreadPoolExecutor(max_workers=EXPORT_WORKERS, thread_name_prefix="export")
+    
+    def submit_next():
+        project = next(todo, None)
+        if project is not None:
+            pending[executor.submit(render_project, project.id, bind)] = project
+    
+    try:
+        for _ in range(EXPORT_WORKERS):
+            submit_next()
+        
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                project = pending.pop(future)
+                submit_next()
+                try:
+                    data = future.result()
+                except Exception as e:
+                    print(f"Error exporting project {project.id}: {str(e)}")
+                    failed.append(f"{project.title} (id {project.id}): {str(e)}")
+                    continue
+                
+                # OOXML files are already deflated, storing them again is free
+                info = zipfile.ZipInfo(
+                    archive_name(project.title, project.id, project.document_type),
+                    date_time=datetime.now().timetuple()[:6]
+                )
+                archive.writestr(info, data)
+                yield sink.drain()
+        
+        if failed:
+            archive.writestr("export_errors.txt", "\n".join(failed) + "\n")
+        archive.close()
+        yield sink.drain()
+    finally:
+        # Also reached when the client disconnects mid-download
+        for future in pending:
+            future.cancel()
+        executor.shutdown(wait=False)
+
+@router.get("/bulk", dependencies=[Depends(accepting_work)])
+async def export_bulk(
+    project_ids: Optional[List[int]] = Query(None, description="Projects to export, all of the user's projects if omitted"),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_read_db)
+):
+    """Stream a ZIP with the DOCX/PPTX of several projects"""
+    query = db.query(Project.id, Project.title, Project.document_type).filter(
+        Project.user_id == current_user.id,
+        Project.deleted_at.is_(None)
+    )
+    if project_ids:
+        query = query.filter(Project.id.in_(project_ids))
+    projects = query.order_by(Project.id).all()
+    
+    if project_ids and len(projects) != len(set(project_ids)):
+        raise HTTPException(status_code=404, detail="Project not found")
+    
+    with_content = {
+        pid for (pid,) in db.query(DocumentSection.project_id).filter(
+            DocumentSection.project_id.in_([p.id for p in projects])
+        ).distinct()
+    } if projects else set()
+    projects = [p for p in projects if p.id in with_content]
+    
+    if not projects:
+        raise HTTPException(status_code=400, detail="No content to export")
+    
+    filename = f"documents_{datetime.now().strftime('%Y%m%d_%H%M%S')}.zip"
+    return StreamingResponse(
+        stream_archive(projects, db.get_bind()),
+        media_type="application/zip",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
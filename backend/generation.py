@@ -1,20 +1,51 @@
-import google.generativeai as genai
+import asyncio
+import hashlib
+import json
 import os
-from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks, Query
+from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks, Query, Request
 from sqlalchemy.orm import Session
 from pydantic import BaseModel
 from typing import List, Optional
-from datetime import datetime
+from datetime import datetime, timedelta
 
-from database import get_db, User, Project, DocumentStructure, DocumentSection
+from sqlalchemy.exc import IntegrityError
+from database import get_db, SessionLocal, User, Project, DocumentStructure, DocumentSection, GenerationCheckpoint
+from profiling import TimedRoute
 from auth import get_current_user
+from revisions import record_revision, WRITE_CONFLICTS, CONFLICT_DETAIL
+from singleflight import model_calls, cross_process_lock
+from cancellation import cancel_scope, cancel_project, GenerationCancelled, REASON_SHUTDOWN, REASON_BUDGET, RETRY_AFTER_SECONDS
+from draining import drain, accepting_work
+from scheduler import call_model, model_scheduler, INTERACTIVE, TEMPLATE, BULK
+from outline_cache import outline_cache
+from idempotency import idempotency_keys
+from token_budget import count_tokens, check_user_budget, within_user_budget, record_generation_usage
 
-router = APIRouter()
+router = APIRouter(route_class=TimedRoute)
 
 # Initialize Gemini API - load from environment
 # Note: load_dotenv() is called in main.py before this module is imported
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 
+GEMINI_MODEL = 'gemini-2.5-flash'
+GEMINI_FALLBACK_MODEL = 'gemini-1.5-flash'
+
+# Bump whenever build_prompt changes so previously generated sections count as stale
+PROMPT_TEMPLATE_VERSION = 1
+
+# A /generate run repeated within this long of stopping early only generates
+# the sections the stopped run did not get to
+RESUME_WINDOW_MINUTES = float(os.getenv("RESUME_WINDOW_MINUTES", "60"))
+
+def get_genai():
+    """Import the Gemini SDK on first use.
+
+    google.generativeai pulls in gRPC and protobuf and is the slowest import in
+    the app, so workers that only serve auth and CRUD never load it.
+    """
+    import google.generativeai as genai
+    return genai
+
 def get_gemini_api_key():
     """Get Gemini API key, loading from .env if needed"""
     # Reload .env to ensure we have the latest values
@@ -27,34 +58,41 @@ def get_gemini_api_key():
     if key:
         key = key.strip().strip("'").strip('"')
         if key:
-            genai.configure(api_key=key)
+            get_genai().configure(api_key=key)
     return key if key else None
 
 class GenerateRequest(BaseModel):
     project_id: int
     section_indices: Optional[List[int]] = None  # If None, generate all
+    only_stale: bool = False  # Skip sections whose generation inputs are unchanged
 
 class GenerationResponse(BaseModel):
     message: str
     sections_generated: List[int]
+    sections_skipped: List[int] = []
+    sections_conflicted: List[int] = []  # Edited while being generated, the edit was kept
+    cancelled: bool = False  # Stopped early by a disconnect, an explicit cancel or a shutdown
+    sections_pending: List[int] = []  # Left for a retry of the same request, which resumes the run
+    resumed: bool = False  # Continued a run that stopped early instead of starting over
 
-def generate_content_with_gemini(topic: str, section_title: str, document_type: str, existing_content: str = None) -> str:
-    """Generate content using Gemini API"""
-    try:
-        # Ensure API key is configured
-        api_key = get_gemini_api_key()
-        if not api_key:
-            raise Exception("Gemini API key not configured")
-        
-        # Try gemini-2.5-flash, fallback to gemini-1.5-flash if not available
-        try:
-            model = genai.GenerativeModel('gemini-2.5-flash')
-        except Exception:
-            # Fallback to a known working model
-            model = genai.GenerativeModel('gemini-1.5-flash')
-        
-        if existing_content:
-            prompt = f"""Given the topic: "{topic}"
+def build_prompt(topic: str, section_title: str, document_type: str, existing_content: str = None, omitted_tokens: int = 0) -> str:
+    """Build the Gemini prompt for generating or refining a section.
+
+    omitted_tokens is set when existing_content is only the end of a longer
+    section; the model is told so and refines just that part.
+    """
+    if existing_content and omitted_tokens:
+        return f"""Given the topic: "{topic}"
+
+Section/Slide Title: "{section_title}"
+
+Existing content (only the final part of this section; about {omitted_tokens} tokens of earlier text are not shown and will be kept unchanged before it):
+{existing_content}
+
+Please refine or expand this final part while maintaining relevance to the section title and overall topic. Return only the replacement for the part shown, continuing from the earlier text, without repeating or summarising it.
+"""
+    if existing_content:
+        return f"""Given the topic: "{topic}"
 
 Section/Slide Title: "{section_title}"
 
@@ -63,19 +101,48 @@ Existing content:
 
 Please refine or expand this content while maintaining relevance to the section title and overall topic.
 """
-        else:
-            if document_type == "docx":
-                prompt = f"""Write a detailed section for a document with the topic: "{topic}"
+    if document_type == "docx":
+        return f"""Write a detailed section for a document with the topic: "{topic}"
 
 Section Title: "{section_title}"
 
 Write comprehensive content (approximately 300-500 words) for this section. The content should be well-structured, informative, and relevant to the overall topic."""
-            else:  # pptx
-                prompt = f"""Create content for a PowerPoint slide with the topic: "{topic}"
+    # pptx
+    return f"""Create content for a PowerPoint slide with the topic: "{topic}"
 
 Slide Title: "{section_title}"
 
 Write concise, presentation-ready content for this slide (approximately 100-200 words). Format it with bullet points where appropriate. Keep it clear and engaging for a presentation."""
+
+def generation_fingerprint(topic: str, section_title: str, document_type: str) -> str:
+    """Fingerprint of everything that determines a freshly generated section"""
+    inputs = {
+        "topic": topic,
+        "title": section_title,
+        "document_type": document_type,
+        "template_version": PROMPT_TEMPLATE_VERSION,
+        "model": GEMINI_MODEL
+    }
+    return hashlib.sha256(json.dumps(inputs, sort_keys=True).encode("utf-8")).hexdigest()
+
+def generate_content_with_gemini(topic: str, section_title: str, document_type: str, existing_content: str = None, omitted_tokens: int = 0) -> str:
+    """Generate content using Gemini API"""
+    try:
+        # Ensure API key is configured
+        api_key = get_gemini_api_key()
+        if not api_key:
+            raise Exception("Gemini API key not configured")
+        
+        genai = get_genai()
+        
+        # Try gemini-2.5-flash, fallback to gemini-1.5-flash if not available
+        try:
+            model = genai.GenerativeModel(GEMINI_MODEL)
+        except Exception:
+            # Fallback to a known working model
+            model = genai.GenerativeModel(GEMINI_FALLBACK_MODEL)
+        
+        prompt = build_prompt(topic, section_title, document_type, existing_content, omitted_tokens)
         
         print(f"Calling Gemini API with prompt length: {len(prompt)}")
         response = model.generate_content(prompt)
@@ -91,8 +158,9 @@ Write concise, presentation-ready content for this slide (approximately 100-200
         print(traceback.format_exc())
         raise Exception(f"Error generating content with Gemini: {str(e)}")
 
-@router.post("/generate-section")
+@router.post("/generate-section", dependencies=[Depends(accepting_work)])
 async def generate_single_section(
+    http_request: Request,
     project_id: int = Query(..., description="Project ID"),
     section_index: int = Query(..., description="Section index"),
     current_user: User = Depends(get_current_user),
@@ -105,7 +173,8 @@ async def generate_single_section(
     
     project = db.query(Project).filter(
         Project.id == project_id,
-        Project.user_id == current_user.id
+        Project.user_id == current_user.id,
+        Project.deleted_at.is_(None)
     ).first()
     
     if not project:
@@ -119,17 +188,78 @@ async def generate_single_section(
     if section_index >= len(structure_data):
         raise HTTPException(status_code=400, detail=f"Section index {section_index} out of range")
     
-    section_title = structure_data[section_index]
+    # Double clicks, retries and other tabs asking for the same section share
+    # one model call instead of each paying for their own
+    requested_at = datetime.utcnow()
     
-    # Check if section already exists
-    existing_section = db.query(DocumentSection).filter(
-        DocumentSection.project_id == project.id,
-        DocumentSection.section_index == section_index
-    ).first()
+    async def generate():
+        # Checked only when the request runs, so a replayed key is never refused
+        prompt = build_prompt(project.topic, structure_data[section_index], project.document_type)
+        check_user_budget(db, current_user.id, count_tokens(prompt))
+        
+        async with cancel_scope(http_request, project.id) as scope:
+            try:
+                return await scope.run(lambda: model_calls.do(
+                    ("section", project.id, section_index),
+                    lambda: run_section_generation(project.id, section_index, requested_at)
+                ))
+            except GenerationCancelled as e:
+                raise e.to_http()
     
+    # Retries sent with the same Idempotency-Key get the stored response
+    return await idempotency_keys.run(
+        http_request,
+        current_user.id,
+        {"project_id": project.id, "section_index": section_index},
+        generate
+    )
+
+async def run_section_generation(project_id: int, section_index: int, requested_at: datetime):
+    """Generate and store one section, once across all server processes.
+
+    Runs in its own session because coalesced callers may outlive the request
+    that started it. If another process generated the section while this one
+    waited for the lock, its result is returned without calling the model; if
+    it is still generating when the wait runs out, the answer is a 503.
+    """
+    db = SessionLocal()
+    try:
+        # Held in this session's transaction until generate_section commits
+        async with cross_process_lock(f"section:{project_id}:{section_index}", db=db) as acquired:
+            if not acquired:
+                raise HTTPException(
+                    status_code=503,
+                    detail="This section is still being generated by another request, please retry",
+                    headers={"Retry-After": str(RETRY_AFTER_SECONDS)}
+                )
+            project = db.query(Project).filter(Project.id == project_id).first()
+            section_title = project.structure.structure_data[section_index]
+            
+            existing_section = db.query(DocumentSection).filter(
+                DocumentSection.project_id == project.id,
+                DocumentSection.section_index == section_index
+            ).first()
+            
+            if existing_section and existing_section.content and existing_section.updated_at >= requested_at:
+                model_calls.reused_across_processes += 1
+                return {
+                    "success": True,
+                    "section_id": existing_section.id,
+                    "section_index": section_index,
+                    "content": existing_section.content
+                }
+            
+            return await generate_section(db, project, section_index, section_title, existing_section)
+    finally:
+        db.close()
+
+async def generate_section(db: Session, project: Project, section_index: int, section_title: str, existing_section: Optional[DocumentSection]):
     try:
         print(f"Generating content for section {section_index}: {section_title}")
-        content = generate_content_with_gemini(
+        content = await call_model(
+            INTERACTIVE,
+            project.user_id,
+            generate_content_with_gemini,
             project.topic,
             section_title,
             project.document_type
@@ -139,11 +269,22 @@ async def generate_single_section(
         if not content:
             raise HTTPException(status_code=500, detail="Empty response from AI")
         
+        fingerprint = generation_fingerprint(project.topic, section_title, project.document_type)
+        record_generation_usage(
+            db, project.user_id, project.id, "section",
+            count_tokens(build_prompt(project.topic, section_title, project.document_type)),
+            count_tokens(content)
+        )
+        
         if existing_section:
+            previous_content = existing_section.content
+            existing_section.title = section_title
             existing_section.content = content
+            existing_section.input_fingerprint = fingerprint
             existing_section.updated_at = datetime.utcnow()
             if not existing_section.generated_at:
                 existing_section.generated_at = datetime.utcnow()
+            record_revision(db, existing_section, content, previous_content)
             section_id = existing_section.id
         else:
             db_section = DocumentSection(
@@ -151,10 +292,12 @@ async def generate_single_section(
                 section_index=section_index,
                 title=section_title,
                 content=content,
+                input_fingerprint=fingerprint,
                 generated_at=datetime.utcnow()
             )
             db.add(db_section)
             db.flush()
+            record_revision(db, db_section, content)
             section_id = db_section.id
         
         db.commit()
@@ -165,6 +308,10 @@ async def generate_single_section(
             "section_index": section_index,
             "content": content
         }
+    except WRITE_CONFLICTS:
+        # Edited while the model ran: the edit wins, the client can regenerate
+        db.rollback()
+        raise HTTPException(status_code=409, detail=CONFLICT_DETAIL)
     except Exception as e:
         import traceback
         error_msg = str(e)
@@ -173,9 +320,10 @@ async def generate_single_section(
         db.rollback()
         raise HTTPException(status_code=500, detail=f"Error generating section: {error_msg}")
 
-@router.post("/generate")
+@router.post("/generate", dependencies=[Depends(accepting_work)])
 async def generate_content(
     request: GenerateRequest,
+    http_request: Request,
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
@@ -185,7 +333,8 @@ async def generate_content(
     
     project = db.query(Project).filter(
         Project.id == request.project_id,
-        Project.user_id == current_user.id
+        Project.user_id == current_user.id,
+        Project.deleted_at.is_(None)
     ).first()
     
     if not project:
@@ -194,67 +343,184 @@ async def generate_content(
     if not project.structure:
         raise HTTPException(status_code=400, detail="Project structure not defined")
     
+    # Retries sent with the same Idempotency-Key get the stored response instead
+    # of generating again; cancelled runs are not stored so a retry resumes them
+    # from their checkpoint
+    return await idempotency_keys.run(
+        http_request,
+        current_user.id,
+        request.model_dump(),
+        lambda: generate_sections(request, http_request, project, current_user, db),
+        store=lambda result: not result["cancelled"]
+    )
+
+def resume_point(db: Session, project: Project, request: GenerateRequest) -> Optional[List[int]]:
+    """Sections left by the project's last run, if it was this request and stopped early recently"""
+    checkpoint = db.query(GenerationCheckpoint).filter(
+        GenerationCheckpoint.project_id == project.id
+    ).first()
+    if checkpoint is None:
+        return None
+    if checkpoint.section_indices != (request.section_indices or None) or checkpoint.only_stale != request.only_stale:
+        return None
+    if checkpoint.created_at < datetime.utcnow() - timedelta(minutes=RESUME_WINDOW_MINUTES):
+        return None
+    if project.structure.updated_at and project.structure.updated_at > checkpoint.created_at:
+        return None  # Outline edited since, what is left no longer means the same
+    return checkpoint.pending_indices
+
+def save_checkpoint(db: Session, project_id: int, request: GenerateRequest, pending: List[int], reason: Optional[str]):
+    """Record what a stopped run left, or clear the checkpoint once a run got to the end"""
+    db.query(GenerationCheckpoint).filter(GenerationCheckpoint.project_id == project_id).delete()
+    if pending:
+        db.add(GenerationCheckpoint(
+            project_id=project_id,
+            section_indices=request.section_indices or None,
+            only_stale=request.only_stale,
+            pending_indices=pending,
+            reason=reason
+        ))
+    try:
+        db.commit()
+    except IntegrityError:
+        # A concurrent run of the same project checkpointed first
+        db.rollback()
+
+async def generate_sections(request: GenerateRequest, http_request: Request, project: Project, current_user: User, db: Session):
+    """Generate the requested sections one at a time, committing each"""
     structure_data = project.structure.structure_data
     sections_to_generate = request.section_indices if request.section_indices else list(range(len(structure_data)))
     
+    # A retry of a run stopped by a shutdown, disconnect or cancel picks up where it stopped
+    pending = resume_point(db, project, request)
+    resumed = pending is not None
+    if resumed:
+        sections_to_generate = pending
+    
     generated_indices = []
+    skipped_indices = []
+    conflicted_indices = []
     
-    for idx in sections_to_generate:
-        if idx >= len(structure_data):
-            continue
-        
-        section_title = structure_data[idx]
-        
-        # Check if section already exists
-        existing_section = db.query(DocumentSection).filter(
-            DocumentSection.project_id == project.id,
-            DocumentSection.section_index == idx
-        ).first()
-        
+    current_fingerprints = {}
+    if request.only_stale:
+        current_fingerprints = dict(
+            db.query(DocumentSection.section_index, DocumentSection.input_fingerprint).filter(
+                DocumentSection.project_id == project.id,
+                DocumentSection.content.isnot(None)
+            ).all()
+        )
+    
+    # Sections are generated one at a time, so a client that goes away (or an
+    # explicit cancel) stops the remaining sections from being generated
+    cancelled = False
+    reason = None
+    position = 0
+    async with cancel_scope(http_request, project.id) as scope:
         try:
-            print(f"Generating content for section {idx}: {section_title}")
-            content = generate_content_with_gemini(
-                project.topic,
-                section_title,
-                project.document_type
-            )
-            print(f"Successfully generated content for section {idx}, length: {len(content) if content else 0}")
-            
-            if not content:
-                print(f"Warning: Empty content returned for section {idx}")
-                continue
-            
-            if existing_section:
-                existing_section.content = content
-                existing_section.updated_at = datetime.utcnow()
-                if not existing_section.generated_at:
-                    existing_section.generated_at = datetime.utcnow()
-            else:
-                db_section = DocumentSection(
-                    project_id=project.id,
-                    section_index=idx,
-                    title=section_title,
-                    content=content,
-                    generated_at=datetime.utcnow()
-                )
-                db.add(db_section)
-            
-            generated_indices.append(idx)
-        except Exception as e:
-            # Log the full error
-            import traceback
-            print(f"Error generating section {idx}: {str(e)}")
-            print(traceback.format_exc())
-            continue
+            for position, idx in enumerate(sections_to_generate):
+                if drain.draining:
+                    # The section in progress was committed; the rest is left for a
+                    # retry, which the load balancer sends to another worker
+                    raise GenerationCancelled(REASON_SHUTDOWN)
+                
+                if idx >= len(structure_data):
+                    continue
+                
+                section_title = structure_data[idx]
+                fingerprint = generation_fingerprint(project.topic, section_title, project.document_type)
+                
+                if request.only_stale and current_fingerprints.get(idx) == fingerprint:
+                    skipped_indices.append(idx)
+                    continue
+                
+                prompt_tokens = count_tokens(build_prompt(project.topic, section_title, project.document_type))
+                if not within_user_budget(db, current_user.id, prompt_tokens):
+                    # Finished sections are kept, the rest can be resumed once there is budget again
+                    raise GenerationCancelled(REASON_BUDGET)
+                
+                # Check if section already exists
+                existing_section = db.query(DocumentSection).filter(
+                    DocumentSection.project_id == project.id,
+                    DocumentSection.section_index == idx
+                ).first()
+                
+                try:
+                    print(f"Generating content for section {idx}: {section_title}")
+                    content = await scope.run(lambda: call_model(
+                        BULK,
+                        current_user.id,
+                        generate_content_with_gemini,
+                        project.topic,
+                        section_title,
+                        project.document_type
+                    ))
+                    print(f"Successfully generated content for section {idx}, length: {len(content) if content else 0}")
+                    
+                    if not content:
+                        print(f"Warning: Empty content returned for section {idx}")
+                        continue
+                    
+                    if existing_section:
+                        previous_content = existing_section.content
+                        existing_section.title = section_title
+                        existing_section.content = content
+                        existing_section.input_fingerprint = fingerprint
+                        existing_section.updated_at = datetime.utcnow()
+                        if not existing_section.generated_at:
+                            existing_section.generated_at = datetime.utcnow()
+                        record_revision(db, existing_section, content, previous_content)
+                    else:
+                        db_section = DocumentSection(
+                            project_id=project.id,
+                            section_index=idx,
+                            title=section_title,
+                            content=content,
+                            input_fingerprint=fingerprint,
+                            generated_at=datetime.utcnow()
+                        )
+                        db.add(db_section)
+                        db.flush()
+                        record_revision(db, db_section, content)
+                    record_generation_usage(db, current_user.id, project.id, "section", prompt_tokens, count_tokens(content))
+                    
+                    # Commit per section so a cancelled run keeps what it finished
+                    db.commit()
+                    generated_indices.append(idx)
+                except GenerationCancelled:
+                    raise
+                except WRITE_CONFLICTS:
+                    # Edited while the model ran: the edit is kept, not overwritten
+                    db.rollback()
+                    conflicted_indices.append(idx)
+                    continue
+                except Exception as e:
+                    # Log the full error
+                    import traceback
+                    print(f"Error generating section {idx}: {str(e)}")
+                    print(traceback.format_exc())
+                    db.rollback()
+                    continue
+        except GenerationCancelled as e:
+            print(f"Generation for project {project.id} stopped: {e.reason}")
+            cancelled = True
+            reason = e.reason
     
-    db.commit()
+    pending = [idx for idx in sections_to_generate[position:] if idx < len(structure_data)] if cancelled else []
+    save_checkpoint(db, project.id, request, pending, reason)
+    if reason == REASON_BUDGET and not generated_indices:
+        raise GenerationCancelled(reason).to_http()
     
     return {
         "message": f"Generated {len(generated_indices)} sections",
-        "sections_generated": generated_indices
+        "sections_generated": generated_indices,
+        "sections_skipped": skipped_indices,
+        "sections_conflicted": conflicted_indices,
+        "cancelled": cancelled,
+        "sections_pending": pending,
+        "resumed": resumed
     }
 
-@router.post("/generate-template")
+@router.post("/generate-template", dependencies=[Depends(accepting_work)])
 async def generate_ai_template(
     project_id: int = Query(..., description="Project ID"),
     current_user: User = Depends(get_current_user),
@@ -267,24 +533,35 @@ async def generate_ai_template(
     
     project = db.query(Project).filter(
         Project.id == project_id,
-        Project.user_id == current_user.id
+        Project.user_id == current_user.id,
+        Project.deleted_at.is_(None)
     ).first()
     
     if not project:
         raise HTTPException(status_code=404, detail="Project not found")
     
+    # Many users ask for outlines on near-identical topics
+    cached_outline, _ = await asyncio.to_thread(outline_cache.get, project.document_type, project.topic, current_user.id)
+    if cached_outline:
+        return {"structure_data": cached_outline, "cached": True}
+    
+    # The outline prompt is a short instruction around the topic
+    check_user_budget(db, current_user.id, count_tokens(project.topic))
+    
     try:
         # Ensure API key is configured
         api_key = get_gemini_api_key()
         if not api_key:
             raise HTTPException(status_code=500, detail="Gemini API key not configured. Please set GEMINI_API_KEY in your .env file.")
         
+        genai = get_genai()
+        
         # Try gemini-2.5-flash, fallback to gemini-1.5-flash if not available
         try:
-            model = genai.GenerativeModel('gemini-2.5-flash')
+            model = genai.GenerativeModel(GEMINI_MODEL)
         except Exception:
             # Fallback to a known working model
-            model = genai.GenerativeModel('gemini-1.5-flash')
+            model = genai.GenerativeModel(GEMINI_FALLBACK_MODEL)
         
         if project.document_type == "docx":
             prompt = f"""Given the topic: "{project.topic}"
@@ -295,13 +572,46 @@ Generate a comprehensive document outline with 5-8 section headers. Return only
 
 Generate a PowerPoint presentation outline with 8-12 slide titles. Return only the slide titles, one per line, without numbering or bullets."""
         
-        response = model.generate_content(prompt)
+        response = await call_model(TEMPLATE, current_user.id, model.generate_content, prompt)
+        record_generation_usage(db, current_user.id, project.id, "template", count_tokens(prompt), count_tokens(response.text))
+        db.commit()
         titles = [line.strip() for line in response.text.strip().split('\n') if line.strip()]
         
         # Filter out any extra text that might have been generated
         titles = [t for t in titles if not t.startswith('#') and len(t) > 3]
+        await asyncio.to_thread(outline_cache.put, project.document_type, project.topic, current_user.id, titles)
         
-        return {"structure_data": titles}
+        return {"structure_data": titles, "cached": False}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error generating template: {str(e)}")
 
+
+@router.post("/cancel")
+async def cancel_generation(
+    project_id: int = Query(..., description="Project ID"),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Stop in-flight generation and refinement for a project, keeping finished sections"""
+    project = db.query(Project).filter(
+        Project.id == project_id,
+        Project.user_id == current_user.id,
+        Project.deleted_at.is_(None)
+    ).first()
+    
+    if not project:
+        raise HTTPException(status_code=404, detail="Project not found")
+    
+    stopped = cancel_project(db, project.id)
+    return {"message": "Cancellation requested", "requests_stopped": stopped}
+
+@router.get("/stats")
+async def get_generation_stats(current_user: User = Depends(get_current_user)):
+    """Model call coalescing and scheduling counters for this process"""
+    return {
+        "single_flight": model_calls.stats(),
+        "scheduler": model_scheduler.stats(),
+        "outline_cache": outline_cache.stats(),
+        "idempotency": idempotency_keys.stats(),
+        "drain": drain.stats()
+    }
@@ -0,0 +1,70 @@
+"""
+Gunicorn settings for production serving.
+
+Runs several Uvicorn workers so CPU-heavy work (exports, bcrypt) is spread over
+all cores instead of sharing one interpreter and GIL:
+
+    gunicorn -c gunicorn.conf.py main:app
+
+Every setting can be overridden from the environment.
+
+The worker count defaults to the CPU count and has not been benchmarked
+against a single worker; measure 1 vs N workers on the target machine
+before tuning WEB_CONCURRENCY beyond that default.
+"""
+import multiprocessing
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8000')}"
+worker_class = "uvicorn_worker.UvicornWorker"
+
+# One async worker per core by default
+workers = int(os.getenv("WEB_CONCURRENCY", multiprocessing.cpu_count()))
+# database.py splits DB_CONNECTION_BUDGET across this many workers. On
+# PostgreSQL every worker opens at most POOL_SIZE connections per database,
+# POOL_SIZE = max(2, DB_CONNECTION_BUDGET // WEB_CONCURRENCY), no overflow:
+#   primary total  = workers * POOL_SIZE  (<= DB_CONNECTION_BUDGET unless workers exceed it)
+#   per replica    = workers * POOL_SIZE  (each REPLICA_DATABASE_URLS entry has its own pool)
+# plus one short-lived connection from the master in on_starting.
+os.environ["WEB_CONCURRENCY"] = str(workers)
+
+# Import the app once in the master so workers share its memory copy-on-write
+preload_app = os.getenv("PRELOAD_APP", "true").lower() == "true"
+
+# Recycle workers after a number of requests to contain slow memory growth,
+# with jitter so they do not all restart at once
+max_requests = int(os.getenv("MAX_REQUESTS", "1000"))
+max_requests_jitter = int(os.getenv("MAX_REQUESTS_JITTER", "100"))
+
+# Generation requests make several model calls in a row
+timeout = int(os.getenv("WORKER_TIMEOUT", "300"))
+graceful_timeout = int(os.getenv("GRACEFUL_TIMEOUT", "60"))
+keepalive = 5
+
+accesslog = "-"
+
+def on_starting(server):
+    from database import DATABASE_URL, DB_CONNECTION_BUDGET, POOL_SIZE
+    if DATABASE_URL.startswith("postgresql") and workers * POOL_SIZE > DB_CONNECTION_BUDGET:
+        server.log.warning(
+            "%d workers x %d connections exceed DB_CONNECTION_BUDGET=%d",
+            workers, POOL_SIZE, DB_CONNECTION_BUDGET
+        )
+    
+    # Create tables and the search index once, before any worker starts, so
+    # workers do not race each other through CREATE TABLE
+    from database import init_db
+    from search import init_search_index
+    init_db()
+    init_search_index()
+    os.environ["DB_INITIALIZED"] = "1"
+    
+    # Load the model SDK and export libraries once here so all workers share them
+    if preload_app and os.getenv("WARMUP_IMPORTS", "false").lower() == "true":
+        from main import warmup
+        warmup()
+
+def post_fork(server, worker):
+    # Connections opened in the master must not be shared with the workers
+    from database import engine
+    engine.dispose(close=False)
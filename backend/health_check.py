@@ -47,7 +47,7 @@ for var in env_vars:
 # Try to import main modules
 print("\n=== Module Imports ===")
 try:
-    from main import app
+    from main import app, HEAVY_MODULES
     print("✅ main.py imports successfully")
 except Exception as e:
     print(f"❌ Failed to import main.py: {e}")
@@ -65,9 +65,22 @@ try:
 except Exception as e:
     print(f"❌ Failed to import auth.py: {e}")
 
+# Check startup cost in a fresh interpreter: the model SDK and export
+# libraries must load lazily (python -X importtime -c 'import main')
+print("\n=== Startup Cost ===")
+from import_check import startup_problems, IMPORT_TIME_BUDGET_MS
+startup_ms, startup_issues = startup_problems(HEAVY_MODULES)
+if startup_issues:
+    for issue in startup_issues:
+        print(f"❌ {issue}")
+    print("   Run: python -X importtime -c 'import main' 2> importtime.log")
+    sys.exit(1)
+print(f"✅ Import time {startup_ms:.0f} ms within {IMPORT_TIME_BUDGET_MS} ms budget")
+print(f"✅ {', '.join(HEAVY_MODULES)} deferred until first use")
+
 # Check if app has routes
 print("\n=== Route Check ===")
-routes = [route.path for route in app.routes]
+routes = [getattr(route, "path", None) for route in app.routes]  # Included routers have no path of their own
 if '/api/health' in routes:
     print("✅ /api/health route exists")
 else:
@@ -0,0 +1,228 @@
+from fastapi import HTTPException, Request
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from sqlalchemy import delete, select, update
+from sqlalchemy.exc import IntegrityError
+from datetime import datetime, timedelta
+import asyncio
+import hashlib
+import json
+import os
+import time
+
+from database import SessionLocal, IdempotencyRecord
+
+# How long the response to a key is replayed; the key can be reused after that
+IDEMPOTENCY_TTL_HOURS = float(os.getenv("IDEMPOTENCY_TTL_HOURS", "24"))
+# How long a duplicate waits for the original request before answering 409
+IDEMPOTENCY_WAIT_SECONDS = float(os.getenv("IDEMPOTENCY_WAIT_SECONDS", "300"))
+# A key still pending after this long belongs to a process that died, and the
+# next request with it runs again
+PENDING_LEASE_SECONDS = 600
+WAIT_POLL_SECONDS = 0.25
+MAX_KEY_LENGTH = 255
+
+PURGE_INTERVAL_SECONDS = 300
+PURGE_BATCH_SIZE = int(os.getenv("PURGE_BATCH_SIZE", "5000"))
+
+REPLAYED_HEADER = "Idempotent-Replayed"
+
+def request_hash(request: Request, params: dict) -> str:
+    """Hash of what a key was used for, so it cannot be replayed for another request"""
+    payload = json.dumps(
+        [request.method, request.url.path, jsonable_encoder(params)],
+        sort_keys=True, separators=(",", ":")
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+def _claim(user_id: int, key: str, digest: str):
+    """Take key for this request.
+
+    Returns (True, None) if the caller should run it, otherwise False and the
+    (request_hash, status, response_body) of the record holding the key, or
+    None if that record went away meanwhile.
+    """
+    now = datetime.utcnow()
+    db = SessionLocal()
+    try:
+        db.add(IdempotencyRecord(
+            user_id=user_id,
+            key=key,
+            request_hash=digest,
+            status="pending",
+            created_at=now,
+            expires_at=now + timedelta(hours=IDEMPOTENCY_TTL_HOURS)
+        ))
+        try:
+            db.commit()
+            return True, None
+        except IntegrityError:
+            db.rollback()
+        
+        record = db.query(IdempotencyRecord).filter(
+            IdempotencyRecord.user_id == user_id,
+            IdempotencyRecord.key == key
+        ).first()
+        if record is None:
+            return False, None
+        if record.expires_at < now:
+            db.delete(record)
+            db.commit()
+            return False, None
+        abandoned = record.created_at < now - timedelta(seconds=PENDING_LEASE_SECONDS)
+        if record.status == "pending" and record.request_hash == digest and abandoned:
+            # Only one of several waiters takes over an abandoned key
+            taken = db.execute(update(IdempotencyRecord).where(
+                IdempotencyRecord.id == record.id,
+                IdempotencyRecord.status == "pending",
+                IdempotencyRecord.created_at == record.created_at
+            ).values(created_at=now)).rowcount
+            db.commit()
+            if taken:
+                return True, None
+        return False, (record.request_hash, record.status, record.response_body)
+    finally:
+        db.close()
+
+def _complete(user_id: int, key: str, body: str):
+    db = SessionLocal()
+    try:
+        db.execute(update(IdempotencyRecord).where(
+            IdempotencyRecord.user_id == user_id,
+            IdempotencyRecord.key == key
+        ).values(status="completed", response_body=body))
+        db.commit()
+    finally:
+        db.close()
+
+def _release(user_id: int, key: str):
+    db = SessionLocal()
+    try:
+        db.execute(delete(IdempotencyRecord).where(
+            IdempotencyRecord.user_id == user_id,
+            IdempotencyRecord.key == key,
+            IdempotencyRecord.status == "pending"
+        ))
+        db.commit()
+    finally:
+        db.close()
+
+def purge_expired():
+    """Delete expired records, a bounded batch per transaction"""
+    db = SessionLocal()
+    try:
+        while True:
+            batch = select(IdempotencyRecord.id).where(
+                IdempotencyRecord.expires_at < datetime.utcnow()
+            ).limit(PURGE_BATCH_SIZE)
+            result = db.execute(
+                delete(IdempotencyRecord).where(IdempotencyRecord.id.in_(batch)).execution_options(synchronize_session=False)
+            )
+            db.commit()
+            if result.rowcount < PURGE_BATCH_SIZE:
+                break
+    finally:
+        db.close()
+
+class IdempotencyKeys:
+    """Run a request once per Idempotency-Key header and replay its response.
+
+    The first request with a key records it as pending and runs. Its result
+    is stored when it succeeds; on failure or cancellation the key is
+    released so a retry runs again. Repeats get the stored response without
+    running anything, and duplicates arriving meanwhile wait for the first
+    one, here or in another worker process.
+    """
+
+    def __init__(self):
+        self._running = {}  # (user_id, key) -> future set when a local request finishes
+        self._purge = None
+        self._last_purge = 0.0
+        self.executed = 0
+        self.replayed = 0
+        self.waited = 0
+
+    def _maybe_purge(self):
+        if time.monotonic() - self._last_purge < PURGE_INTERVAL_SECONDS:
+            return
+        self._last_purge = time.monotonic()
+        self._purge = asyncio.create_task(asyncio.to_thread(purge_expired))
+
+    async def run(self, request: Request, user_id: int, params: dict, fn, store=None):
+        """Return fn()'s result, or the stored response for a repeated key.
+
+        params identifies the request along with its method and path. store
+        decides whether a result is kept for replay, all are by default.
+        """
+        key = request.headers.get("idempotency-key")
+        if key is None:
+            return await fn()
+        if not key or len(key) > MAX_KEY_LENGTH:
+            raise HTTPException(status_code=400, detail=f"Idempotency-Key must be 1 to {MAX_KEY_LENGTH} characters")
+        
+        self._maybe_purge()
+        digest = request_hash(request, params)
+        deadline = time.monotonic() + IDEMPOTENCY_WAIT_SECONDS
+        waited = False
+        while True:
+            claimed, existing = await asyncio.to_thread(_claim, user_id, key, digest)
+            if claimed:
+                return await self._run_claimed(user_id, key, fn, store)
+            if existing is None:
+                continue
+            
+            existing_hash, status, body = existing
+            if existing_hash != digest:
+                raise HTTPException(status_code=422, detail="Idempotency-Key was already used for a different request")
+            if status == "completed":
+                self.replayed += 1
+                return JSONResponse(json.loads(body), headers={REPLAYED_HEADER: "true"})
+            
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise HTTPException(status_code=409, detail="A request with this Idempotency-Key is still in progress")
+            if not waited:
+                self.waited += 1
+                waited = True
+            running = self._running.get((user_id, key))
+            if running is not None:
+                # The original runs in this process: wake up as soon as it is done
+                try:
+                    await asyncio.wait_for(asyncio.shield(running), remaining)
+                except asyncio.TimeoutError:
+                    pass
+            else:
+                await asyncio.sleep(min(WAIT_POLL_SECONDS, remaining))
+
+    async def _run_claimed(self, user_id: int, key: str, fn, store):
+        done = asyncio.get_running_loop().create_future()
+        self._running[(user_id, key)] = done
+        self.executed += 1
+        completed = False
+        try:
+            result = await fn()
+            if store is None or store(result):
+                body = json.dumps(jsonable_encoder(result), separators=(",", ":"))
+                await asyncio.to_thread(_complete, user_id, key, body)
+                completed = True
+            return result
+        finally:
+            try:
+                if not completed:
+                    # Shielded so a cancelled request still releases its key
+                    await asyncio.shield(asyncio.to_thread(_release, user_id, key))
+            finally:
+                if self._running.get((user_id, key)) is done:
+                    del self._running[(user_id, key)]
+                done.set_result(None)
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": len(self._running),
+            "executed": self.executed,
+            "replayed": self.replayed,
+            "waited": self.waited
+        }
+
+# Shared by generation and refinement
+idempotency_keys = IdempotencyKeys()
@@ -0,0 +1,47 @@
+"""
+Startup cost of the app, measured in a fresh interpreter with -X importtime.
+Used by health_check.py and the test suite.
+"""
+import os
+import re
+import subprocess
+import sys
+
+# Cumulative time allowed for 'import main', in milliseconds
+IMPORT_TIME_BUDGET_MS = int(os.getenv("IMPORT_TIME_BUDGET_MS", "1500"))
+
+# "import time: <self us> | <cumulative us> | <indent><module>"
+IMPORTTIME_LINE = re.compile(r"import time:\s+\d+\s+\|\s+(\d+)\s+\|\s(\s*)(\S+)$")
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+def measure_imports(module: str = "main") -> dict:
+    """Modules loaded by importing module in a new interpreter, with their cumulative ms"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=BACKEND_DIR,
+        capture_output=True,
+        text=True,
+        timeout=120
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{result.stderr[-2000:]}")
+    
+    loaded = {}
+    for line in result.stderr.splitlines():
+        match = IMPORTTIME_LINE.match(line)
+        if match:
+            loaded[match.group(3)] = int(match.group(1)) / 1000
+    return loaded
+
+def startup_problems(heavy_modules, module: str = "main", budget_ms: int = IMPORT_TIME_BUDGET_MS):
+    """Import time of module and what is wrong with it: over budget or heavy modules loaded eagerly"""
+    loaded = measure_imports(module)
+    import_ms = loaded.get(module, 0.0)
+    problems = []
+    if import_ms > budget_ms:
+        problems.append(f"import {module} took {import_ms:.0f} ms, over the {budget_ms} ms budget")
+    for name in heavy_modules:
+        if any(loaded_name == name or loaded_name.startswith(name + ".") for loaded_name in loaded):
+            problems.append(f"{name} is imported at startup, it should load on first use")
+    return import_ms, problems
@@ -0,0 +1,423 @@
+from fastapi import APIRouter, Depends, File, Form, HTTPException, Request, UploadFile
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import insert
+from sqlalchemy.orm import Session
+from typing import Optional
+import os
+import posixpath
+import re
+import zipfile
+import zlib
+
+from database import get_db, User, Project, DocumentStructure, DocumentSection
+from profiling import TimedRoute
+from auth import get_current_user
+from search import index_section
+
+# Uploads are spooled to disk by the multipart parser past 1MB, so this bounds
+# disk use and parse time rather than memory. ImportRoute enforces it on the
+# request body while it arrives, before anything is spooled past the limit.
+IMPORT_MAX_BYTES = int(os.getenv("IMPORT_MAX_BYTES", str(200 * 1024 * 1024)))
+# Room for multipart boundaries, part headers and the title field
+IMPORT_BODY_OVERHEAD = 64 * 1024
+# Extracted text allowed per document, guards against XML that inflates far beyond the upload
+MAX_TEXT_CHARS = 50_000_000
+# Sections are inserted in batches of this many, or sooner once their text adds up
+IMPORT_BATCH_SIZE = 200
+IMPORT_BATCH_CHARS = 8_000_000
+TOPIC_MAX_CHARS = 2000
+
+W = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+A = "{http://schemas.openxmlformats.org/drawingml/2006/main}"
+P = "{http://schemas.openxmlformats.org/presentationml/2006/main}"
+R = "{http://schemas.openxmlformats.org/officeDocument/2006/relationships}"
+PKG_REL = "{http://schemas.openxmlformats.org/package/2006/relationships}"
+
+# Outline headings that are navigation rather than content, e.g. in our own exports
+SKIPPED_HEADINGS = {"table of contents", "contents"}
+# Date line of our own title pages
+GENERATED_ON = re.compile(r"^Generated on \w+ \d{1,2}, \d{4}$")
+
+class DocumentImportError(ValueError):
+    """The upload is not a document this importer can read"""
+
+def _too_large():
+    return HTTPException(status_code=413, detail="File too large to import")
+
+class ImportRoute(TimedRoute):
+    """Route that refuses request bodies over the import limit before parsing them.
+
+    A declared Content-Length over the limit is refused outright; chunked
+    bodies are counted as they arrive and cut off once they pass it.
+    """
+
+    def get_route_handler(self):
+        handler = super().get_route_handler()
+        
+        async def limited_handler(request: Request):
+            limit = IMPORT_MAX_BYTES + IMPORT_BODY_OVERHEAD
+            length = request.headers.get("content-length", "")
+            if length.isdigit() and int(length) > limit:
+                raise _too_large()
+            
+            received = 0
+            
+            async def receive():
+                nonlocal received
+                message = await request.receive()
+                received += len(message.get("body", b""))
+                if received > limit:
+                    raise _too_large()
+                return message
+            
+            return await handler(Request(request.scope, receive))
+        
+        return limited_handler
+
+router = APIRouter(route_class=ImportRoute)
+
+def _etree():
+    # lxml comes with python-docx; imported on first import like the export libraries
+    from lxml import etree
+    return etree
+
+def _iterparse(source, tag):
+    return _etree().iterparse(source, events=("end",), tag=tag, resolve_entities=False, no_network=True)
+
+def _release(elem):
+    # Drop the element and everything parsed before it, so memory stays at
+    # one paragraph or shape however long the part is
+    elem.clear()
+    while elem.getprevious() is not None:
+        del elem.getparent()[0]
+
+def _parse_small(zf: zipfile.ZipFile, name: str):
+    parser = _etree().XMLParser(resolve_entities=False, no_network=True)
+    with zf.open(name) as f:
+        return _etree().parse(f, parser).getroot()
+
+def _clean_title(title: str) -> str:
+    # Our exports number headings ("3. Methods") and slides ("Slide 3: Methods")
+    title = re.sub(r"^(slide\s+\d+:\s*|\d+\.\s+)", "", title.strip(), flags=re.IGNORECASE)
+    return title[:500]
+
+class _Text:
+    """Body text of one section, in the paragraph and bullet conventions of generated content"""
+
+    def __init__(self):
+        self.parts = []
+        self.last_bullet = False
+
+    def add(self, text: str, bullet: bool = False):
+        text = text.strip()
+        if not text:
+            return
+        if bullet:
+            text = "• " + text
+        if self.parts:
+            self.parts.append("\n" if bullet and self.last_bullet else "\n\n")
+        self.parts.append(text)
+        self.last_bullet = bullet
+
+    def value(self) -> str:
+        return "".join(self.parts)
+
+    def __str__(self):
+        return self.value()
+
+def _docx_styles(zf: zipfile.ZipFile):
+    """styleId -> (heading level, is list, is TOC entry). Level 0 is the document title, None for body text"""
+    if "word/styles.xml" not in zf.namelist():
+        return {}
+    root = _parse_small(zf, "word/styles.xml")
+    raw = {}
+    for style in root.iter(f"{W}style"):
+        style_id = style.get(f"{W}styleId")
+        name_el = style.find(f"{W}name")
+        name = (name_el.get(f"{W}val") if name_el is not None else style_id or "").lower()
+        level = None
+        match = re.match(r"heading\s*(\d)$", name)
+        if name == "title":
+            level = 0
+        elif match:
+            level = int(match.group(1))
+        else:
+            outline = style.find(f"{W}pPr/{W}outlineLvl")
+            if outline is not None and outline.get(f"{W}val", "9").isdigit() and int(outline.get(f"{W}val")) < 9:
+                level = int(outline.get(f"{W}val")) + 1
+        based_on = style.find(f"{W}basedOn")
+        raw[style_id] = (level, "list" in name, name.startswith("toc"), based_on.get(f"{W}val") if based_on is not None else None)
+    
+    styles = {}
+    for style_id in raw:
+        level, is_list, is_toc, parent = raw[style_id]
+        seen = {style_id}
+        # Inherit a heading level through basedOn, e.g. a custom "Chapter" style based on Heading 1
+        while level is None and parent in raw and parent not in seen:
+            seen.add(parent)
+            level, _, _, parent = raw[parent]
+        styles[style_id] = (level, is_list, is_toc)
+    return styles
+
+def _docx_paragraph_text(p) -> str:
+    chunks = []
+    for el in p.iter(f"{W}t", f"{W}tab", f"{W}br", f"{W}cr"):
+        if el.tag == f"{W}t":
+            chunks.append(el.text or "")
+        elif el.tag == f"{W}tab":
+            chunks.append("\t")
+        else:
+            chunks.append("\n")
+    return "".join(chunks)
+
+def iter_docx(zf: zipfile.ZipFile, meta: dict):
+    """Yield (title, content) per top-level heading of a Word document.
+
+    Sections start at headings of the highest level seen so far, so documents
+    that only use Heading 2 still split sensibly. Text before the first
+    heading goes to meta["preamble"], a Title paragraph (or else the first
+    line) to meta["title"].
+    """
+    styles = _docx_styles(zf)
+    section_level = None
+    title = None
+    body = _Text()
+    preamble = meta["preamble"] = _Text()
+    
+    with zf.open("word/document.xml") as f:
+        for _, p in _iterparse(f, f"{W}p"):
+            ppr = p.find(f"{W}pPr")
+            level, is_list, is_toc = None, False, False
+            bullet = False
+            if ppr is not None:
+                style = ppr.find(f"{W}pStyle")
+                if style is not None:
+                    level, is_list, is_toc = styles.get(style.get(f"{W}val"), (None, False, False))
+                outline = ppr.find(f"{W}outlineLvl")
+                if outline is not None and outline.get(f"{W}val", "9").isdigit() and int(outline.get(f"{W}val")) < 9:
+                    level = int(outline.get(f"{W}val")) + 1
+                bullet = is_list or ppr.find(f"{W}numPr") is not None
+            text = _docx_paragraph_text(p)
+            _release(p)
+            
+            if is_toc or not text.strip():
+                continue
+            meta["chars"] += len(text)
+            if meta["chars"] > MAX_TEXT_CHARS:
+                raise DocumentImportError("Document has too much text to import")
+            
+            if level == 0:
+                if not meta.get("title"):
+                    meta["title"] = text.strip()
+                continue
+            if level is not None and (section_level is None or level <= section_level):
+                section_level = level if section_level is None else min(section_level, level)
+                if title is not None and title.lower() not in SKIPPED_HEADINGS:
+                    yield title, body.value()
+                title = _clean_title(text)
+                body = _Text()
+                continue
+            
+            if title is None:
+                # Without a Title paragraph, the first line of the title page is the title
+                if not meta.get("title"):
+                    meta["title"] = text.strip()
+                elif not GENERATED_ON.match(text.strip()):
+                    preamble.add(text)
+            elif level is not None:
+                body.add(text)  # Subheading, kept as its own paragraph
+            else:
+                body.add(text, bullet)
+    
+    if title is not None and title.lower() not in SKIPPED_HEADINGS:
+        yield title, body.value()
+
+def _pptx_slide_paths(zf: zipfile.ZipFile):
+    """Slide part names in presentation order"""
+    presentation = _parse_small(zf, "ppt/presentation.xml")
+    rels = _parse_small(zf, "ppt/_rels/presentation.xml.rels")
+    targets = {rel.get("Id"): rel.get("Target") for rel in rels.iter(f"{PKG_REL}Relationship")}
+    paths = []
+    for slide_id in presentation.iter(f"{P}sldId"):
+        target = targets.get(slide_id.get(f"{R}id"))
+        if target:
+            paths.append(target.lstrip("/") if target.startswith("/") else posixpath.normpath(posixpath.join("ppt", target)))
+    return paths
+
+def _pptx_shape_lines(sp):
+    lines = []
+    for para in sp.iter(f"{A}p"):
+        text = "".join(
+            (el.text or "") if el.tag == f"{A}t" else "\n"
+            for el in para.iter(f"{A}t", f"{A}br")
+        ).strip()
+        if text:
+            lines.append(text)
+    return lines
+
+def iter_pptx(zf: zipfile.ZipFile, meta: dict):
+    """Yield (title, content) per slide of a presentation.
+
+    A leading title slide (centered title placeholder) is not a section; its
+    title and subtitle go to meta["title"] and meta["preamble"].
+    """
+    names = set(zf.namelist())
+    for number, path in enumerate(_pptx_slide_paths(zf), 1):
+        if path not in names:
+            continue
+        title = None
+        is_title_slide = False
+        subtitle = []
+        lines = []
+        with zf.open(path) as f:
+            for _, sp in _iterparse(f, f"{P}sp"):
+                ph = sp.find(f"{P}nvSpPr/{P}nvPr/{P}ph")
+                ph_type = ph.get("type") if ph is not None else None
+                shape_lines = _pptx_shape_lines(sp)
+                _release(sp)
+                
+                meta["chars"] += sum(len(line) for line in shape_lines)
+                if meta["chars"] > MAX_TEXT_CHARS:
+                    raise DocumentImportError("Presentation has too much text to import")
+                
+                if ph_type in ("title", "ctrTitle") and title is None:
+                    title = " ".join(shape_lines)
+                    is_title_slide = ph_type == "ctrTitle"
+                elif ph_type == "subTitle":
+                    subtitle.extend(shape_lines)
+                else:
+                    lines.extend(shape_lines)
+        
+        if number == 1 and is_title_slide:
+            meta["title"] = title
+            meta["preamble"] = "\n".join(line for line in subtitle + lines if not GENERATED_ON.match(line))
+            continue
+        lines = subtitle + lines
+        yield _clean_title(title) if title else f"Slide {number}", "\n".join(lines)
+
+def import_document(db: Session, user_id: int, upload, filename: str, title: Optional[str]) -> dict:
+    """Create a project from an uploaded DOCX or PPTX, inserting sections in batches"""
+    try:
+        zf = zipfile.ZipFile(upload)
+    except zipfile.BadZipFile:
+        raise DocumentImportError("Not a DOCX or PPTX file")
+    names = set(zf.namelist())
+    if "word/document.xml" in names:
+        document_type, sections = "docx", iter_docx
+    elif "ppt/presentation.xml" in names:
+        document_type, sections = "pptx", iter_pptx
+    else:
+        raise DocumentImportError("Not a DOCX or PPTX file")
+    
+    meta = {"chars": 0}
+    project = None
+    titles = []
+    batch = []
+    batch_chars = 0
+
+    def create_project():
+        # Deferred until the first section, when the title and preamble are known
+        fallback = os.path.splitext(os.path.basename(filename or ""))[0] or "Imported document"
+        project_title = (title or meta.get("title") or fallback).strip()[:500]
+        topic = str(meta.get("preamble") or "").strip()[:TOPIC_MAX_CHARS] or project_title
+        new_project = Project(title=project_title, document_type=document_type, topic=topic, user_id=user_id)
+        db.add(new_project)
+        db.flush()
+        return new_project
+
+    def flush_batch():
+        if not batch:
+            return
+        ids = db.execute(
+            insert(DocumentSection).returning(DocumentSection.id, sort_by_parameter_order=True),
+            batch
+        ).scalars().all()
+        # Core inserts skip the flush hook that keeps search in step with sections
+        for section_id, row in zip(ids, batch):
+            if row["content"]:
+                index_section(db, section_id, project.id, user_id, row["content"])
+        batch.clear()
+    
+    try:
+        for section_title, content in sections(zf, meta):
+            if project is None:
+                project = create_project()
+            titles.append(section_title)
+            batch.append({
+                "project_id": project.id,
+                "section_index": len(titles) - 1,
+                "title": section_title,
+                "content": content or None,
+                "current_revision": 0
+            })
+            batch_chars += len(content)
+            if len(batch) >= IMPORT_BATCH_SIZE or batch_chars >= IMPORT_BATCH_CHARS:
+                flush_batch()
+                batch_chars = 0
+        
+        if project is None:
+            # No headings or slides to split on, keep the text as one section
+            project = create_project()
+            if str(meta.get("preamble") or ""):
+                titles.append(project.title)
+                batch.append({
+                    "project_id": project.id,
+                    "section_index": 0,
+                    "title": project.title,
+                    "content": str(meta["preamble"]),
+                    "current_revision": 0
+                })
+        flush_batch()
+        
+        db.add(DocumentStructure(project_id=project.id, structure_data=titles))
+        db.commit()
+    except KeyError as e:
+        db.rollback()
+        raise DocumentImportError(f"Damaged document, missing part {e}")
+    except DocumentImportError:
+        db.rollback()
+        raise
+    except Exception as e:
+        db.rollback()
+        # Corrupt member data fails in zlib, or ends early, rather than in zipfile
+        if isinstance(e, (_etree().XMLSyntaxError, zipfile.BadZipFile, zlib.error, EOFError)):
+            raise DocumentImportError(f"Damaged document: {str(e)}")
+        raise
+    finally:
+        zf.close()
+    
+    db.refresh(project)
+    return {
+        "id": project.id,
+        "title": project.title,
+        "document_type": project.document_type,
+        "topic": project.topic,
+        "created_at": project.created_at,
+        "updated_at": project.updated_at,
+        "sections": len(titles)
+    }
+
+@router.post("")
+async def import_project(
+    file: UploadFile = File(...),
+    title: Optional[str] = Form(None),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Create a project from an existing DOCX or PPTX.
+
+    Headings (or slides) become the outline and their text the section
+    content. The upload is read from its spooled temp file and parsed one
+    paragraph or shape at a time, so memory use does not grow with file size.
+    """
+    file.file.seek(0, os.SEEK_END)
+    size = file.file.tell()
+    file.file.seek(0)
+    if size > IMPORT_MAX_BYTES:
+        raise _too_large()
+    
+    try:
+        # Parsing is CPU bound, keep it off the event loop
+        return await run_in_threadpool(import_document, db, current_user.id, file.file, file.filename, title)
+    except DocumentImportError as e:
+        raise HTTPException(status_code=400, detail=str(e))
@@ -1,6 +1,8 @@
 from fastapi import FastAPI, Depends, HTTPException, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import JSONResponse
 from sqlalchemy.orm import Session
 from contextlib import asynccontextmanager
 import uvicorn
@@ -8,23 +10,55 @@ from dotenv import load_dotenv
 
 from database import get_db, init_db
 from auth import get_current_user, router as auth_router
-from projects import router as projects_router
+from projects import router as projects_router, purge_deleted_projects_once
 from documents import router as documents_router
 from generation import router as generation_router
 from refinement import router as refinement_router
 from export import router as export_router
+from importer import router as import_router
+from preview import router as preview_router
+from search import router as search_router, init_search_index
+from replicas import ReadYourWritesMiddleware, replicas, replica_stats, LAST_WRITE_HEADER
+from profiling import ServerTimingMiddleware, router as profiles_router
+from draining import drain
+import asyncio
+import importlib
 import os
 
 # Load .env from the backend directory
 env_path = os.path.join(os.path.dirname(__file__), '.env')
 load_dotenv(dotenv_path=env_path)
 
+# Dependencies only needed for model calls and exports. They are imported on
+# first use; set WARMUP_IMPORTS=true to load them at startup instead (with
+# gunicorn's preload_app this happens once in the master and is shared).
+HEAVY_MODULES = ("google.generativeai", "docx", "pptx", "numpy", "lxml")
+
+def warmup():
+    for name in HEAVY_MODULES:
+        importlib.import_module(name)
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    # Startup: Initialize database
-    init_db()
+    # Startup: Initialize database (done once in the gunicorn master when
+    # running multiple workers, see gunicorn.conf.py)
+    if not os.getenv("DB_INITIALIZED"):
+        init_db()
+        init_search_index()
+    if os.getenv("WARMUP_IMPORTS", "false").lower() == "true":
+        warmup()
+    # Projects deleted just before a restart may not have been purged yet;
+    # one worker does it while the others skip
+    purge = asyncio.create_task(purge_deleted_projects_once())
+    # Deploys and scale-downs send SIGTERM: finish in-flight sections first
+    drain.reset()
+    drain.install_signal_handler()
     yield
-    # Shutdown: cleanup code can go here if needed
+    # Shutdown: the server has waited for open requests by now; generations
+    # still running (shutdowns without SIGTERM) are stopped and checkpointed
+    drain.shutdown()
+    if not purge.done():
+        purge.cancel()
 
 app = FastAPI(
     title="AI Document Authoring Platform",
@@ -51,8 +85,33 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[LAST_WRITE_HEADER],
 )
 
+# Compress large responses (project detail, section lists). Brotli is used when
+# brotli-asgi is installed, which falls back to gzip for clients without it.
+# Exports are DOCX/PPTX/ZIP files, which are already deflated, so brotli skips them.
+COMPRESSION_MINIMUM_SIZE = int(os.getenv("COMPRESSION_MINIMUM_SIZE", "1024"))
+try:
+    from brotli_asgi import BrotliMiddleware
+    app.add_middleware(
+        BrotliMiddleware,
+        minimum_size=COMPRESSION_MINIMUM_SIZE,
+        gzip_fallback=True,
+        excluded_handlers=[r"^/api/export/"]
+    )
+except ImportError:
+    app.add_middleware(GZipMiddleware, minimum_size=COMPRESSION_MINIMUM_SIZE, compresslevel=6)
+
+# Read-only endpoints use replicas when REPLICA_DATABASE_URLS is set; this
+# stamps each client's writes so its next reads, sent with the stamp, see them
+if replicas:
+    app.add_middleware(ReadYourWritesMiddleware)
+
+# Added last so it wraps everything else: times every request for the
+# Server-Timing header and profiles those sent with PROFILE_SECRET
+app.add_middleware(ServerTimingMiddleware)
+
 # Include routers
 app.include_router(auth_router, prefix="/api/auth", tags=["Authentication"])
 app.include_router(projects_router, prefix="/api/projects", tags=["Projects"])
@@ -60,6 +119,10 @@ app.include_router(documents_router, prefix="/api/documents", tags=["Documents"]
 app.include_router(generation_router, prefix="/api/generation", tags=["Generation"])
 app.include_router(refinement_router, prefix="/api/refinement", tags=["Refinement"])
 app.include_router(export_router, prefix="/api/export", tags=["Export"])
+app.include_router(import_router, prefix="/api/import", tags=["Import"])
+app.include_router(preview_router, prefix="/api/preview", tags=["Preview"])
+app.include_router(search_router, prefix="/api/search", tags=["Search"])
+app.include_router(profiles_router, prefix="/api/profiles", tags=["Profiling"])
 
 @app.get("/")
 async def root():
@@ -67,6 +130,11 @@ async def root():
 
 @app.get("/api/health")
 async def health_check():
+    # Not ready while draining, so the load balancer stops routing here
+    if drain.draining:
+        return JSONResponse({"status": "draining", "drain": drain.stats()}, status_code=503)
+    if replicas:
+        return {"status": "healthy", "database": replica_stats()}
     return {"status": "healthy"}
 
 if __name__ == "__main__":
@@ -0,0 +1,308 @@
+from functools import lru_cache
+from types import SimpleNamespace
+from xml.sax.saxutils import escape
+from datetime import datetime
+import io
+import re
+import zipfile
+
+from database import SessionLocal, Project, DocumentSection
+from export import _ZipStream, render_docx, render_pptx, content_blocks, slide_lines
+
+# Sections whose content is read per query while streaming
+STREAM_BATCH_SIZE = 100
+# Output is handed to the response in chunks of about this size
+STREAM_CHUNK_BYTES = 64 * 1024
+
+# Marker texts rendered into the sample documents the templates are cut from
+MARK_TITLE = "ZZTITLEZZ"
+MARK_TOPIC = "ZZTOPICZZ"
+MARK_DATE = "ZZDATEZZ"
+MARK_HEADING = "ZZHEADINGZZ"
+MARK_SECTION = ("ZZSECAZZ", "ZZSECBZZ", "ZZSECCZZ")
+MARK_PARAGRAPH = "ZZPARAZZ"
+MARK_BULLET = "ZZBULLETZZ"
+
+DOCX_MAIN = "word/document.xml"
+PPTX_MAIN = "ppt/presentation.xml"
+PPTX_RELS = "ppt/_rels/presentation.xml.rels"
+CONTENT_TYPES = "[Content_Types].xml"
+SLIDE_REL_TYPE = "http://schemas.openxmlformats.org/officeDocument/2006/relationships/slide"
+SLIDE_CONTENT_TYPE = "application/vnd.openxmlformats-officedocument.presentationml.slide+xml"
+
+# Characters XML 1.0 cannot carry at all
+_INVALID_XML = re.compile("[\x00-\x08\x0b\x0c\x0e-\x1f\ufffe\uffff]")
+
+def _text(value: str) -> str:
+    return escape(_INVALID_XML.sub("", value))
+
+def _fill(template: str, marker: str, value: str) -> str:
+    """Put value into a slide template. Line breaks become spaces, tabs are kept as python-pptx keeps them."""
+    return template.replace(marker, _text(re.sub(r"[\n\r]", " ", value)))
+
+def _fill_run(template: str, marker: str, value: str) -> str:
+    """Put value into a Word paragraph template as the run python-docx would write for it"""
+    out = []
+    for piece in re.split(r"([\t\n\r])", value):
+        if piece == "\t":
+            out.append("<w:tab/>")
+        elif piece in ("\n", "\r"):
+            out.append("<w:br/>")
+        elif piece:
+            space = ' xml:space="preserve"' if piece != piece.strip() else ""
+            out.append(f"<w:t{space}>{_text(piece)}</w:t>")
+    return template.replace(f"<w:t>{marker}</w:t>", "".join(out))
+
+def _date_line() -> str:
+    return f"Generated on {datetime.now().strftime('%B %d, %Y')}"
+
+def _render_sample(render, sections):
+    """Render marker sections with the regular renderer, as {part name: text} in archive order"""
+    while True:
+        today = _date_line()
+        buffer = io.BytesIO()
+        render(SimpleNamespace(title=MARK_TITLE, topic=MARK_TOPIC), sections, buffer)
+        if _date_line() == today:  # Re-render if the date changed mid-render
+            break
+    parts = {}
+    with zipfile.ZipFile(buffer) as sample:
+        for name in sample.namelist():
+            data = sample.read(name)
+            if name.endswith(".xml") or name.endswith(".rels"):
+                data = data.decode("utf-8").replace(today, MARK_DATE)
+            parts[name] = data
+    return parts
+
+def _one(items, marker):
+    matches = [i for i, item in enumerate(items) if marker in item]
+    if not matches:
+        raise RuntimeError(f"Export template has no {marker}")
+    return matches[0]
+
+@lru_cache(maxsize=None)
+def docx_template() -> dict:
+    """Pieces of the Word document render_docx produces, cut from a rendered sample.
+
+    Everything but word/document.xml is copied as is; the body is rebuilt
+    from these paragraph templates so it matches the library output.
+    """
+    parts = _render_sample(render_docx, [
+        SimpleNamespace(title=MARK_SECTION[0], content=MARK_PARAGRAPH),
+        SimpleNamespace(title=MARK_SECTION[1], content=f"• {MARK_BULLET}")
+    ])
+    xml = parts[DOCX_MAIN]
+    body_start = xml.index("<w:body>") + len("<w:body>")
+    body_end = xml.index("<w:sectPr")
+    paragraphs = re.findall(r"<w:p>.*?</w:p>|<w:p/>", xml[body_start:body_end])
+    if "".join(paragraphs) != xml[body_start:body_end]:
+        raise RuntimeError("Unexpected export template layout")
+    
+    title = _one(paragraphs, MARK_TITLE)
+    subtitle = _one(paragraphs, MARK_TOPIC)
+    date = _one(paragraphs, MARK_DATE)
+    toc_item = _one(paragraphs, MARK_SECTION[0])
+    heading = toc_item + 1 + _one(paragraphs[toc_item + 1:], MARK_SECTION[0])
+    paragraph = _one(paragraphs, MARK_PARAGRAPH)
+    next_heading = paragraph + _one(paragraphs[paragraph:], MARK_SECTION[1])
+    bullet = _one(paragraphs, MARK_BULLET)
+    return {
+        "parts": parts,
+        "head": xml[:body_start],
+        "title": paragraphs[title],
+        "subtitle": paragraphs[subtitle],
+        "date": paragraphs[date],
+        "toc_start": "".join(paragraphs[date + 1:toc_item]),
+        "toc_item": paragraphs[toc_item].replace(f"1. {MARK_SECTION[0]}", MARK_HEADING),
+        "toc_end": "".join(paragraphs[_one(paragraphs, MARK_SECTION[1]) + 1:heading]),
+        "heading": paragraphs[heading].replace(f"1. {MARK_SECTION[0]}", MARK_HEADING),
+        "paragraph": paragraphs[paragraph],
+        "bullet": paragraphs[bullet],
+        "separator": "".join(paragraphs[paragraph + 1:next_heading]),
+        "tail": xml[body_end:]
+    }
+
+def _split_paragraph(xml: str, marker: str):
+    at = xml.index(marker)
+    start = xml.rindex("<a:p>", 0, at)
+    end = xml.index("</a:p>", at) + len("</a:p>")
+    return xml[:start], xml[start:end], xml[end:]
+
+@lru_cache(maxsize=None)
+def pptx_template() -> dict:
+    """Pieces of the presentation render_pptx produces, cut from a rendered sample"""
+    parts = _render_sample(render_pptx, [
+        SimpleNamespace(title=MARK_SECTION[0], content=MARK_PARAGRAPH),
+        SimpleNamespace(title=MARK_SECTION[1], content=f"• {MARK_BULLET}"),
+        SimpleNamespace(title=MARK_SECTION[2], content=None)
+    ])
+    names = list(parts)
+    # Parts python-pptx writes after the slides, such as the thumbnail
+    trailing = names[max(i for i, name in enumerate(names) if name.startswith("ppt/slides/")) + 1:]
+    trailing_parts = {name: parts.pop(name) for name in trailing}
+    slides = {}
+    for number, name in enumerate(("title", "plain", "bullets", "empty"), 1):
+        xml = parts.pop(f"ppt/slides/slide{number}.xml")
+        if number > 1:
+            xml = xml.replace(f"Slide {number - 1}: {MARK_SECTION[number - 2]}", MARK_HEADING)
+        slides[name] = xml
+        slides[f"{name}_rels"] = parts.pop(f"ppt/slides/_rels/slide{number}.xml.rels")
+    for name in ("plain", "bullets"):
+        marker = MARK_PARAGRAPH if name == "plain" else MARK_BULLET
+        before, line, after = _split_paragraph(slides[name], marker)
+        slides[name] = (before, line.replace(marker, MARK_PARAGRAPH), after)
+    
+    rels = parts.pop(PPTX_RELS)
+    rels = re.sub(rf'<Relationship Id="[^"]+" Type="{SLIDE_REL_TYPE}" Target="[^"]+"/>', "", rels)
+    content_types = parts.pop(CONTENT_TYPES)
+    first_slide = content_types.index('<Override PartName="/ppt/slides/')
+    content_types = re.sub(r'<Override PartName="/ppt/slides/slide\d+\.xml" ContentType="[^"]+"/>', "", content_types)
+    return {
+        "parts": parts,
+        "trailing_parts": trailing_parts,
+        "slides": slides,
+        "rels": rels,
+        "next_rel": max(int(n) for n in re.findall(r'Id="rId(\d+)"', rels)) + 1,
+        "content_types": (content_types[:first_slide], content_types[first_slide:])
+    }
+
+def _flush(sink: _ZipStream, force: bool = False):
+    if force or sink.buffered >= STREAM_CHUNK_BYTES:
+        return sink.drain()
+    return None
+
+def stream_docx(project, titles, sections):
+    """Yield a Word document equivalent to render_docx while sections are still being read.
+
+    titles is the full outline (needed up front for the table of contents),
+    sections an iterable of (title, content) in the same order.
+    """
+    t = docx_template()
+    sink = _ZipStream()
+    archive = zipfile.ZipFile(sink, "w", compression=zipfile.ZIP_DEFLATED)
+    for name, data in t["parts"].items():
+        if name != DOCX_MAIN:
+            archive.writestr(name, data)
+            continue
+        
+        with archive.open(DOCX_MAIN, "w") as part:
+            untitled = project.title == "Untitled Project"
+            out = [t["head"], _fill_run(t["title"], MARK_TITLE, project.topic if untitled else project.title)]
+            if not untitled:
+                out.append(_fill_run(t["subtitle"], MARK_TOPIC, project.topic))
+            out.append(t["date"].replace(MARK_DATE, _date_line()))
+            out.append(t["toc_start"])
+            out.extend(_fill_run(t["toc_item"], MARK_HEADING, f"{idx}. {title}") for idx, title in enumerate(titles, 1))
+            out.append(t["toc_end"])
+            part.write("".join(out).encode("utf-8"))
+            
+            for idx, (title, content) in enumerate(sections, 1):
+                out = [_fill_run(t["heading"], MARK_HEADING, f"{idx}. {title}")]
+                if content:
+                    has_bullets, blocks = content_blocks(content)
+                    template, marker = (t["bullet"], MARK_BULLET) if has_bullets else (t["paragraph"], MARK_PARAGRAPH)
+                    out.extend(_fill_run(template, marker, block) for block in blocks)
+                if idx < len(titles):
+                    out.append(t["separator"])
+                part.write("".join(out).encode("utf-8"))
+                chunk = _flush(sink)
+                if chunk:
+                    yield chunk
+            
+            part.write(t["tail"].encode("utf-8"))
+    archive.close()
+    yield sink.drain()
+
+def _slide(t: dict, idx: int, title: str, content) -> str:
+    lines = []
+    has_bullets = False
+    if content:
+        has_bullets, lines = slide_lines(content)
+    heading = f"Slide {idx}: {title}"
+    if not lines:
+        return _fill(t["slides"]["empty"], MARK_HEADING, heading)
+    
+    before, line, after = t["slides"]["bullets" if has_bullets else "plain"]
+    # Lines after the first are set 2pt smaller on bullet slides
+    other_line = line.replace('sz="1800"', 'sz="1600"') if has_bullets else line
+    out = [_fill(before, MARK_HEADING, heading), _fill(line, MARK_PARAGRAPH, lines[0])]
+    out.extend(_fill(other_line, MARK_PARAGRAPH, text) for text in lines[1:])
+    out.append(after)
+    return "".join(out)
+
+def stream_pptx(project, titles, sections):
+    """Yield a presentation equivalent to render_pptx while sections are still being read.
+
+    Slide parts are written one by one; only presentation.xml, its rels and
+    the content types depend on the slide count, which titles gives up front.
+    """
+    t = pptx_template()
+    count = len(titles) + 1  # Title slide first
+    sink = _ZipStream()
+    archive = zipfile.ZipFile(sink, "w", compression=zipfile.ZIP_DEFLATED)
+    
+    # python-pptx lists overrides sorted by part name, so slide10 before slide2
+    overrides = "".join(
+        f'<Override PartName="/ppt/slides/{name}" ContentType="{SLIDE_CONTENT_TYPE}"/>'
+        for name in sorted(f"slide{n}.xml" for n in range(1, count + 1))
+    )
+    head, tail = t["content_types"]
+    archive.writestr(CONTENT_TYPES, head + overrides + tail)
+    
+    for name, data in t["parts"].items():
+        if name != PPTX_MAIN:
+            archive.writestr(name, data)
+            continue
+        rel_ids = [f"rId{t['next_rel'] + n}" for n in range(count)]
+        slide_ids = "".join(f'<p:sldId id="{256 + n}" r:id="{rel_id}"/>' for n, rel_id in enumerate(rel_ids))
+        archive.writestr(PPTX_MAIN, re.sub(r"<p:sldIdLst>.*?</p:sldIdLst>", f"<p:sldIdLst>{slide_ids}</p:sldIdLst>", data))
+        slide_rels = "".join(
+            f'<Relationship Id="{rel_id}" Type="{SLIDE_REL_TYPE}" Target="slides/slide{n}.xml"/>'
+            for n, rel_id in enumerate(rel_ids, 1)
+        )
+        archive.writestr(PPTX_RELS, t["rels"].replace("</Relationships>", slide_rels + "</Relationships>"))
+    
+    untitled = project.title == "Untitled Project"
+    title_slide = _fill(t["slides"]["title"], MARK_TITLE, project.topic if untitled else project.title)
+    title_slide = _fill(title_slide, MARK_TOPIC, _date_line() if untitled else project.topic)
+    archive.writestr("ppt/slides/slide1.xml", title_slide)
+    archive.writestr("ppt/slides/_rels/slide1.xml.rels", t["slides"]["title_rels"])
+    
+    for idx, (title, content) in enumerate(sections, 1):
+        archive.writestr(f"ppt/slides/slide{idx + 1}.xml", _slide(t, idx, title, content))
+        archive.writestr(f"ppt/slides/_rels/slide{idx + 1}.xml.rels", t["slides"]["plain_rels"])
+        chunk = _flush(sink)
+        if chunk:
+            yield chunk
+    for name, data in t["trailing_parts"].items():
+        archive.writestr(name, data)
+    archive.close()
+    yield sink.drain()
+
+def _section_batches(db, outline):
+    """Yield (title, content) for each (id, title) of outline, reading content a batch at a time"""
+    for start in range(0, len(outline), STREAM_BATCH_SIZE):
+        batch = outline[start:start + STREAM_BATCH_SIZE]
+        contents = dict(db.query(DocumentSection.id, DocumentSection.content).filter(
+            DocumentSection.id.in_([section_id for section_id, _ in batch])
+        ).all())
+        # End the read transaction between batches so a slow download holds no connection
+        db.rollback()
+        for section_id, title in batch:
+            yield title, contents.get(section_id)
+
+def stream_document(project_id: int, bind):
+    """Yield a project's DOCX or PPTX from its own session on bind, for a StreamingResponse"""
+    db = SessionLocal(bind=bind)
+    try:
+        project = db.query(Project.title, Project.topic, Project.document_type).filter(
+            Project.id == project_id
+        ).one()
+        outline = db.query(DocumentSection.id, DocumentSection.title).filter(
+            DocumentSection.project_id == project_id
+        ).order_by(DocumentSection.section_index).all()
+        db.rollback()
+        
+        writer = stream_docx if project.document_type == "docx" else stream_pptx
+        yield from writer(project, [title for _, title in outline], _section_batches(db, outline))
+    finally:
+        db.close()
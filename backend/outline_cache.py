@@ -0,0 +1,192 @@
+import os
+import re
+import threading
+import unicodedata
+import zlib
+
+# Topic vectors are hashed character trigrams. 256 dimensions keeps 100k
+# cached topics at ~100MB per document type while collisions stay well
+# below the similarity threshold for topics that share no wording.
+VECTOR_DIM = 256
+NGRAM = 3
+
+# Cosine similarity above which a cached outline is served for a new topic
+OUTLINE_CACHE_THRESHOLD = float(os.getenv("OUTLINE_CACHE_THRESHOLD", "0.9"))
+# Topics remembered per document type, oldest are replaced first. 0 disables the cache.
+OUTLINE_CACHE_SIZE = int(os.getenv("OUTLINE_CACHE_SIZE", "20000"))
+
+# Common shorthand spelled out so "Intro to ML" and "Introduction to machine
+# learning" share most of their trigrams
+ABBREVIATIONS = {
+    "intro": "introduction",
+    "ml": "machine learning",
+    "ai": "artificial intelligence",
+    "dl": "deep learning",
+    "nlp": "natural language processing",
+    "&": "and",
+    "vs": "versus",
+    "w/": "with",
+}
+
+def _np():
+    # NumPy is only needed once outlines are generated, see HEAVY_MODULES in main.py
+    import numpy
+    return numpy
+
+def normalize_topic(topic: str) -> str:
+    text = unicodedata.normalize("NFKD", topic).encode("ascii", "ignore").decode("ascii").lower()
+    words = re.findall(r"[a-z0-9]+|&|w/", text)
+    return " ".join(ABBREVIATIONS.get(word, word) for word in words)
+
+def number_signature(key: str) -> int:
+    """Hash of the words of a normalized topic that contain digits.
+
+    Years, quarters and versions barely move a trigram vector ("Marketing plan
+    for 2024" and "... 2025" score above 0.9), so near-duplicates must also
+    agree on these exactly.
+    """
+    return zlib.crc32(" ".join(word for word in key.split() if any(c.isdigit() for c in word)).encode("utf-8"))
+
+def vectorize(topic: str):
+    """Unit-length hashed trigram vector of a normalized topic.
+
+    crc32 rather than hash() so vectors agree between worker processes, and
+    a sign bit from the hash so colliding trigrams tend to cancel out.
+    """
+    np = _np()
+    vector = np.zeros(VECTOR_DIM, dtype=np.float32)
+    text = f" {normalize_topic(topic)} "
+    for i in range(len(text) - NGRAM + 1):
+        h = zlib.crc32(text[i:i + NGRAM].encode("utf-8"))
+        vector[h % VECTOR_DIM] += 1.0 if h & 0x80000000 else -1.0
+    norm = np.linalg.norm(vector)
+    if norm:
+        vector /= norm
+    return vector
+
+class _TypeIndex:
+    """Topic vectors and outlines of one document type, in a fixed-size ring"""
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.vectors = None
+        self.owners = None
+        self.numbers = None
+        self.topics = []
+        self.keys = []
+        self.outlines = []
+        self.slots_by_key = {}
+        self.next_slot = 0
+
+    def __len__(self):
+        return len(self.outlines)
+
+    def find(self, key: str):
+        """Slot of a topic that normalizes to exactly key, whoever cached it"""
+        return self.slots_by_key.get(key)
+
+    def search(self, vector, user_id: int, numbers: int):
+        """Closest of the topics cached for user_id that have the same numbers"""
+        if not self.outlines:
+            return None, 0.0
+        np = _np()
+        count = len(self.outlines)
+        # Other users' entries, and topics with other numbers, score below any cosine similarity
+        eligible = (self.owners[:count] == user_id) & (self.numbers[:count] == numbers)
+        scores = np.where(eligible, self.vectors[:count] @ vector, -2.0)
+        best = int(scores.argmax())
+        return best, float(scores[best])
+
+    def add(self, vector, user_id: int, topic: str, key: str, outline):
+        np = _np()
+        if self.vectors is None:
+            self.vectors = np.zeros((min(self.capacity, 1024), VECTOR_DIM), dtype=np.float32)
+            self.owners = np.zeros(len(self.vectors), dtype=np.int64)
+            self.numbers = np.zeros(len(self.vectors), dtype=np.int64)
+        slot = self.next_slot
+        if slot >= len(self.vectors):
+            grown = np.zeros((min(self.capacity, len(self.vectors) * 2), VECTOR_DIM), dtype=np.float32)
+            grown[:len(self.vectors)] = self.vectors
+            self.vectors = grown
+            grown_owners = np.zeros(len(grown), dtype=np.int64)
+            grown_owners[:len(self.owners)] = self.owners
+            self.owners = grown_owners
+            grown_numbers = np.zeros(len(grown), dtype=np.int64)
+            grown_numbers[:len(self.numbers)] = self.numbers
+            self.numbers = grown_numbers
+        self.vectors[slot] = vector
+        self.owners[slot] = user_id
+        self.numbers[slot] = number_signature(key)
+        if slot < len(self.outlines):
+            if self.slots_by_key.get(self.keys[slot]) == slot:
+                del self.slots_by_key[self.keys[slot]]
+            self.topics[slot] = topic
+            self.keys[slot] = key
+            self.outlines[slot] = outline
+        else:
+            self.topics.append(topic)
+            self.keys.append(key)
+            self.outlines.append(outline)
+        self.slots_by_key[key] = slot
+        self.next_slot = (slot + 1) % self.capacity
+
+class OutlineCache:
+    """In-memory near-duplicate cache of AI outlines, keyed by topic similarity.
+
+    A user is served outlines cached for their own similar topics with the
+    same numbers in them. Another
+    user's outline is only served for a topic that normalizes to exactly
+    the same words: the outline prompt contains nothing but the topic, so
+    such a hit returns what the user's own request would have produced.
+    Merely similar topics of other users can differ in names or details
+    ("John Smith" vs "John Smyth") that must not leak between accounts.
+    Both search the vectors with NumPy, so callers on the event loop run
+    get and put in a thread.
+    """
+
+    def __init__(self, capacity: int = OUTLINE_CACHE_SIZE, threshold: float = OUTLINE_CACHE_THRESHOLD):
+        self.capacity = capacity
+        self.threshold = threshold
+        self._indexes = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, document_type: str, topic: str, user_id: int):
+        """Return (outline, cached_topic) for the closest cached topic, or (None, None)"""
+        if self.capacity <= 0:
+            return None, None
+        index = self._indexes.get(document_type)
+        key = normalize_topic(topic)
+        vector = vectorize(topic)
+        with self._lock:
+            best = index.find(key) if index else None
+            score = 1.0
+            if best is None:
+                best, score = index.search(vector, user_id, number_signature(key)) if index else (None, 0.0)
+            if best is None or score < self.threshold:
+                self.misses += 1
+                return None, None
+            self.hits += 1
+            return list(index.outlines[best]), index.topics[best]
+
+    def put(self, document_type: str, topic: str, user_id: int, outline):
+        if self.capacity <= 0 or not outline:
+            return
+        key = normalize_topic(topic)
+        vector = vectorize(topic)
+        with self._lock:
+            index = self._indexes.setdefault(document_type, _TypeIndex(self.capacity))
+            index.add(vector, user_id, topic, key, list(outline))
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": {doc_type: len(index) for doc_type, index in self._indexes.items()},
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            "threshold": self.threshold
+        }
+
+outline_cache = OutlineCache()
@@ -0,0 +1,175 @@
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.responses import Response
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+from collections import OrderedDict
+from typing import Optional
+import html
+import os
+import re
+
+from database import User, Project, DocumentSection
+from profiling import TimedRoute, phase
+from auth import get_current_user
+from replicas import get_read_db
+from responses import weak_etag, is_not_modified, not_modified
+from projects import project_etag
+from export import content_blocks, slide_lines
+
+router = APIRouter(route_class=TimedRoute)
+
+# Rendered section bodies kept per process, least recently used dropped first
+PREVIEW_CACHE_SIZE = int(os.getenv("PREVIEW_CACHE_SIZE", "5000"))
+
+MEDIA_TYPES = {
+    "html": "text/html; charset=utf-8",
+    "markdown": "text/markdown; charset=utf-8"
+}
+
+# Characters that start Markdown inline markup, links, HTML or entities anywhere in a line
+MARKDOWN_INLINE = re.compile(r"([\\`*_\[\]<>|~&])")
+# Headings, quotes, list items, rules and setext underlines at the start of a line
+MARKDOWN_BLOCK_MARKER = re.compile(r"^(\s*)([#>+=-])", re.MULTILINE)
+MARKDOWN_ORDERED_ITEM = re.compile(r"^(\s*\d+)([.)])", re.MULTILINE)
+
+def markdown_escape(text: str) -> str:
+    """Backslash-escape user text so Markdown shows it literally, as html.escape does for HTML"""
+    text = MARKDOWN_INLINE.sub(r"\\\1", text)
+    text = MARKDOWN_ORDERED_ITEM.sub(r"\1\\\2", text)
+    return MARKDOWN_BLOCK_MARKER.sub(r"\1\\\2", text)
+
+def render_body(content: Optional[str], document_type: str, fmt: str) -> str:
+    """Section content as an HTML or Markdown fragment, laid out like the export"""
+    if not content:
+        return ""
+    if document_type == "pptx":
+        _, blocks = slide_lines(content)
+        bullets = True  # Slide body placeholders show every line as a bullet
+    else:
+        bullets, blocks = content_blocks(content)
+    
+    if fmt == "markdown":
+        if bullets:
+            return "\n".join(f"- {markdown_escape(block)}" for block in blocks) + "\n\n"
+        return "".join(f"{markdown_escape(block)}\n\n" for block in blocks)
+    if bullets:
+        return "<ul>" + "".join(f"<li>{html.escape(block)}</li>" for block in blocks) + "</ul>"
+    return "".join(f"<p>{html.escape(block)}</p>" for block in blocks)
+
+def render_heading(index: int, title: str, document_type: str, fmt: str) -> str:
+    # Numbered the same way as the exported document
+    prefix = f"Slide {index}: " if document_type == "pptx" else f"{index}. "
+    if fmt == "markdown":
+        return f"## {prefix}{markdown_escape(title)}\n\n"
+    return f"<h2>{html.escape(prefix + title)}</h2>"
+
+class FragmentCache:
+    """LRU cache of rendered section bodies, keyed by section version and format"""
+
+    def __init__(self, capacity: int = PREVIEW_CACHE_SIZE):
+        self.capacity = capacity
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        fragment = self._entries.get(key)
+        if fragment is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return fragment
+
+    def put(self, key, fragment: str):
+        if self.capacity <= 0:
+            return
+        self._entries[key] = fragment
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.capacity:
+            self._entries.popitem(last=False)
+
+fragment_cache = FragmentCache()
+
+@router.get("/{project_id}")
+async def preview_project(
+    project_id: int,
+    request: Request,
+    fmt: str = Query("html", alias="format", pattern="^(html|markdown)$"),
+    start: int = Query(0, ge=0, description="section_index of the first section to render"),
+    end: Optional[int] = Query(None, ge=0, description="section_index after the last section to render, all remaining if omitted"),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_read_db)
+):
+    """Render a project, or a range of its sections, as HTML or Markdown.
+
+    Section bodies are rendered once per section version and then served from
+    the cache, so after an edit only the changed sections are rendered again.
+    """
+    version = project_etag(db, project_id, current_user.id)
+    if version is None:
+        raise HTTPException(status_code=404, detail="Project not found")
+    etag = weak_etag(version, fmt, start, end)
+    if is_not_modified(request, etag):
+        return not_modified(etag)
+    
+    project = db.query(Project.title, Project.topic, Project.document_type).filter(
+        Project.id == project_id
+    ).one()
+    if end is not None and start > end:
+        raise HTTPException(status_code=400, detail="start must not be after end")
+    in_range = [DocumentSection.project_id == project_id, DocumentSection.section_index >= start]
+    if end is not None:
+        in_range.append(DocumentSection.section_index < end)
+    selected = db.query(
+        DocumentSection.id,
+        DocumentSection.section_index,
+        DocumentSection.title,
+        DocumentSection.updated_at
+    ).filter(*in_range).order_by(DocumentSection.section_index, DocumentSection.id).all()
+    # Headings are numbered by position in the whole document, as in the export
+    total, before = db.query(
+        func.count(DocumentSection.id),
+        func.count(DocumentSection.id).filter(DocumentSection.section_index < start)
+    ).filter(DocumentSection.project_id == project_id).one()
+    
+    keys = {s.id: (s.id, s.updated_at, project.document_type, fmt) for s in selected}
+    bodies = {}
+    for section_id, key in keys.items():
+        fragment = fragment_cache.get(key)
+        if fragment is not None:
+            bodies[section_id] = fragment
+    missing = [section_id for section_id in keys if section_id not in bodies]
+    if missing:
+        # Content is only loaded for sections whose current version is not cached yet
+        for section_id, content in db.query(DocumentSection.id, DocumentSection.content).filter(
+            DocumentSection.id.in_(missing)
+        ):
+            with phase("render"):
+                bodies[section_id] = render_body(content, project.document_type, fmt)
+            fragment_cache.put(keys[section_id], bodies[section_id])
+    
+    title = project.title if project.title != "Untitled Project" else project.topic
+    parts = []
+    if start == 0:
+        if fmt == "markdown":
+            parts.append(f"# {markdown_escape(title)}\n\n")
+            if project.title != "Untitled Project":
+                parts.append(f"*{markdown_escape(project.topic)}*\n\n")
+        else:
+            parts.append(f"<h1>{html.escape(title)}</h1>")
+            if project.title != "Untitled Project":
+                parts.append(f"<p><em>{html.escape(project.topic)}</em></p>")
+    for index, section in enumerate(selected, before + 1):
+        if fmt == "html":
+            parts.append(f'<section id="section-{section.id}">')
+        parts.append(render_heading(index, section.title, project.document_type, fmt))
+        parts.append(bodies.get(section.id, ""))
+        if fmt == "html":
+            parts.append("</section>")
+    
+    return Response(
+        "".join(parts),
+        media_type=MEDIA_TYPES[fmt],
+        headers={"ETag": etag, "X-Total-Sections": str(total)}
+    )
@@ -0,0 +1,266 @@
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import FileResponse
+from fastapi.routing import APIRoute
+from starlette.datastructures import Headers, MutableHeaders, QueryParams
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from contextlib import contextmanager
+from contextvars import ContextVar
+from collections import Counter
+from datetime import datetime
+import asyncio
+import functools
+import hmac
+import inspect
+import os
+import re
+import sys
+import tempfile
+import threading
+import time
+
+router = APIRouter()
+
+# Requests sent with ?profile=true and this value in an X-Profile-Token header
+# run under the sampling profiler. Profiling is disabled while it is unset.
+PROFILE_SECRET = os.getenv("PROFILE_SECRET", "")
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "5"))
+# Profiles are shared by all workers on the host, the newest PROFILE_KEEP are kept
+PROFILE_DIR = os.getenv("PROFILE_DIR", os.path.join(tempfile.gettempdir(), "docgen-profiles"))
+PROFILE_KEEP = 200
+
+PROFILE_NAME = re.compile(r"[\w.-]+\.folded")
+
+# Threads whose innermost Python frame is in one of these are waiting for work
+# (or for the event loop to wake up) and are left out of samples
+IDLE_FILES = ("threading.py", "selectors.py", "queue.py")
+# Idle executor threads block in C on their work queue, inside this function
+IDLE_FUNCTIONS = {("thread.py", "_worker")}
+
+# Order of the phases in the Server-Timing header, others follow
+PHASES = ("auth", "db", "queue", "model", "render", "serialize")
+
+class RequestTimings:
+    """Seconds spent per phase while handling one request.
+
+    Phases can overlap (queries made during auth count as db too) and calls
+    made concurrently for one request add up, so they need not sum to total.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.phases = {}
+        self.queries = 0
+        self.handler_done = None
+        self._lock = threading.Lock()
+
+    def add(self, name: str, seconds: float):
+        # Threadpool and model threads of the same request report here too
+        with self._lock:
+            self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    def add_query(self, seconds: float):
+        with self._lock:
+            self.phases["db"] = self.phases.get("db", 0.0) + seconds
+            self.queries += 1
+
+    def header(self) -> str:
+        now = time.perf_counter()
+        if self.handler_done is not None:
+            self.add("serialize", now - self.handler_done)
+        names = [name for name in PHASES if name in self.phases]
+        names += [name for name in self.phases if name not in PHASES]
+        entries = []
+        for name in names:
+            entry = f"{name};dur={self.phases[name] * 1000:.1f}"
+            if name == "db":
+                entry += f';desc="{self.queries} queries"'
+            entries.append(entry)
+        entries.append(f"total;dur={(now - self.started) * 1000:.1f}")
+        return ", ".join(entries)
+
+_current = ContextVar("request_timings", default=None)
+
+@contextmanager
+def phase(name: str):
+    """Count the time spent in the block towards a phase of the current request"""
+    timings = _current.get()
+    if timings is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.add(name, time.perf_counter() - started)
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _query_started(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context.query_started = time.perf_counter()
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _query_finished(conn, cursor, statement, parameters, context, executemany):
+    timings = _current.get()
+    if timings is not None and context is not None:
+        timings.add_query(time.perf_counter() - context.query_started)
+
+def _note_handler_done(endpoint):
+    if getattr(endpoint, "notes_handler_done", False):
+        return endpoint
+    
+    if inspect.iscoroutinefunction(endpoint):
+        @functools.wraps(endpoint)
+        async def wrapper(*args, **kwargs):
+            result = await endpoint(*args, **kwargs)
+            _mark_handler_done()
+            return result
+    else:
+        @functools.wraps(endpoint)
+        def wrapper(*args, **kwargs):
+            result = endpoint(*args, **kwargs)
+            _mark_handler_done()
+            return result
+    wrapper.notes_handler_done = True
+    return wrapper
+
+def _mark_handler_done():
+    timings = _current.get()
+    if timings is not None:
+        timings.handler_done = time.perf_counter()
+
+class TimedRoute(APIRoute):
+    """Route that notes when its handler returned, so validating and encoding the response is timed as serialize"""
+
+    def __init__(self, path: str, endpoint, **kwargs):
+        super().__init__(path, _note_handler_done(endpoint), **kwargs)
+
+def _idle(code) -> bool:
+    filename = os.path.basename(code.co_filename)
+    return filename in IDLE_FILES or (filename, code.co_name) in IDLE_FUNCTIONS
+
+class SamplingProfiler:
+    """Wall-clock sampler of every busy thread in this process, until stopped"""
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own or _idle(frame.f_code):
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                self.stacks[";".join(reversed(stack))] += 1
+            self.samples += 1
+
+    def collapsed(self) -> str:
+        """Samples in the folded format flamegraph.pl and speedscope read"""
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+def _authorized(token) -> bool:
+    return bool(PROFILE_SECRET) and token is not None and hmac.compare_digest(token, PROFILE_SECRET)
+
+def _wants_profile(scope) -> bool:
+    flag = QueryParams(scope["query_string"]).get("profile", "")
+    return flag.lower() in ("1", "true") and _authorized(Headers(scope=scope).get("x-profile-token"))
+
+def _profile_name(scope) -> str:
+    path = re.sub(r"[^\w-]+", "_", scope["path"]).strip("_")[:80]
+    return f"{datetime.now().strftime('%Y%m%d-%H%M%S-%f')}-{scope['method']}-{path}-{os.getpid()}.folded"
+
+def _save_profile(name: str, profiler: SamplingProfiler):
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    with open(os.path.join(PROFILE_DIR, name), "w", encoding="utf-8") as f:
+        f.write(profiler.collapsed())
+    
+    names = sorted(n for n in os.listdir(PROFILE_DIR) if PROFILE_NAME.fullmatch(n))
+    for old in names[:-PROFILE_KEEP]:
+        try:
+            os.remove(os.path.join(PROFILE_DIR, old))
+        except FileNotFoundError:
+            pass
+
+def _finish_profile(name: str, profiler: SamplingProfiler):
+    profiler.stop()
+    _save_profile(name, profiler)
+    print(f"Saved profile {name} ({profiler.samples} samples)")
+
+class ServerTimingMiddleware:
+    """Send per-phase timings of every request as a Server-Timing header.
+
+    Requests with ?profile=true and a valid X-Profile-Token also run under
+    the sampling profiler until their response is complete; the saved profile is named
+    in the X-Profile response header.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        
+        timings = RequestTimings()
+        token = _current.set(timings)
+        profiler = None
+        if _wants_profile(scope):
+            profile_name = _profile_name(scope)
+            profiler = SamplingProfiler(PROFILE_INTERVAL_MS / 1000)
+            profiler.start()
+
+        async def send_with_timings(message):
+            if message["type"] == "http.response.start":
+                # Work a streamed body does after this is not included
+                headers = MutableHeaders(scope=message)
+                headers.append("Server-Timing", timings.header())
+                if profiler is not None:
+                    headers.append("X-Profile", profile_name)
+            await send(message)
+        
+        try:
+            await self.app(scope, receive, send_with_timings)
+        finally:
+            _current.reset(token)
+            if profiler is not None:
+                # Joining the sampler and writing the file block, keep them off the event loop
+                await asyncio.to_thread(_finish_profile, profile_name, profiler)
+
+@router.get("")
+async def list_profiles(request: Request):
+    if not _authorized(request.headers.get("x-profile-token")):
+        raise HTTPException(status_code=403, detail="Profiling is not enabled for this token")
+    try:
+        names = [n for n in os.listdir(PROFILE_DIR) if PROFILE_NAME.fullmatch(n)]
+    except FileNotFoundError:
+        names = []
+    return {"profiles": sorted(names, reverse=True)}
+
+@router.get("/{name}")
+async def get_profile(name: str, request: Request):
+    """Download a saved profile as collapsed stacks"""
+    if not _authorized(request.headers.get("x-profile-token")):
+        raise HTTPException(status_code=403, detail="Profiling is not enabled for this token")
+    path = os.path.join(PROFILE_DIR, name)
+    if not PROFILE_NAME.fullmatch(name) or not os.path.isfile(path):
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return FileResponse(path, media_type="text/plain; charset=utf-8", filename=name)
@@ -1,13 +1,29 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Request, status
+from sqlalchemy import update, delete, case, func, select
 from sqlalchemy.orm import Session
 from pydantic import BaseModel
 from typing import List, Optional
 from datetime import datetime
+import asyncio
+import os
 
-from database import get_db, User, Project, DocumentStructure, DocumentSection
+from database import (
+    get_db, SessionLocal, User, Project, DocumentStructure, DocumentSection, Refinement,
+    SectionRevision, GenerationCancellation, GenerationCheckpoint
+)
+from profiling import TimedRoute
 from auth import get_current_user
+from search import remove_sections, remove_project_documents
+from cancellation import cancel_project
+from singleflight import cross_process_lock
+from replicas import get_read_db
+from responses import FastJSONResponse, weak_etag, is_not_modified, not_modified
 
-router = APIRouter()
+router = APIRouter(route_class=TimedRoute)
+
+# Rows deleted per transaction when purging a deleted project. Short
+# transactions keep the purge from holding locks other requests are waiting on.
+PURGE_BATCH_SIZE = int(os.getenv("PURGE_BATCH_SIZE", "5000"))
 
 class ProjectCreate(BaseModel):
     title: str
@@ -17,6 +33,15 @@ class ProjectCreate(BaseModel):
 class ProjectStructureCreate(BaseModel):
     structure_data: List[str]  # Section headers for docx, slide titles for pptx
 
+class StructureOperation(BaseModel):
+    op: str  # "insert", "move", "delete" or "rename"
+    index: int  # Position the operation applies to, against the outline as left by earlier operations
+    to_index: Optional[int] = None  # Target position for "move"
+    title: Optional[str] = None  # New title for "insert" and "rename"
+
+class StructureOperationsRequest(BaseModel):
+    operations: List[StructureOperation]
+
 class ProjectResponse(BaseModel):
     id: int
     title: str
@@ -53,20 +78,101 @@ async def create_project(
 @router.get("", response_model=List[ProjectResponse])
 async def get_projects(
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db)
 ):
-    projects = db.query(Project).filter(Project.user_id == current_user.id).all()
+    projects = db.query(Project).filter(
+        Project.user_id == current_user.id,
+        Project.deleted_at.is_(None)
+    ).all()
     return projects
 
+SECTION_COLUMNS = (
+    DocumentSection.id,
+    DocumentSection.section_index,
+    DocumentSection.title,
+    DocumentSection.content,
+    DocumentSection.current_revision,
+    DocumentSection.generated_at,
+    DocumentSection.updated_at
+)
+
+def section_rows(db: Session, project_id: int) -> List[dict]:
+    """Sections of a project as response-ready dicts, in outline order.
+
+    Selects only the response columns, so no ORM objects or identity map
+    entries are created for potentially hundreds of long sections.
+    """
+    rows = db.query(*SECTION_COLUMNS).filter(
+        DocumentSection.project_id == project_id
+    ).order_by(DocumentSection.section_index).all()
+    return [
+        {
+            "id": r.id,
+            "section_index": r.section_index,
+            "title": r.title,
+            "content": r.content,
+            "version": r.current_revision,
+            "generated_at": r.generated_at,
+            "updated_at": r.updated_at
+        }
+        for r in rows
+    ]
+
+def project_etag(db: Session, project_id: int, user_id: int) -> Optional[str]:
+    """Weak ETag covering a project, its structure and its sections.
+
+    Computed with one query over indexed columns, without loading any content.
+    Returns None if the project does not exist or belongs to someone else.
+    """
+    structure_updated = select(DocumentStructure.updated_at).where(
+        DocumentStructure.project_id == Project.id
+    ).scalar_subquery()
+    section_count = select(func.count(DocumentSection.id)).where(
+        DocumentSection.project_id == Project.id
+    ).scalar_subquery()
+    sections_updated = select(func.max(DocumentSection.updated_at)).where(
+        DocumentSection.project_id == Project.id
+    ).scalar_subquery()
+    
+    version = db.query(
+        Project.updated_at, structure_updated, section_count, sections_updated
+    ).filter(
+        Project.id == project_id,
+        Project.user_id == user_id,
+        Project.deleted_at.is_(None)
+    ).first()
+    
+    if not version:
+        return None
+    return weak_etag(project_id, *version)
+
 @router.get("/{project_id}", response_model=ProjectDetailResponse)
 async def get_project(
     project_id: int,
+    request: Request,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db)
 ):
-    project = db.query(Project).filter(
+    etag = project_etag(db, project_id, current_user.id)
+    if etag is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Project not found"
+        )
+    if is_not_modified(request, etag):
+        return not_modified(etag)
+    
+    project = db.query(
+        Project.id,
+        Project.title,
+        Project.document_type,
+        Project.topic,
+        Project.created_at,
+        Project.updated_at
+    ).filter(
         Project.id == project_id,
-        Project.user_id == current_user.id
+        Project.user_id == current_user.id,
+        Project.deleted_at.is_(None)
     ).first()
     
     if not project:
@@ -76,26 +182,17 @@ async def get_project(
         )
     
     structure = None
-    if project.structure:
-        structure = {"structure_data": project.structure.structure_data}
+    structure_data = db.query(DocumentStructure.structure_data).filter(
+        DocumentStructure.project_id == project.id
+    ).scalar()
+    if structure_data is not None:
+        structure = {"structure_data": structure_data}
     
-    sections = [
-        {
-            "id": s.id,
-            "section_index": s.section_index,
-            "title": s.title,
-            "content": s.content,
-            "generated_at": s.generated_at,
-            "updated_at": s.updated_at
-        }
-        for s in sorted(project.sections, key=lambda x: x.section_index)
-    ]
-    
-    return {
-        **project.__dict__,
+    return FastJSONResponse({
+        **project._asdict(),
         "structure": structure,
-        "sections": sections
-    }
+        "sections": section_rows(db, project.id)
+    }, headers={"ETag": etag})
 
 @router.post("/{project_id}/structure")
 async def save_project_structure(
@@ -106,7 +203,8 @@ async def save_project_structure(
 ):
     project = db.query(Project).filter(
         Project.id == project_id,
-        Project.user_id == current_user.id
+        Project.user_id == current_user.id,
+        Project.deleted_at.is_(None)
     ).first()
     
     if not project:
@@ -130,15 +228,150 @@ async def save_project_structure(
     
     return {"message": "Structure saved successfully"}
 
+def apply_structure_operations(titles: List[str], operations: List[StructureOperation]):
+    """Apply outline operations in order.
+
+    Returns the resulting slots as (original_index, title) pairs, where
+    original_index is None for inserted entries, so callers can tell which
+    existing sections moved, were renamed or disappeared.
+    """
+    slots = list(enumerate(titles))
+    for position, operation in enumerate(operations):
+        invalid = HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Invalid operation #{position}: {operation.op} at index {operation.index}"
+        )
+        if operation.op == "insert":
+            if operation.title is None or not 0 <= operation.index <= len(slots):
+                raise invalid
+            slots.insert(operation.index, (None, operation.title))
+        elif not 0 <= operation.index < len(slots):
+            raise invalid
+        elif operation.op == "delete":
+            slots.pop(operation.index)
+        elif operation.op == "rename":
+            if operation.title is None:
+                raise invalid
+            slots[operation.index] = (slots[operation.index][0], operation.title)
+        elif operation.op == "move":
+            if operation.to_index is None or not 0 <= operation.to_index < len(slots):
+                raise invalid
+            slots.insert(operation.to_index, slots.pop(operation.index))
+        else:
+            raise invalid
+    return slots
+
+@router.post("/{project_id}/structure/operations")
+async def apply_project_structure_operations(
+    project_id: int,
+    request: StructureOperationsRequest,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Insert, move, delete and rename outline entries in one transaction.
+
+    Existing DocumentSection rows follow their titles to their new positions with
+    a single bulk UPDATE, so reordering never mixes up content and never needs a
+    regeneration. Section content is not loaded or rewritten.
+    """
+    project = db.query(Project).filter(
+        Project.id == project_id,
+        Project.user_id == current_user.id,
+        Project.deleted_at.is_(None)
+    ).first()
+    
+    if not project:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Project not found"
+        )
+    
+    titles = project.structure.structure_data if project.structure else []
+    slots = apply_structure_operations(titles, request.operations)
+    new_index = {old: new for new, (old, _) in enumerate(slots) if old is not None}
+    new_title = {old: title for old, title in slots if old is not None}
+    
+    sections = db.query(
+        DocumentSection.id,
+        DocumentSection.section_index,
+        DocumentSection.title
+    ).filter(DocumentSection.project_id == project.id).order_by(
+        DocumentSection.section_index, DocumentSection.id
+    ).all()
+    
+    deleted_ids = []
+    index_changes = {}
+    title_changes = {}
+    mapped = set()
+    outside = []
+    for section_id, section_index, section_title in sections:
+        if section_index >= len(titles) or section_index in mapped:
+            # Not part of the outline, or a second row for one entry: kept, after the outline
+            outside.append((section_id, section_index))
+            continue
+        mapped.add(section_index)
+        if section_index not in new_index:
+            deleted_ids.append(section_id)
+            continue
+        if new_index[section_index] != section_index:
+            index_changes[section_id] = new_index[section_index]
+        if new_title[section_index] != section_title:
+            title_changes[section_id] = new_title[section_index]
+    
+    # Every section ends up with its own index, so an inserted or moved entry
+    # never shares one with a row that was outside the outline
+    for offset, (section_id, section_index) in enumerate(outside):
+        if section_index != len(slots) + offset:
+            index_changes[section_id] = len(slots) + offset
+    
+    if deleted_ids:
+        db.execute(delete(Refinement).where(Refinement.section_id.in_(deleted_ids)))
+        db.execute(delete(SectionRevision).where(SectionRevision.section_id.in_(deleted_ids)))
+        db.execute(delete(DocumentSection).where(DocumentSection.id.in_(deleted_ids)))
+        remove_sections(db, deleted_ids)
+    
+    changed_ids = set(index_changes) | set(title_changes)
+    if changed_ids:
+        # Bumped so section versions (preview cache, project ETag) see the change
+        values = {"updated_at": datetime.utcnow()}
+        if index_changes:
+            values["section_index"] = case(index_changes, value=DocumentSection.id, else_=DocumentSection.section_index)
+        if title_changes:
+            values["title"] = case(title_changes, value=DocumentSection.id, else_=DocumentSection.title)
+        db.execute(
+            update(DocumentSection)
+            .where(DocumentSection.id.in_(changed_ids))
+            .values(**values)
+            .execution_options(synchronize_session=False)
+        )
+    
+    structure_data = [title for _, title in slots]
+    if project.structure:
+        project.structure.structure_data = structure_data
+        project.structure.updated_at = datetime.utcnow()
+    else:
+        db.add(DocumentStructure(project_id=project.id, structure_data=structure_data))
+    
+    db.commit()
+    
+    return {
+        "structure_data": structure_data,
+        "sections_moved": len(index_changes),
+        "sections_renamed": len(title_changes),
+        "sections_deleted": len(deleted_ids)
+    }
+
 @router.delete("/{project_id}")
 async def delete_project(
     project_id: int,
+    background_tasks: BackgroundTasks,
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
     project = db.query(Project).filter(
         Project.id == project_id,
-        Project.user_id == current_user.id
+        Project.user_id == current_user.id,
+        Project.deleted_at.is_(None)
     ).first()
     
     if not project:
@@ -147,8 +380,73 @@ async def delete_project(
             detail="Project not found"
         )
     
-    db.delete(project)
+    # Hide the project right away and stop any generation still writing to it;
+    # its rows are removed in the background
+    project.deleted_at = datetime.utcnow()
+    remove_project_documents(db.connection(), project.id)
     db.commit()
+    cancel_project(db, project.id)
+    background_tasks.add_task(purge_project, project.id)
     
     return {"message": "Project deleted successfully"}
 
+def purge_project(project_id: int):
+    """Delete a soft-deleted project and everything under it, in batches.
+
+    Children go first so each batch is a bounded DELETE of one table; the final
+    project delete then leaves nothing for ON DELETE CASCADE to do in one go.
+    """
+    db = SessionLocal()
+    try:
+        if db.query(Project.deleted_at).filter(Project.id == project_id).scalar() is None:
+            return
+        
+        section_ids = select(DocumentSection.id).where(DocumentSection.project_id == project_id)
+        for model, condition in (
+            (Refinement, Refinement.project_id == project_id),
+            (SectionRevision, SectionRevision.section_id.in_(section_ids)),
+            (DocumentSection, DocumentSection.project_id == project_id),
+            (DocumentStructure, DocumentStructure.project_id == project_id),
+        ):
+            while True:
+                batch = select(model.id).where(condition).limit(PURGE_BATCH_SIZE)
+                result = db.execute(
+                    delete(model).where(model.id.in_(batch)).execution_options(synchronize_session=False)
+                )
+                db.commit()
+                if result.rowcount < PURGE_BATCH_SIZE:
+                    break
+        
+        db.execute(delete(GenerationCancellation).where(GenerationCancellation.project_id == project_id))
+        db.execute(delete(GenerationCheckpoint).where(GenerationCheckpoint.project_id == project_id))
+        db.execute(delete(Project).where(Project.id == project_id))
+        db.commit()
+    except Exception as e:
+        # Left for the next startup sweep to finish
+        print(f"Error purging project {project_id}: {str(e)}")
+        db.rollback()
+    finally:
+        db.close()
+
+def purge_deleted_projects():
+    """Finish purges interrupted by a restart"""
+    db = SessionLocal()
+    try:
+        project_ids = [pid for (pid,) in db.query(Project.id).filter(Project.deleted_at.isnot(None)).all()]
+    finally:
+        db.close()
+    for project_id in project_ids:
+        purge_project(project_id)
+
+async def purge_deleted_projects_once() -> bool:
+    """purge_deleted_projects at startup, in one server process at a time.
+
+    Every worker calls this as it starts; whichever gets the lock first does
+    the purge and the others skip it instead of deleting the same rows.
+    Returns whether this process ran it.
+    """
+    async with cross_process_lock("purge-deleted-projects", wait_seconds=0) as acquired:
+        if acquired:
+            await asyncio.to_thread(purge_deleted_projects)
+        return acquired
+
@@ -1,16 +1,31 @@
-import google.generativeai as genai
 import os
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from sqlalchemy import func, or_, and_
 from sqlalchemy.orm import Session
 from pydantic import BaseModel
 from typing import Optional
 from datetime import datetime
+import base64
 
-from database import get_db, User, Project, DocumentSection, Refinement
+from database import get_db, SessionLocal, User, Project, DocumentSection, Refinement, SectionRevision
+from profiling import TimedRoute
+from replicas import get_read_db
 from auth import get_current_user
-from generation import generate_content_with_gemini
+from generation import generate_content_with_gemini, build_prompt
+from revisions import record_revision, ensure_current_revision, get_revision_content, WRITE_CONFLICTS, CONFLICT_DETAIL
+from singleflight import model_calls, cross_process_lock
+from cancellation import cancel_scope, GenerationCancelled, RETRY_AFTER_SECONDS
+from draining import accepting_work
+from scheduler import call_model, INTERACTIVE
+from idempotency import idempotency_keys
+from token_budget import (
+    count_tokens, split_context, check_request_budget, check_user_budget,
+    REFINE_CONTEXT_TOKENS
+)
 
-router = APIRouter()
+router = APIRouter(route_class=TimedRoute)
+
+HISTORY_MAX_PAGE_SIZE = 200
 
 def get_gemini_api_key():
     """Get Gemini API key from environment"""
@@ -40,9 +55,10 @@ class RefinementResponse(BaseModel):
     refinement_prompt: Optional[str]
     created_at: datetime
 
-@router.post("/refine")
+@router.post("/refine", dependencies=[Depends(accepting_work)])
 async def refine_section(
     request: RefinementRequest,
+    http_request: Request,
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
@@ -52,7 +68,8 @@ async def refine_section(
     
     project = db.query(Project).filter(
         Project.id == request.project_id,
-        Project.user_id == current_user.id
+        Project.user_id == current_user.id,
+        Project.deleted_at.is_(None)
     ).first()
     
     if not project:
@@ -69,25 +86,125 @@ async def refine_section(
     if not section.content:
         raise HTTPException(status_code=400, detail="Section has no content to refine")
     
+    # Identical refinements of the same section arriving together (double
+    # submits, retries) are run once and share the result
+    requested_at = datetime.utcnow()
+    
+    async def refine():
+        # Checked only when the request runs: a retry whose key already has a
+        # stored result gets it replayed even once the budget is used up
+        input_tokens = count_tokens(build_refinement_prompt(project, section, request.refinement_prompt))
+        check_request_budget(input_tokens)
+        check_user_budget(db, current_user.id, input_tokens)
+        
+        async with cancel_scope(http_request, project.id) as scope:
+            try:
+                return await scope.run(lambda: model_calls.do(
+                    ("refine", section.id, request.refinement_prompt),
+                    lambda: run_refinement(project.id, section.id, request.refinement_prompt, requested_at)
+                ))
+            except GenerationCancelled as e:
+                raise e.to_http()
+    
+    # Retries sent with the same Idempotency-Key get the stored response instead
+    # of refining (and recording) the section again
+    return await idempotency_keys.run(http_request, current_user.id, request.model_dump(), refine)
+
+async def run_refinement(project_id: int, section_id: int, refinement_prompt: str, requested_at: datetime):
+    """Refine a section once across all server processes, in its own session.
+
+    If another process already applied the same refinement while this one
+    waited for the lock, that refinement is returned instead of a second call;
+    if it is still running when the wait runs out, the answer is a 503.
+    """
+    db = SessionLocal()
+    try:
+        # Held in this session's transaction until apply_refinement commits
+        async with cross_process_lock(f"refine:{section_id}:{refinement_prompt}", db=db) as acquired:
+            if not acquired:
+                raise HTTPException(
+                    status_code=503,
+                    detail="This refinement is still running for another request, please retry",
+                    headers={"Retry-After": str(RETRY_AFTER_SECONDS)}
+                )
+            done = db.query(Refinement).filter(
+                Refinement.section_id == section_id,
+                Refinement.refinement_prompt == refinement_prompt,
+                Refinement.created_at >= requested_at
+            ).order_by(Refinement.id.desc()).first()
+            if done:
+                model_calls.reused_across_processes += 1
+                return refinement_result(db, done)
+            
+            project = db.query(Project).filter(Project.id == project_id).first()
+            section = db.query(DocumentSection).filter(DocumentSection.id == section_id).first()
+            return await apply_refinement(db, project, section, refinement_prompt)
+    finally:
+        db.close()
+
+def refinement_result(db: Session, refinement: Refinement) -> dict:
+    refined_content = refinement.refined_content
+    if refined_content is None and refinement.revision:
+        refined_content = get_revision_content(db, refinement.section_id, refinement.revision.revision_number)
+    return {
+        "id": refinement.id,
+        "refined_content": refined_content,
+        "refinement_prompt": refinement.refinement_prompt,
+        "input_tokens": refinement.input_tokens,
+        "output_tokens": refinement.output_tokens,
+        "created_at": refinement.created_at
+    }
+
+def refinement_window(section: DocumentSection, prompt: str):
+    """Split a section for refinement: (kept, separator, existing_content, omitted_tokens).
+
+    Repeated refinements grow a section without bound, so only a bounded window
+    at its end is sent to the model; the result replaces just that window and
+    the text before it is kept unchanged.
+    """
+    kept, separator, window = split_context(section.content, REFINE_CONTEXT_TOKENS)
+    existing_content = f"{window}\n\nUser refinement request: {prompt}"
+    return kept, separator, existing_content, count_tokens(kept)
+
+def build_refinement_prompt(project: Project, section: DocumentSection, prompt: str) -> str:
+    _, _, existing_content, omitted_tokens = refinement_window(section, prompt)
+    return build_prompt(project.topic, section.title, project.document_type, existing_content, omitted_tokens)
+
+async def apply_refinement(db: Session, project: Project, section: DocumentSection, refinement_prompt: str):
+    kept, separator, existing_content, omitted_tokens = refinement_window(section, refinement_prompt)
+    input_tokens = count_tokens(
+        build_prompt(project.topic, section.title, project.document_type, existing_content, omitted_tokens)
+    )
+    
     try:
-        # Generate refined content
-        refined_content = generate_content_with_gemini(
+        # Generate refined content off the event loop
+        refined_window = await call_model(
+            INTERACTIVE,
+            project.user_id,
+            generate_content_with_gemini,
             project.topic,
             section.title,
             project.document_type,
-            f"{section.content}\n\nUser refinement request: {request.refinement_prompt}"
+            existing_content,
+            omitted_tokens
         )
+        refined_content = kept + separator + refined_window.strip() if kept else refined_window
         
         # Update section content
+        previous_content = section.content
         section.content = refined_content
         section.updated_at = datetime.utcnow()
+        revision = record_revision(db, section, refined_content, previous_content)
         
         # Create refinement record
         refinement = Refinement(
             project_id=project.id,
             section_id=section.id,
-            refinement_prompt=request.refinement_prompt,
-            refined_content=refined_content
+            revision_id=revision.id,
+            refinement_prompt=refinement_prompt,
+            input_tokens=input_tokens,
+            # Only the window came from the model, the kept text is not output
+            output_tokens=count_tokens(refined_window)
         )
         db.add(refinement)
         db.commit()
@@ -96,10 +213,17 @@ async def refine_section(
         return {
             "id": refinement.id,
             "refined_content": refined_content,
-            "refinement_prompt": request.refinement_prompt,
+            "refinement_prompt": refinement_prompt,
+            "input_tokens": refinement.input_tokens,
+            "output_tokens": refinement.output_tokens,
             "created_at": refinement.created_at
         }
+    except WRITE_CONFLICTS:
+        # Edited while the model ran: the edit wins, the client can refine again
+        db.rollback()
+        raise HTTPException(status_code=409, detail=CONFLICT_DETAIL)
     except Exception as e:
+        db.rollback()
         raise HTTPException(status_code=500, detail=f"Error refining content: {str(e)}")
 
 @router.post("/feedback")
@@ -113,7 +237,8 @@ async def submit_feedback(
     
     project = db.query(Project).filter(
         Project.id == request.project_id,
-        Project.user_id == current_user.id
+        Project.user_id == current_user.id,
+        Project.deleted_at.is_(None)
     ).first()
     
     if not project:
@@ -127,49 +252,240 @@ async def submit_feedback(
     if not section:
         raise HTTPException(status_code=404, detail="Section not found")
     
-    # Create feedback record
+    # Create feedback record pointing at the revision being rated
+    revision = ensure_current_revision(db, section)
     refinement = Refinement(
         project_id=project.id,
         section_id=section.id,
+        revision_id=revision.id if revision else None,
         feedback=request.feedback,
-        comment=request.comment,
-        refined_content=section.content or ""
+        comment=request.comment
     )
     db.add(refinement)
     db.commit()
     
     return {"message": "Feedback submitted successfully"}
 
+def encode_history_cursor(created_at: datetime, refinement_id: int) -> str:
+    """Opaque keyset cursor pointing just past a history row"""
+    raw = f"{created_at.isoformat()}|{refinement_id}"
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii")
+
+def decode_history_cursor(cursor: str):
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode("ascii")).decode("utf-8")
+        created_at, refinement_id = raw.rsplit("|", 1)
+        return datetime.fromisoformat(created_at), int(refinement_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
 @router.get("/{project_id}/history")
 async def get_refinement_history(
     project_id: int,
     section_id: Optional[int] = None,
+    feedback: Optional[str] = Query(None, description="'like', 'dislike', 'any' for all feedback, or 'none' for refinements only"),
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=HISTORY_MAX_PAGE_SIZE),
+    include_content: bool = False,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db)
 ):
-    project = db.query(Project).filter(
+    """Page through a project's refinement and feedback history, newest first.
+
+    Only the listed columns are loaded; content is reconstructed from the
+    referenced revision when include_content=true. Pass next_cursor from one
+    page as cursor to fetch the next.
+    """
+    project_exists = db.query(Project.id).filter(
         Project.id == project_id,
-        Project.user_id == current_user.id
+        Project.user_id == current_user.id,
+        Project.deleted_at.is_(None)
     ).first()
     
-    if not project:
+    if not project_exists:
         raise HTTPException(status_code=404, detail="Project not found")
     
-    query = db.query(Refinement).filter(Refinement.project_id == project.id)
+    columns = [
+        Refinement.id,
+        Refinement.section_id,
+        Refinement.revision_id,
+        SectionRevision.revision_number,
+        Refinement.refinement_prompt,
+        Refinement.feedback,
+        Refinement.comment,
+        Refinement.input_tokens,
+        Refinement.output_tokens,
+        Refinement.created_at
+    ]
+    if include_content:
+        columns.append(Refinement.refined_content)
+    
+    query = db.query(*columns).outerjoin(
+        SectionRevision, SectionRevision.id == Refinement.revision_id
+    ).filter(Refinement.project_id == project_id)
+    
     if section_id:
         query = query.filter(Refinement.section_id == section_id)
+    if feedback == "none":
+        query = query.filter(Refinement.feedback.is_(None))
+    elif feedback == "any":
+        query = query.filter(Refinement.feedback.isnot(None))
+    elif feedback:
+        query = query.filter(Refinement.feedback == feedback)
+    if since:
+        query = query.filter(Refinement.created_at >= since)
+    if until:
+        query = query.filter(Refinement.created_at < until)
+    if cursor:
+        cursor_created_at, cursor_id = decode_history_cursor(cursor)
+        query = query.filter(or_(
+            Refinement.created_at < cursor_created_at,
+            and_(Refinement.created_at == cursor_created_at, Refinement.id < cursor_id)
+        ))
     
-    refinements = query.order_by(Refinement.created_at.desc()).all()
+    rows = query.order_by(Refinement.created_at.desc(), Refinement.id.desc()).limit(limit + 1).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    
+    items = []
+    reconstructed = {}
+    for row in rows:
+        item = {
+            "id": row.id,
+            "section_id": row.section_id,
+            "revision_id": row.revision_id,
+            "revision_number": row.revision_number,
+            "refinement_prompt": row.refinement_prompt,
+            "feedback": row.feedback,
+            "comment": row.comment,
+            "input_tokens": row.input_tokens,
+            "output_tokens": row.output_tokens,
+            "created_at": row.created_at
+        }
+        if include_content:
+            if row.revision_number is not None:
+                key = (row.section_id, row.revision_number)
+                if key not in reconstructed:
+                    reconstructed[key] = get_revision_content(db, row.section_id, row.revision_number)
+                item["content"] = reconstructed[key]
+            else:
+                item["content"] = row.refined_content
+        items.append(item)
+    
+    return {
+        "items": items,
+        "next_cursor": encode_history_cursor(rows[-1].created_at, rows[-1].id) if has_more else None
+    }
+
+@router.get("/{project_id}/usage")
+async def get_token_usage(
+    project_id: int,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_read_db)
+):
+    """Token usage of a project's refinements, in total and per section"""
+    project = db.query(Project).filter(
+        Project.id == project_id,
+        Project.user_id == current_user.id,
+        Project.deleted_at.is_(None)
+    ).first()
+    
+    if not project:
+        raise HTTPException(status_code=404, detail="Project not found")
+    
+    rows = db.query(
+        Refinement.section_id,
+        func.count(Refinement.id),
+        func.coalesce(func.sum(Refinement.input_tokens), 0),
+        func.coalesce(func.sum(Refinement.output_tokens), 0)
+    ).filter(
+        Refinement.project_id == project.id,
+        Refinement.refinement_prompt.isnot(None)
+    ).group_by(Refinement.section_id).all()
+    
+    sections = [
+        {
+            "section_id": section_id,
+            "refinements": count,
+            "input_tokens": int(input_tokens),
+            "output_tokens": int(output_tokens)
+        }
+        for section_id, count, input_tokens, output_tokens in rows
+    ]
+    
+    return {
+        "project_id": project.id,
+        "input_tokens": sum(s["input_tokens"] for s in sections),
+        "output_tokens": sum(s["output_tokens"] for s in sections),
+        "sections": sections
+    }
+
+@router.get("/{project_id}/sections/{section_id}/revisions")
+async def get_section_revisions(
+    project_id: int,
+    section_id: int,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_read_db)
+):
+    """List the stored revisions of a section, newest first"""
+    section = db.query(DocumentSection).join(Project).filter(
+        DocumentSection.id == section_id,
+        DocumentSection.project_id == project_id,
+        Project.user_id == current_user.id,
+        Project.deleted_at.is_(None)
+    ).first()
+    
+    if not section:
+        raise HTTPException(status_code=404, detail="Section not found")
+    
+    revisions = db.query(
+        SectionRevision.id,
+        SectionRevision.revision_number,
+        SectionRevision.is_snapshot,
+        func.length(SectionRevision.data),
+        SectionRevision.created_at
+    ).filter(
+        SectionRevision.section_id == section.id
+    ).order_by(SectionRevision.revision_number.desc()).all()
     
     return [
         {
-            "id": r.id,
-            "section_id": r.section_id,
-            "refinement_prompt": r.refinement_prompt,
-            "feedback": r.feedback,
-            "comment": r.comment,
-            "created_at": r.created_at
+            "id": revision_id,
+            "revision_number": revision_number,
+            "is_snapshot": is_snapshot,
+            "stored_bytes": stored_bytes,
+            "created_at": created_at
         }
-        for r in refinements
+        for revision_id, revision_number, is_snapshot, stored_bytes, created_at in revisions
     ]
 
+@router.get("/{project_id}/sections/{section_id}/revisions/{revision_number}")
+async def get_section_revision(
+    project_id: int,
+    section_id: int,
+    revision_number: int,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_read_db)
+):
+    """Reconstruct the content of a section at a given revision"""
+    section = db.query(DocumentSection).join(Project).filter(
+        DocumentSection.id == section_id,
+        DocumentSection.project_id == project_id,
+        Project.user_id == current_user.id,
+        Project.deleted_at.is_(None)
+    ).first()
+    
+    if not section:
+        raise HTTPException(status_code=404, detail="Section not found")
+    
+    content = get_revision_content(db, section.id, revision_number)
+    if content is None:
+        raise HTTPException(status_code=404, detail="Revision not found")
+    
+    return {
+        "section_id": section.id,
+        "revision_number": revision_number,
+        "content": content
+    }
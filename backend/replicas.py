@@ -0,0 +1,227 @@
+from fastapi import Request
+from starlette.datastructures import MutableHeaders
+from sqlalchemy import text
+from sqlalchemy.exc import SQLAlchemyError
+import asyncio
+import hashlib
+import hmac
+import itertools
+import os
+import threading
+import time
+
+from database import REPLICA_DATABASE_URLS, SessionLocal, make_engine, engine
+from auth import SECRET_KEY
+
+# Replicas further behind the primary than this are skipped
+REPLICA_MAX_LAG_SECONDS = float(os.getenv("REPLICA_MAX_LAG_SECONDS", "5"))
+# How often each process measures a replica's lag (and whether it is up at all)
+REPLICA_CHECK_SECONDS = 1.0
+REPLICA_CONNECT_TIMEOUT = int(os.getenv("REPLICA_CONNECT_TIMEOUT", "2"))
+
+# Responses to writes carry the primary's WAL position after the write, signed
+# for the client's token; clients send the latest one back so any worker on
+# any host can route their reads (the frontend does this in services/api.js)
+LAST_WRITE_HEADER = "X-Last-Write"
+
+SAFE_METHODS = {"GET", "HEAD", "OPTIONS"}
+
+# WAL positions as byte offsets, comparable across the primary and replicas
+# unlike timestamps taken on different hosts
+POSTGRES_WRITE_POSITION_QUERY = text("SELECT (pg_current_wal_lsn() - '0/0'::pg_lsn)::bigint")
+
+# How far the replica has replayed, and roughly how stale it is: zero when it
+# has replayed everything it received, otherwise the age of the last replayed
+# transaction, which overstates lag on an idle primary but never understates
+# it. The lag only decides whether a replica is usable at all; whether it has
+# a client's own write is decided by the replayed position.
+POSTGRES_REPLICA_QUERY = text("""
+    SELECT
+        CASE
+            WHEN NOT pg_is_in_recovery() THEN 0
+            WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+            ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+        END,
+        (CASE
+            WHEN pg_is_in_recovery() THEN pg_last_wal_replay_lsn()
+            ELSE pg_current_wal_lsn()
+        END - '0/0'::pg_lsn)::bigint
+""")
+
+class Replica:
+    """One read replica and what this process last learned about its lag"""
+
+    def __init__(self, url: str):
+        connect_args = {"connect_timeout": REPLICA_CONNECT_TIMEOUT} if url.startswith("postgresql") else {}
+        self.engine = make_engine(url, **connect_args)
+        self.name = self.engine.url.render_as_string(hide_password=True)
+        self.lag = None  # Seconds, None while unreachable
+        self.replayed = 0  # WAL position replayed up to
+        self.checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def refresh(self):
+        if time.time() - self.checked_at < REPLICA_CHECK_SECONDS:
+            return
+        # One thread measures, the others keep using the last result meanwhile
+        if not self._lock.acquire(blocking=False):
+            return
+        try:
+            checked_at = time.time()
+            try:
+                with self.engine.connect() as conn:
+                    if self.engine.dialect.name == "postgresql":
+                        lag, replayed = conn.execute(POSTGRES_REPLICA_QUERY).one()
+                        lag, replayed = float(lag), int(replayed)
+                    else:
+                        conn.execute(text("SELECT 1"))
+                        # SQLite stand-ins have no replication to lag behind
+                        lag, replayed = 0.0, 0
+            except SQLAlchemyError as e:
+                if self.lag is not None:
+                    print(f"Read replica {self.name} unavailable: {str(e)}")
+                lag, replayed = None, self.replayed
+            self.lag, self.replayed, self.checked_at = lag, replayed, checked_at
+        finally:
+            self._lock.release()
+
+    def mark_down(self):
+        self.lag, self.checked_at = None, time.time()
+
+    def usable(self) -> bool:
+        return self.lag is not None and self.lag <= REPLICA_MAX_LAG_SECONDS
+
+    def has_replayed(self, position: int) -> bool:
+        """Whether the replica has replayed the primary's WAL up to position"""
+        return self.replayed >= position
+
+replicas = [Replica(url) for url in REPLICA_DATABASE_URLS]
+_next_replica = itertools.count()
+
+routing_counts = {"replica": 0, "primary_recent_write": 0, "primary_no_replica": 0, "primary_replica_error": 0}
+
+def _client_key(request: Request):
+    authorization = request.headers.get("authorization")
+    if not authorization:
+        return None
+    return hashlib.sha1(authorization.encode("utf-8")).hexdigest()
+
+def _signature(key: str, position: str) -> str:
+    message = f"{key}:{position}".encode("utf-8")
+    return hmac.new(SECRET_KEY.encode("utf-8"), message, hashlib.sha256).hexdigest()[:32]
+
+def write_position() -> int:
+    """The primary's current WAL position, 0 when there is no replica to wait for"""
+    if not replicas or engine.dialect.name != "postgresql":
+        return 0
+    with engine.connect() as conn:
+        return int(conn.execute(POSTGRES_WRITE_POSITION_QUERY).scalar())
+
+def write_stamp(key: str, position: int) -> str:
+    """Header value telling later requests of this client how far its writes reach"""
+    stamp = str(position)
+    return f"{stamp}.{_signature(key, stamp)}"
+
+def last_write(request: Request):
+    """WAL position of the client's last write as sent back by it, None if absent or not its own"""
+    key = _client_key(request)
+    value = request.headers.get(LAST_WRITE_HEADER)
+    if not key or not value:
+        return None
+    stamp, _, signature = value.rpartition(".")
+    if not hmac.compare_digest(signature, _signature(key, stamp)):
+        return None
+    try:
+        return int(stamp)
+    except ValueError:
+        return None
+
+class ReadYourWritesMiddleware:
+    """Stamp responses to requests that may have written with the WAL position.
+
+    Read from the primary when the response starts, after the handler
+    committed, so a replica only qualifies for that client once it has
+    replayed past this point. Nothing is stored server side.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] in SAFE_METHODS:
+            await self.app(scope, receive, send)
+            return
+        key = _client_key(Request(scope))
+        if not key:
+            await self.app(scope, receive, send)
+            return
+        
+        async def send_with_stamp(message):
+            if message["type"] == "http.response.start":
+                try:
+                    position = await asyncio.to_thread(write_position)
+                    MutableHeaders(scope=message)[LAST_WRITE_HEADER] = write_stamp(key, position)
+                except SQLAlchemyError as e:
+                    # The client keeps its previous stamp, as after a failed write
+                    print(f"Could not read the primary's WAL position: {str(e)}")
+            await send(message)
+        
+        await self.app(scope, receive, send_with_stamp)
+
+def pick_replica(request: Request):
+    """Replica that can serve this client's reads, or None for the primary"""
+    for replica in replicas:
+        replica.refresh()
+    written = last_write(request)
+    
+    usable = [r for r in replicas if r.usable()]
+    if not usable:
+        routing_counts["primary_no_replica"] += 1
+        return None
+    if written is not None:
+        usable = [r for r in usable if r.has_replayed(written)]
+        if not usable:
+            routing_counts["primary_recent_write"] += 1
+            return None
+    return usable[next(_next_replica) % len(usable)]
+
+def get_read_db(request: Request):
+    """Session for read-only endpoints, on a replica when one is caught up.
+
+    Clients that send back their X-Last-Write stamp read from the primary
+    until a replica has replayed that write, and everyone does while no
+    replica is reachable and within REPLICA_MAX_LAG_SECONDS.
+    """
+    replica = pick_replica(request) if replicas else None
+    db = None
+    if replica is not None:
+        db = SessionLocal(bind=replica.engine)
+        try:
+            db.connection()  # Checks the connection out now so a dead replica falls back here
+            routing_counts["replica"] += 1
+        except SQLAlchemyError as e:
+            print(f"Read replica {replica.name} failed, using the primary: {str(e)}")
+            db.close()
+            db = None
+            replica.mark_down()
+            routing_counts["primary_replica_error"] += 1
+    if db is None:
+        db = SessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+def replica_stats() -> dict:
+    return {
+        "replicas": [
+            {
+                "name": r.name,
+                "lag_seconds": None if r.lag is None else round(r.lag, 3),
+                "replayed_position": r.replayed,
+                "usable": r.usable()
+            }
+            for r in replicas
+        ],
+        "routing": dict(routing_counts)
+    }
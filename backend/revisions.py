@@ -0,0 +1,158 @@
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from sqlalchemy.orm.exc import StaleDataError
+from difflib import SequenceMatcher
+import json
+import os
+import zlib
+
+from database import DocumentSection, SectionRevision
+
+# Every Nth revision of a section stores the full text, the rest store a delta
+# from the previous revision. Reading any revision replays at most N-1 deltas.
+SNAPSHOT_INTERVAL = int(os.getenv("REVISION_SNAPSHOT_INTERVAL", "20"))
+
+# A section write that lost to another writer: the section's version moved on
+# since it was read (StaleDataError, see DocumentSection.__mapper_args__) or
+# its next revision number was taken first (IntegrityError)
+WRITE_CONFLICTS = (StaleDataError, IntegrityError)
+CONFLICT_DETAIL = "Section was modified concurrently, reload and retry"
+
+# Delta opcodes, applied line by line against the previous revision
+KEEP = 0
+SKIP = 1
+INSERT = 2
+
+def _compress(text: str) -> bytes:
+    return zlib.compress(text.encode("utf-8"), 6)
+
+def _decompress(data: bytes) -> str:
+    return zlib.decompress(data).decode("utf-8")
+
+def encode_delta(old: str, new: str) -> str:
+    """Encode new as line operations against old.
+
+    The result is a JSON list of [KEEP, n], [SKIP, n] and [INSERT, text] ops
+    which only carries the lines that actually changed.
+    """
+    old_lines = old.splitlines(keepends=True)
+    new_lines = new.splitlines(keepends=True)
+
+    # Edits are usually local, so only the lines between the unchanged head
+    # and tail go through the (quadratic) matcher
+    head = 0
+    limit = min(len(old_lines), len(new_lines))
+    while head < limit and old_lines[head] == new_lines[head]:
+        head += 1
+    tail = 0
+    while tail < limit - head and old_lines[-1 - tail] == new_lines[-1 - tail]:
+        tail += 1
+
+    ops = [[KEEP, head]] if head else []
+    matcher = SequenceMatcher(
+        None, old_lines[head:len(old_lines) - tail], new_lines[head:len(new_lines) - tail], autojunk=False
+    )
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == "equal":
+            ops.append([KEEP, i2 - i1])
+            continue
+        if i2 > i1:
+            ops.append([SKIP, i2 - i1])
+        if j2 > j1:
+            ops.append([INSERT, "".join(new_lines[head + j1:head + j2])])
+    if tail:
+        ops.append([KEEP, tail])
+    return json.dumps(ops, separators=(",", ":"))
+
+def apply_delta(old: str, delta: str) -> str:
+    """Rebuild a revision from the previous revision and its delta"""
+    old_lines = old.splitlines(keepends=True)
+    parts = []
+    pos = 0
+    for op, arg in json.loads(delta):
+        if op == KEEP:
+            parts.extend(old_lines[pos:pos + arg])
+            pos += arg
+        elif op == SKIP:
+            pos += arg
+        else:
+            parts.append(arg)
+    return "".join(parts)
+
+def build_revision(section_id: int, number: int, content: str, previous_content: str = None) -> SectionRevision:
+    """Create revision number of a section, stored as a delta from previous_content when that pays off"""
+    data = None
+    is_snapshot = True
+
+    if previous_content is not None and number > 1 and (number - 1) % SNAPSHOT_INTERVAL != 0:
+        delta = _compress(encode_delta(previous_content, content))
+        # Prose never compresses 16x, so a delta that small beats the snapshot
+        # without paying to compress the full text just to compare
+        if len(delta) * 16 < len(content) or len(delta) < len(_compress(content)):
+            data = delta
+            is_snapshot = False
+
+    if data is None:
+        data = _compress(content)
+
+    return SectionRevision(
+        section_id=section_id,
+        revision_number=number,
+        is_snapshot=is_snapshot,
+        data=data
+    )
+
+def record_revision(db: Session, section: DocumentSection, content: str, previous_content: str = None) -> SectionRevision:
+    """Append a revision of a section's content and bump section.current_revision.
+
+    previous_content must be the content of the section's current revision for a
+    delta to be stored; without it (or when a snapshot is due, or the delta would
+    not be smaller) the full text is stored instead.
+    """
+    if not section.current_revision:
+        previous_content = None
+    revision = build_revision(section.id, (section.current_revision or 0) + 1, content, previous_content)
+    db.add(revision)
+    section.current_revision = revision.revision_number
+    db.flush()
+    return revision
+
+def ensure_current_revision(db: Session, section: DocumentSection):
+    """Return the revision holding the section's current content.
+
+    Sections written before revisions existed get a snapshot of their content on
+    first use. Returns None for sections without content.
+    """
+    if section.current_revision:
+        return db.query(SectionRevision).filter(
+            SectionRevision.section_id == section.id,
+            SectionRevision.revision_number == section.current_revision
+        ).first()
+    if not section.content:
+        return None
+    return record_revision(db, section, section.content)
+
+def get_revision_content(db: Session, section_id: int, revision_number: int):
+    """Reconstruct the text of a section at a given revision, None if it does not exist"""
+    snapshot_number = db.query(SectionRevision.revision_number).filter(
+        SectionRevision.section_id == section_id,
+        SectionRevision.revision_number <= revision_number,
+        SectionRevision.is_snapshot == True
+    ).order_by(SectionRevision.revision_number.desc()).limit(1).scalar()
+
+    if snapshot_number is None:
+        return None
+
+    chain = db.query(SectionRevision.revision_number, SectionRevision.data).filter(
+        SectionRevision.section_id == section_id,
+        SectionRevision.revision_number >= snapshot_number,
+        SectionRevision.revision_number <= revision_number
+    ).order_by(SectionRevision.revision_number).all()
+
+    if not chain or chain[-1][0] != revision_number:
+        return None
+
+    content = _decompress(chain[0][1])
+    for _, data in chain[1:]:
+        content = apply_delta(content, _decompress(data))
+    return content
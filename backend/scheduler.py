@@ -0,0 +1,169 @@
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import functools
+import os
+import time
+
+from profiling import phase
+
+# Priority classes, most urgent first
+INTERACTIVE = 0  # Single-section generation and refinement, a user is waiting on the result
+TEMPLATE = 1     # Outline suggestions
+BULK = 2         # Whole-document generation runs
+
+CLASS_NAMES = {INTERACTIVE: "interactive", TEMPLATE: "template", BULK: "bulk"}
+
+# Concurrent model calls allowed by the provider quota, shared by all worker
+# processes the same way DB_CONNECTION_BUDGET is
+MODEL_MAX_CONCURRENCY = int(os.getenv("MODEL_MAX_CONCURRENCY", "8"))
+WORKERS = max(1, int(os.getenv("WEB_CONCURRENCY", "1")))
+# Slots per process only interactive calls may use, so a refine never waits
+# behind a full house of bulk calls
+INTERACTIVE_RESERVED_SLOTS = int(os.getenv("MODEL_INTERACTIVE_RESERVED_SLOTS", "1"))
+
+# Recent queue waits kept per class for percentiles
+WAIT_SAMPLES = 1000
+
+class _ClassQueue:
+    """Waiters of one priority class, served round robin across users"""
+
+    def __init__(self):
+        self.by_user = OrderedDict()
+        self.waits = deque(maxlen=WAIT_SAMPLES)
+        self.served = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def __len__(self):
+        return sum(len(waiters) for waiters in self.by_user.values())
+
+    def push(self, user_id, waiter):
+        self.by_user.setdefault(user_id, deque()).append(waiter)
+
+    def pop(self):
+        # Take the oldest waiter of the user at the front, then send that user
+        # to the back so every user with queued calls gets a turn
+        user_id, waiters = next(iter(self.by_user.items()))
+        waiter = waiters.popleft()
+        del self.by_user[user_id]
+        if waiters:
+            self.by_user[user_id] = waiters
+        return waiter
+
+    def remove(self, user_id, waiter):
+        waiters = self.by_user.get(user_id)
+        if waiters and waiter in waiters:
+            waiters.remove(waiter)
+            if not waiters:
+                del self.by_user[user_id]
+
+    def record(self, waited: float):
+        self.waits.append(waited)
+        self.served += 1
+        self.total_wait += waited
+        self.max_wait = max(self.max_wait, waited)
+
+class ModelScheduler:
+    """Admit model calls by priority class, fairly between users within a class.
+
+    At most max_concurrency calls run at once. When a slot frees up it goes to
+    the most urgent class with queued calls; inside a class users take turns,
+    so one user's long bulk run cannot hold back another user's.
+    """
+
+    def __init__(self, max_concurrency: int, interactive_reserved: int = 0):
+        self.max_concurrency = max(1, max_concurrency)
+        self.interactive_reserved = min(max(0, interactive_reserved), self.max_concurrency - 1)
+        self.running = 0
+        self._queues = {priority: _ClassQueue() for priority in CLASS_NAMES}
+
+    def _limit(self, priority: int) -> int:
+        if priority == INTERACTIVE:
+            return self.max_concurrency
+        return self.max_concurrency - self.interactive_reserved
+
+    def _next_priority(self):
+        for priority in sorted(self._queues):
+            if len(self._queues[priority]) and self.running < self._limit(priority):
+                return priority
+        return None
+
+    def _dispatch(self):
+        while True:
+            priority = self._next_priority()
+            if priority is None:
+                return
+            future, enqueued_at = self._queues[priority].pop()
+            if future.done():
+                continue
+            self.running += 1
+            self._queues[priority].record(time.monotonic() - enqueued_at)
+            future.set_result(None)
+
+    async def acquire(self, priority: int, user_id):
+        """Wait for a model call slot; pair every successful acquire with release()"""
+        queue = self._queues[priority]
+        if self._next_priority() is None and self.running < self._limit(priority):
+            self.running += 1
+            queue.record(0.0)
+            return
+        
+        entry = (asyncio.get_running_loop().create_future(), time.monotonic())
+        queue.push(user_id, entry)
+        try:
+            await entry[0]
+        except asyncio.CancelledError:
+            if entry[0].done() and not entry[0].cancelled():
+                # Granted a slot just as the caller went away
+                self.release()
+            else:
+                queue.remove(user_id, entry)
+            raise
+
+    def release(self):
+        self.running -= 1
+        self._dispatch()
+
+    def stats(self) -> dict:
+        classes = {}
+        for priority, queue in self._queues.items():
+            waits = sorted(queue.waits)
+            classes[CLASS_NAMES[priority]] = {
+                "queued": len(queue),
+                "served": queue.served,
+                "avg_wait_ms": round(queue.total_wait / queue.served * 1000, 1) if queue.served else 0.0,
+                "p95_wait_ms": round(waits[min(len(waits) - 1, int(len(waits) * 0.95))] * 1000, 1) if waits else 0.0,
+                "max_wait_ms": round(queue.max_wait * 1000, 1)
+            }
+        return {
+            "max_concurrency": self.max_concurrency,
+            "interactive_reserved": self.interactive_reserved,
+            "running": self.running,
+            "classes": classes
+        }
+
+model_scheduler = ModelScheduler(max(1, MODEL_MAX_CONCURRENCY // WORKERS), INTERACTIVE_RESERVED_SLOTS)
+
+# The SDK call blocks, so admitted calls get their own threads instead of
+# competing with FastAPI's threadpool for request handling
+_executor = ThreadPoolExecutor(max_workers=model_scheduler.max_concurrency, thread_name_prefix="model-call")
+
+def _finished(task: asyncio.Future):
+    model_scheduler.release()
+    if not task.cancelled():
+        task.exception()  # Consumed here when the caller already went away
+
+async def call_model(priority: int, user_id, fn, *args):
+    """Run a blocking model call once the scheduler admits it.
+
+    If the caller is cancelled mid-call the slot stays taken until the call
+    actually returns, so abandoned calls still count against the provider quota.
+    """
+    with phase("queue"):
+        await model_scheduler.acquire(priority, user_id)
+    loop = asyncio.get_running_loop()
+    call = loop.run_in_executor(_executor, functools.partial(fn, *args))
+    call.add_done_callback(_finished)
+    with phase("model"):
+        return await asyncio.shield(call)
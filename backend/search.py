@@ -0,0 +1,287 @@
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy import event, inspect, select, text
+from sqlalchemy.orm import Session
+import html
+import re
+
+from database import get_db, engine, SessionLocal, User, Project, DocumentSection
+from profiling import TimedRoute
+from auth import get_current_user
+
+router = APIRouter(route_class=TimedRoute)
+
+# One inverted index over Project.title/Project.topic and DocumentSection.content.
+#   SQLite:     FTS5 virtual table. "owner" holds "u<user_id> p<project_id>" tokens
+#               so per-user and per-project lookups also go through the index.
+#   PostgreSQL: plain table with a generated tsvector column and a GIN index (12+).
+# Each row is keyed by doc_key = ref_id * 2 + kind so upserts and deletes are
+# primary key lookups.
+KIND_PROJECT = 0
+KIND_SECTION = 1
+
+# Snippets come back from the database with control-character markers, which
+# survive HTML escaping and are then swapped for <mark> tags
+SNIPPET_START = "\x02"
+SNIPPET_END = "\x03"
+
+SEARCH_MAX_PAGE_SIZE = 50
+
+def is_postgres(bind) -> bool:
+    return bind.dialect.name == "postgresql"
+
+def search_supported(bind) -> bool:
+    """FTS5 on SQLite, generated tsvector columns need PostgreSQL 12 or later.
+
+    On anything else the index is not created or maintained, writes go
+    through untouched and /api/search answers 503.
+    """
+    if is_postgres(bind):
+        return (bind.dialect.server_version_info or (0,)) >= (12,)
+    return bind.dialect.name == "sqlite"
+
+def doc_key(kind: int, ref_id: int) -> int:
+    return ref_id * 2 + kind
+
+def init_search_index():
+    """Create the search index if needed, backfilling it from existing rows"""
+    with engine.begin() as conn:
+        if not search_supported(conn):
+            print(f"Full-text search is not available on {conn.dialect.name}, the index is not maintained")
+            return
+        if is_postgres(conn):
+            exists = conn.execute(text("SELECT to_regclass('search_index')")).scalar() is not None
+            conn.execute(text("""
+                CREATE TABLE IF NOT EXISTS search_index (
+                    doc_key BIGINT PRIMARY KEY,
+                    kind SMALLINT NOT NULL,
+                    ref_id INTEGER NOT NULL,
+                    project_id INTEGER NOT NULL,
+                    user_id INTEGER NOT NULL,
+                    title TEXT NOT NULL DEFAULT '',
+                    body TEXT NOT NULL DEFAULT '',
+                    tsv TSVECTOR GENERATED ALWAYS AS (
+                        setweight(to_tsvector('english', title), 'A') ||
+                        setweight(to_tsvector('english', body), 'B')
+                    ) STORED
+                )
+            """))
+            conn.execute(text("CREATE INDEX IF NOT EXISTS ix_search_index_tsv ON search_index USING GIN (tsv)"))
+            conn.execute(text("CREATE INDEX IF NOT EXISTS ix_search_index_user ON search_index (user_id)"))
+            conn.execute(text("CREATE INDEX IF NOT EXISTS ix_search_index_project ON search_index (project_id)"))
+        else:
+            exists = conn.execute(text(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'search_index'"
+            )).first() is not None
+            conn.execute(text("""
+                CREATE VIRTUAL TABLE IF NOT EXISTS search_index USING fts5(
+                    title, body, owner,
+                    kind UNINDEXED, ref_id UNINDEXED, project_id UNINDEXED,
+                    tokenize = 'porter unicode61'
+                )
+            """))
+        if not exists:
+            backfill_search_index(conn)
+
+def backfill_search_index(conn):
+    """Index every existing project and section"""
+    projects = conn.execute(text("SELECT id, user_id, title, topic FROM projects")).fetchall()
+    for project_id, user_id, title, topic in projects:
+        upsert_document(conn, KIND_PROJECT, project_id, project_id, user_id, title, topic)
+    # Selected through the mapped column so stored content is decompressed
+    sections = conn.execute(
+        select(DocumentSection.id, DocumentSection.project_id, Project.user_id, DocumentSection.content)
+        .join(Project, Project.id == DocumentSection.project_id)
+        .where(DocumentSection.content.isnot(None))
+    ).fetchall()
+    for section_id, project_id, user_id, content in sections:
+        upsert_document(conn, KIND_SECTION, section_id, project_id, user_id, "", content)
+
+def upsert_document(conn, kind: int, ref_id: int, project_id: int, user_id: int, title: str, body: str):
+    if not search_supported(conn):
+        return
+    key = doc_key(kind, ref_id)
+    params = {
+        "key": key, "kind": kind, "ref_id": ref_id, "project_id": project_id,
+        "user_id": user_id, "title": title or "", "body": body or ""
+    }
+    if is_postgres(conn):
+        conn.execute(text("""
+            INSERT INTO search_index (doc_key, kind, ref_id, project_id, user_id, title, body)
+            VALUES (:key, :kind, :ref_id, :project_id, :user_id, :title, :body)
+            ON CONFLICT (doc_key) DO UPDATE SET title = EXCLUDED.title, body = EXCLUDED.body
+        """), params)
+    else:
+        conn.execute(text("DELETE FROM search_index WHERE rowid = :key"), params)
+        conn.execute(text("""
+            INSERT INTO search_index (rowid, title, body, owner, kind, ref_id, project_id)
+            VALUES (:key, :title, :body, :owner, :kind, :ref_id, :project_id)
+        """), {**params, "owner": f"u{user_id} p{project_id}"})
+
+def remove_documents(conn, kind: int, ref_ids):
+    keys = [doc_key(kind, ref_id) for ref_id in ref_ids]
+    if not keys or not search_supported(conn):
+        return
+    column = "doc_key" if is_postgres(conn) else "rowid"
+    conn.execute(
+        text(f"DELETE FROM search_index WHERE {column} IN ({', '.join(str(k) for k in keys)})")
+    )
+
+def remove_project_documents(conn, project_id: int):
+    """Drop a project and all of its sections from the index"""
+    if not search_supported(conn):
+        return
+    if is_postgres(conn):
+        conn.execute(text("DELETE FROM search_index WHERE project_id = :pid"), {"pid": project_id})
+    else:
+        conn.execute(text("""
+            DELETE FROM search_index WHERE rowid IN (
+                SELECT rowid FROM search_index WHERE search_index MATCH :owner
+            )
+        """), {"owner": f'owner:"p{project_id}"'})
+
+def remove_sections(db: Session, section_ids):
+    """Drop sections removed with bulk statements, which bypass the flush hook"""
+    remove_documents(db.connection(), KIND_SECTION, section_ids)
+
+def index_section(db: Session, section_id: int, project_id: int, user_id: int, content: str):
+    """Re-index a section written with a bulk UPDATE, which bypasses the flush hook"""
+    upsert_document(db.connection(), KIND_SECTION, section_id, project_id, user_id, "", content)
+
+def _changed(obj, *attrs) -> bool:
+    state = inspect(obj)
+    return any(state.attrs[attr].history.has_changes() for attr in attrs)
+
+@event.listens_for(SessionLocal, "after_flush")
+def sync_search_index(session, flush_context):
+    """Keep the index in step with ORM writes, inside the same transaction"""
+    conn = session.connection()
+    if not search_supported(conn):
+        return
+    owners = {}
+
+    def owner_of(project_id):
+        if project_id not in owners:
+            owners[project_id] = conn.execute(
+                text("SELECT user_id FROM projects WHERE id = :pid"), {"pid": project_id}
+            ).scalar()
+        return owners[project_id]
+
+    for obj in list(session.new) + list(session.dirty):
+        if isinstance(obj, Project) and (obj in session.new or _changed(obj, "title", "topic")):
+            upsert_document(conn, KIND_PROJECT, obj.id, obj.id, obj.user_id, obj.title, obj.topic)
+        elif isinstance(obj, DocumentSection) and (obj in session.new or _changed(obj, "content")):
+            if obj.content is None:
+                remove_documents(conn, KIND_SECTION, [obj.id])
+            else:
+                upsert_document(conn, KIND_SECTION, obj.id, obj.project_id, owner_of(obj.project_id), "", obj.content)
+
+    for obj in session.deleted:
+        if isinstance(obj, Project):
+            remove_project_documents(conn, obj.id)
+        elif isinstance(obj, DocumentSection):
+            remove_documents(conn, KIND_SECTION, [obj.id])
+
+def highlight_snippet(snippet: str) -> str:
+    if not snippet:
+        return ""
+    escaped = html.escape(snippet)
+    return escaped.replace(SNIPPET_START, "<mark>").replace(SNIPPET_END, "</mark>")
+
+def build_fts_query(q: str) -> str:
+    """Turn free text into an FTS5 query: every word must match, the last as a prefix"""
+    words = re.findall(r"\w+", q)
+    if not words:
+        return ""
+    terms = [f'"{word}"' for word in words]
+    terms[-1] += "*"
+    return " ".join(terms)
+
+@router.get("")
+async def search(
+    q: str = Query(..., min_length=1, description="Search text"),
+    page: int = Query(1, ge=1),
+    page_size: int = Query(20, ge=1, le=SEARCH_MAX_PAGE_SIZE),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Ranked full-text search over the user's project titles, topics and section content"""
+    conn = db.connection()
+    if not search_supported(conn):
+        raise HTTPException(status_code=503, detail="Search is not available on this database")
+    params = {"uid": current_user.id, "limit": page_size + 1, "offset": (page - 1) * page_size}
+
+    if is_postgres(conn):
+        params["q"] = q
+        rows = conn.execute(text(f"""
+            WITH hits AS (
+                SELECT kind, ref_id, project_id, body, ts_rank(tsv, query) AS score, query
+                FROM search_index, websearch_to_tsquery('english', :q) AS query
+                WHERE user_id = :uid AND tsv @@ query
+                ORDER BY score DESC, doc_key
+                LIMIT :limit OFFSET :offset
+            )
+            SELECT hits.kind, hits.ref_id, hits.project_id, hits.score,
+                   ts_headline('english', hits.body, hits.query,
+                               'StartSel={SNIPPET_START}, StopSel={SNIPPET_END}, MaxWords=30, MinWords=10') AS snippet
+            FROM hits
+            ORDER BY hits.score DESC
+        """), params).fetchall()
+    else:
+        fts_query = build_fts_query(q)
+        if not fts_query:
+            raise HTTPException(status_code=400, detail="Search text has no searchable words")
+        params["q"] = f'owner:"u{current_user.id}" AND {{title body}}: ({fts_query})'
+        rows = conn.execute(text(f"""
+            SELECT kind, ref_id, project_id, -bm25(search_index, 4.0, 1.0, 0.0) AS score,
+                   snippet(search_index, 1, '{SNIPPET_START}', '{SNIPPET_END}', '…', 24) AS snippet
+            FROM search_index
+            WHERE search_index MATCH :q
+            ORDER BY bm25(search_index, 4.0, 1.0, 0.0)
+            LIMIT :limit OFFSET :offset
+        """), params).fetchall()
+
+    has_more = len(rows) > page_size
+    rows = rows[:page_size]
+
+    project_ids = {row.project_id for row in rows}
+    section_ids = [row.ref_id for row in rows if row.kind == KIND_SECTION]
+    projects = dict(db.query(Project.id, Project.title).filter(
+        Project.id.in_(project_ids),
+        Project.user_id == current_user.id,
+        Project.deleted_at.is_(None)
+    ).all()) if project_ids else {}
+    sections = {
+        s.id: s for s in db.query(
+            DocumentSection.id, DocumentSection.section_index, DocumentSection.title
+        ).filter(DocumentSection.id.in_(section_ids)).all()
+    } if section_ids else {}
+
+    results = []
+    for row in rows:
+        if row.project_id not in projects:
+            continue
+        result = {
+            "kind": "section" if row.kind == KIND_SECTION else "project",
+            "project_id": row.project_id,
+            "project_title": projects[row.project_id],
+            "snippet": highlight_snippet(row.snippet),
+            "score": float(row.score)
+        }
+        if row.kind == KIND_SECTION:
+            section = sections.get(row.ref_id)
+            if section is None:
+                continue
+            result.update({
+                "section_id": section.id,
+                "section_index": section.section_index,
+                "section_title": section.title
+            })
+        results.append(result)
+
+    return {
+        "query": q,
+        "page": page,
+        "page_size": page_size,
+        "has_more": has_more,
+        "results": results
+    }
@@ -0,0 +1,154 @@
+from contextlib import asynccontextmanager
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+import asyncio
+import hashlib
+import os
+import tempfile
+import time
+
+from database import engine
+
+# How long a leader waits for another process holding the same key; callers
+# answer 503 when it runs out rather than make the call unlocked
+LOCK_WAIT_SECONDS = float(os.getenv("SINGLE_FLIGHT_LOCK_WAIT_SECONDS", "120"))
+LOCK_POLL_SECONDS = 0.1
+# Lock files older than this are left over from a crashed process
+STALE_LOCK_SECONDS = 600
+
+class _Call:
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+class SingleFlight:
+    """Coalesce concurrent identical async calls into one execution.
+
+    The first caller for a key starts the work as a task; callers arriving
+    while it runs await the same task and get the same result or exception.
+    The task is cancelled only when every caller waiting on it has gone away.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self.executed = 0
+        self.coalesced = 0
+        self.reused_across_processes = 0
+
+    def in_flight(self, key) -> bool:
+        return key in self._calls
+
+    async def do(self, key, fn):
+        call = self._calls.get(key)
+        if call is None:
+            call = _Call(asyncio.ensure_future(fn()))
+            self._calls[key] = call
+            call.task.add_done_callback(lambda _: self._forget(key, call))
+            self.executed += 1
+        else:
+            self.coalesced += 1
+        
+        call.waiters += 1
+        try:
+            return await asyncio.shield(call.task)
+        except asyncio.CancelledError:
+            if call.waiters == 1 and not call.task.done():
+                call.task.cancel()
+            raise
+        finally:
+            call.waiters -= 1
+
+    def _forget(self, key, call):
+        if self._calls.get(key) is call:
+            del self._calls[key]
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": len(self._calls),
+            "executed": self.executed,
+            "coalesced": self.coalesced,
+            "reused_across_processes": self.reused_across_processes,
+            "calls_saved": self.coalesced + self.reused_across_processes
+        }
+
+def _lock_id(key: str) -> int:
+    return int.from_bytes(hashlib.sha1(key.encode("utf-8")).digest()[:8], "big", signed=True)
+
+async def _acquire(try_lock, deadline: float) -> bool:
+    """Call try_lock in a thread until it returns True or deadline passes, trying at least once"""
+    while True:
+        if await asyncio.to_thread(try_lock):
+            return True
+        if time.monotonic() >= deadline:
+            return False
+        await asyncio.sleep(LOCK_POLL_SECONDS)
+
+@asynccontextmanager
+async def cross_process_lock(key: str, wait_seconds: float = None, db: Session = None):
+    """Hold a lock on key across all server processes.
+
+    PostgreSQL uses an advisory lock. Given db, it is a transaction lock taken
+    in db's current transaction and released when db commits or rolls back,
+    so it costs no connection beyond the session's own; without db (work
+    spanning several transactions) a session lock on a dedicated connection.
+    Other databases (SQLite in development, where all workers share one host)
+    fall back to an exclusively created lock file. Yields True if the lock
+    was acquired, False if wait_seconds (default LOCK_WAIT_SECONDS) ran out
+    first; 0 tries exactly once.
+    """
+    deadline = time.monotonic() + (LOCK_WAIT_SECONDS if wait_seconds is None else wait_seconds)
+    
+    if engine.dialect.name == "postgresql":
+        lock_id = _lock_id(key)
+        if db is not None:
+            yield await _acquire(
+                lambda: db.execute(text("SELECT pg_try_advisory_xact_lock(:id)"), {"id": lock_id}).scalar(),
+                deadline
+            )
+            return
+        conn = await asyncio.to_thread(engine.connect)
+        try:
+            acquired = await _acquire(
+                lambda: conn.execute(text("SELECT pg_try_advisory_lock(:id)"), {"id": lock_id}).scalar(),
+                deadline
+            )
+            try:
+                yield acquired
+            finally:
+                if acquired:
+                    await asyncio.to_thread(
+                        lambda: conn.execute(text("SELECT pg_advisory_unlock(:id)"), {"id": lock_id})
+                    )
+        finally:
+            await asyncio.to_thread(conn.close)
+        return
+    
+    lock_dir = os.path.join(tempfile.gettempdir(), "docgen-locks")
+    os.makedirs(lock_dir, exist_ok=True)
+    path = os.path.join(lock_dir, hashlib.sha1(key.encode("utf-8")).hexdigest() + ".lock")
+    acquired = False
+    while True:
+        try:
+            os.close(os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            acquired = True
+        except FileExistsError:
+            try:
+                if time.time() - os.path.getmtime(path) > STALE_LOCK_SECONDS:
+                    os.remove(path)
+                    continue
+            except FileNotFoundError:
+                continue
+        if acquired or time.monotonic() >= deadline:
+            break
+        await asyncio.sleep(LOCK_POLL_SECONDS)
+    try:
+        yield acquired
+    finally:
+        if acquired:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+# Shared by generation and refinement
+model_calls = SingleFlight()
@@ -0,0 +1,101 @@
+import asyncio
+import gc
+import time
+import warnings
+
+import pytest
+from starlette.requests import Request
+
+from cancellation import CancelScope, GenerationCancelled, REASON_DISCONNECTED
+
+class StubRequest:
+    """Request whose client goes away disconnect_after seconds in, or never"""
+
+    def __init__(self, disconnect_after=None):
+        self.started = time.monotonic()
+        self.disconnect_after = disconnect_after
+
+    async def is_disconnected(self):
+        return self.disconnect_after is not None and time.monotonic() - self.started >= self.disconnect_after
+
+def test_run_does_not_start_work_for_a_disconnected_request():
+    started = []
+    
+    async def model_call():
+        started.append(True)
+    
+    async def main():
+        scope = CancelScope(StubRequest(disconnect_after=0), project_id=0)
+        with pytest.raises(GenerationCancelled) as cancelled:
+            await scope.run(lambda: model_call())
+        return cancelled.value.reason
+    
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter("always")
+        reason = asyncio.run(main())
+        gc.collect()
+    
+    assert reason == REASON_DISCONNECTED
+    assert not started
+    assert not [w for w in caught if "never awaited" in str(w.message)]
+
+def test_disconnect_cancels_the_running_call():
+    finished = []
+    
+    async def slow_model_call():
+        await asyncio.sleep(5)
+        finished.append(True)
+    
+    async def main():
+        scope = CancelScope(StubRequest(disconnect_after=0.3), project_id=0)
+        started = time.monotonic()
+        with pytest.raises(GenerationCancelled):
+            await scope.run(slow_model_call)
+        return time.monotonic() - started
+    
+    elapsed = asyncio.run(main())
+    
+    assert elapsed < 2
+    assert not finished
+
+def test_cancelling_the_request_task_stops_the_running_call():
+    state = []
+    
+    async def slow_model_call():
+        try:
+            await asyncio.sleep(5)
+        except asyncio.CancelledError:
+            state.append("cancelled")
+            raise
+        state.append("finished")
+    
+    async def main():
+        scope = CancelScope(StubRequest(), project_id=0)
+        request_task = asyncio.ensure_future(scope.run(slow_model_call))
+        await asyncio.sleep(0.2)
+        request_task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await request_task
+        # Stopped by the time run() returns, not left to the event loop
+        return list(state)
+    
+    assert asyncio.run(main()) == ["cancelled"]
+
+def test_disconnect_stops_bulk_generation_and_keeps_finished_sections(client, make_project, fake_model, monkeypatch):
+    project_id = make_project(["One", "Two", "Three"])
+    fake_model.delay = 0.5
+    
+    # The client goes away while the second section is being generated
+    async def is_disconnected(self):
+        return len(fake_model.prompts) >= 2
+    monkeypatch.setattr(Request, "is_disconnected", is_disconnected)
+    
+    result = client.post("/api/generation/generate", json={"project_id": project_id}).json()
+    
+    assert result["cancelled"] is True
+    assert result["sections_generated"] == [0]
+    assert result["sections_pending"] == [1, 2]
+    assert len(fake_model.prompts) == 2
+    
+    sections = client.get(f"/api/documents/{project_id}/sections").json()
+    assert [s["section_index"] for s in sections if s.get("content")] == [0]
@@ -0,0 +1,107 @@
+import threading
+import time
+
+import pytest
+from sqlalchemy.orm.exc import StaleDataError
+
+from database import SessionLocal, DocumentSection, SectionRevision
+
+def generated_section(client, project_id):
+    response = client.post("/api/generation/generate-section", params={"project_id": project_id, "section_index": 0})
+    assert response.status_code == 200
+    return response.json()["section_id"]
+
+def patch(client, project_id, section_id, base_version, text):
+    return client.patch(f"/api/documents/{project_id}/sections/{section_id}/content", json={
+        "base_version": base_version,
+        "operations": [{"start": 0, "end": 0, "text": text}]
+    })
+
+def stored(section_id):
+    """(content, current_revision, number of revision rows) of a section"""
+    db = SessionLocal()
+    try:
+        section = db.get(DocumentSection, section_id)
+        revisions = db.query(SectionRevision).filter(SectionRevision.section_id == section_id).count()
+        return section.content, section.current_revision, revisions
+    finally:
+        db.close()
+
+def in_background(call):
+    results = []
+    thread = threading.Thread(target=lambda: results.append(call()))
+    thread.start()
+    return thread, results
+
+def test_patch_against_a_stale_version_is_rejected(client, make_project, fake_model):
+    project_id = make_project(["Intro"])
+    section_id = generated_section(client, project_id)
+    
+    assert patch(client, project_id, section_id, 1, "First edit. ").json() == {"version": 2}
+    stale = patch(client, project_id, section_id, 1, "Second edit. ")
+    
+    assert stale.status_code == 409
+    content, version, revisions = stored(section_id)
+    assert content == "First edit. " + fake_model.reply
+    assert (version, revisions) == (2, 2)
+
+def test_edit_during_section_generation_is_not_overwritten(client, make_project, fake_model):
+    project_id = make_project(["Intro"])
+    section_id = generated_section(client, project_id)
+    fake_model.delay = 1.0
+    thread, results = in_background(lambda: client.post(
+        "/api/generation/generate-section", params={"project_id": project_id, "section_index": 0}
+    ))
+    time.sleep(0.4)
+    
+    edit = patch(client, project_id, section_id, 1, "Edited. ")
+    thread.join()
+    
+    assert edit.status_code == 200
+    assert results[0].status_code == 409
+    assert stored(section_id) == ("Edited. " + fake_model.reply, 2, 2)
+
+def test_edit_during_refinement_is_not_overwritten(client, make_project, fake_model):
+    project_id = make_project(["Intro"])
+    section_id = generated_section(client, project_id)
+    fake_model.delay = 1.0
+    thread, results = in_background(lambda: client.post("/api/refinement/refine", json={
+        "project_id": project_id, "section_id": section_id, "refinement_prompt": "Shorter"
+    }))
+    time.sleep(0.4)
+    
+    edit = patch(client, project_id, section_id, 1, "Edited. ")
+    thread.join()
+    
+    assert edit.status_code == 200
+    assert results[0].status_code == 409
+    assert stored(section_id) == ("Edited. " + fake_model.reply, 2, 2)
+
+def test_bulk_generation_keeps_sections_edited_meanwhile(client, make_project, fake_model):
+    project_id = make_project(["Intro", "Body"])
+    section_id = generated_section(client, project_id)
+    fake_model.delay = 0.8
+    thread, results = in_background(lambda: client.post("/api/generation/generate", json={"project_id": project_id}))
+    time.sleep(0.3)
+    
+    edit = patch(client, project_id, section_id, 1, "Edited. ")
+    thread.join()
+    
+    assert edit.status_code == 200
+    result = results[0].json()
+    assert (result["sections_conflicted"], result["sections_generated"]) == ([0], [1])
+    assert stored(section_id) == ("Edited. " + fake_model.reply, 2, 2)
+
+def test_section_writes_are_conditional_on_the_version_read(client, make_project):
+    project_id = make_project(["Intro"])
+    section_id = generated_section(client, project_id)
+    reader = SessionLocal()
+    try:
+        section = reader.get(DocumentSection, section_id)
+        assert patch(client, project_id, section_id, 1, "Edited. ").status_code == 200
+        
+        section.title = "Renamed"
+        with pytest.raises(StaleDataError):
+            reader.commit()
+    finally:
+        reader.close()
@@ -0,0 +1,148 @@
+"""SIGTERM handling, against a real uvicorn server in a subprocess"""
+import os
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+import uuid
+
+import httpx
+import pytest
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# The app with a model that takes MODEL_DELAY seconds per call
+SERVER = """
+import os, sys, time
+import uvicorn
+import google.generativeai as genai
+
+class FakeResponse:
+    def __init__(self, text):
+        self.text = text
+
+class SlowModel:
+    def __init__(self, name):
+        pass
+
+    def generate_content(self, prompt):
+        time.sleep(float(os.environ["MODEL_DELAY"]))
+        return FakeResponse("Generated paragraph one.\\n\\nGenerated paragraph two.")
+
+genai.GenerativeModel = SlowModel
+genai.configure = lambda **kwargs: None
+from main import app
+uvicorn.run(app, host="127.0.0.1", port=int(os.environ["PORT"]), log_level="warning")
+"""
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+class Server:
+    def __init__(self, database_url, **env):
+        self.port = free_port()
+        self.url = f"http://127.0.0.1:{self.port}"
+        self.process = subprocess.Popen(
+            [sys.executable, "-c", SERVER],
+            cwd=BACKEND_DIR,
+            env={
+                **os.environ, "DATABASE_URL": database_url, "GEMINI_API_KEY": "test",
+                "PORT": str(self.port), **{key: str(value) for key, value in env.items()}
+            }
+        )
+        deadline = time.monotonic() + 30
+        while time.monotonic() < deadline:
+            try:
+                httpx.get(self.url + "/api/health")
+                return
+            except httpx.TransportError:
+                time.sleep(0.1)
+        self.process.kill()
+        raise RuntimeError("server did not start")
+
+    def terminate(self):
+        self.process.send_signal(signal.SIGTERM)
+
+    def wait(self) -> int:
+        return self.process.wait(timeout=30)
+
+@pytest.fixture
+def start_server(tmp_path):
+    database_url = "sqlite:///" + str(tmp_path / "drain.db")
+    servers = []
+    
+    def start(**env):
+        server = Server(database_url, **env)
+        servers.append(server)
+        return server
+    
+    yield start
+    for server in servers:
+        if server.process.poll() is None:
+            server.process.kill()
+
+def new_project(server, titles):
+    client = httpx.Client(base_url=server.url, timeout=60)
+    name = uuid.uuid4().hex[:12]
+    response = client.post("/api/auth/register", json={
+        "email": f"{name}@example.com", "username": name, "password": "password123"
+    })
+    client.headers["Authorization"] = f"Bearer {response.json()['access_token']}"
+    project_id = client.post("/api/projects", json={
+        "title": "Drain", "document_type": "docx", "topic": "Renewable energy"
+    }).json()["id"]
+    client.post(f"/api/projects/{project_id}/structure", json={"structure_data": titles})
+    return client, project_id
+
+def generate_in_background(client, body):
+    responses = []
+    thread = threading.Thread(target=lambda: responses.append(client.post("/api/generation/generate", json=body)))
+    thread.start()
+    return thread, responses
+
+def test_sigterm_finishes_the_current_section_and_checkpoints_the_rest(start_server):
+    server = start_server(MODEL_DELAY=1, DRAIN_NOTICE_SECONDS=1, DRAIN_TIMEOUT_SECONDS=20)
+    client, project_id = new_project(server, ["A", "B", "C", "D", "E"])
+    thread, responses = generate_in_background(client, {"project_id": project_id})
+    time.sleep(1.5)
+    
+    server.terminate()
+    time.sleep(0.3)
+    health = httpx.get(server.url + "/api/health")
+    new_work = client.post("/api/generation/generate-section", params={"project_id": project_id, "section_index": 0})
+    thread.join(timeout=30)
+    
+    assert health.status_code == 503 and health.json()["drain"]["in_flight"] == 1
+    assert new_work.status_code == 503 and new_work.headers["Retry-After"]
+    stopped = responses[0].json()
+    assert responses[0].status_code == 200 and stopped["cancelled"] is True
+    assert stopped["sections_generated"] and stopped["sections_pending"]
+    assert sorted(stopped["sections_generated"] + stopped["sections_pending"]) == [0, 1, 2, 3, 4]
+    assert server.wait() in (0, -signal.SIGTERM)
+    
+    # The next server resumes the checkpointed sections only
+    server = start_server(MODEL_DELAY=0)
+    resumed = httpx.post(server.url + "/api/generation/generate", json={"project_id": project_id}, headers=client.headers)
+    assert resumed.status_code == 200
+    assert resumed.json()["resumed"] is True
+    assert resumed.json()["sections_generated"] == stopped["sections_pending"]
+
+def test_sections_still_running_at_the_drain_deadline_are_stopped(start_server):
+    server = start_server(MODEL_DELAY=10, DRAIN_TIMEOUT_SECONDS=1)
+    client, project_id = new_project(server, ["A", "B"])
+    started = time.monotonic()
+    thread, responses = generate_in_background(client, {"project_id": project_id})
+    time.sleep(0.5)
+    
+    server.terminate()
+    thread.join(timeout=30)
+    
+    stopped = responses[0].json()
+    assert stopped["cancelled"] is True
+    assert stopped["sections_generated"] == [] and stopped["sections_pending"] == [0, 1]
+    assert time.monotonic() - started < 8
+    assert server.wait() in (0, -signal.SIGTERM)
@@ -0,0 +1,104 @@
+import io
+import zipfile
+
+import pytest
+
+SECTIONS = ["Introduction", "Benefits", "Outlook"]
+
+def reply(prompt):
+    # Exports collapse whitespace, bullets survive as inline markers
+    if "Benefits" in prompt:
+        return "Main benefits: • Lower bills • Cleaner air • Local jobs"
+    return "Solar and wind now supply a growing share of electricity."
+
+def generated_project(client, fake_model, make_project, document_type):
+    fake_model.reply = reply
+    project_id = make_project(SECTIONS, document_type=document_type)
+    client.post("/api/generation/generate", json={"project_id": project_id})
+    return project_id
+
+def outline(data: bytes, document_type: str):
+    """What a reader sees: headings, paragraphs and bullets, or slide titles and body text"""
+    if document_type == "docx":
+        from docx import Document
+        document = Document(io.BytesIO(data))
+        return [(p.style.name, p.text) for p in document.paragraphs]
+    
+    from pptx import Presentation
+    presentation = Presentation(io.BytesIO(data))
+    return [
+        (
+            slide.slide_layout.name,
+            slide.shapes.title.text,
+            [
+                (shape.name, p.level, p.text, p.font.bold)
+                for shape in slide.shapes if shape.has_text_frame
+                for p in shape.text_frame.paragraphs
+            ]
+        )
+        for slide in presentation.slides
+    ]
+
+@pytest.mark.parametrize("document_type", ["docx", "pptx"])
+def test_stream_engine_matches_the_library_engine(client, fake_model, make_project, document_type, monkeypatch):
+    import ooxml
+    # Several batches, as for a project larger than one
+    monkeypatch.setattr(ooxml, "STREAM_BATCH_SIZE", 2)
+    project_id = generated_project(client, fake_model, make_project, document_type)
+    
+    library = client.get(f"/api/export/{project_id}/download?engine=library")
+    stream = client.get(f"/api/export/{project_id}/download?engine=stream")
+    
+    assert library.status_code == stream.status_code == 200
+    expected = outline(library.content, document_type)
+    assert outline(stream.content, document_type) == expected
+    
+    text = repr(expected)
+    for title in SECTIONS:
+        assert title in text
+    assert "Lower bills" in text
+
+def test_bulk_archive_holds_the_same_documents(client, fake_model, make_project):
+    projects = {
+        generated_project(client, fake_model, make_project, document_type): document_type
+        for document_type in ("docx", "pptx")
+    }
+    
+    response = client.get("/api/export/bulk")
+    
+    assert response.status_code == 200
+    archive = zipfile.ZipFile(io.BytesIO(response.content))
+    assert archive.testzip() is None
+    names = archive.namelist()
+    assert len(names) == len(projects)
+    for project_id, document_type in projects.items():
+        name = next(n for n in names if n.endswith(f"_{project_id}.{document_type}"))
+        single = client.get(f"/api/export/{project_id}/download?engine=library").content
+        assert outline(archive.read(name), document_type) == outline(single, document_type)
+
+def test_bulk_export_selects_projects_and_reports_failures(client, fake_model, make_project, monkeypatch):
+    import export
+    first = generated_project(client, fake_model, make_project, "docx")
+    failing = generated_project(client, fake_model, make_project, "pptx")
+    empty = make_project(SECTIONS)
+    
+    render = export.render_project
+    
+    def render_or_fail(project_id, bind):
+        if project_id == failing:
+            raise RuntimeError("renderer crashed")
+        return render(project_id, bind)
+    
+    monkeypatch.setattr(export, "render_project", render_or_fail)
+    
+    response = client.get("/api/export/bulk", params={"project_ids": [first, failing, empty]})
+    
+    assert response.status_code == 200
+    archive = zipfile.ZipFile(io.BytesIO(response.content))
+    names = archive.namelist()
+    # Projects without content are left out, failures are listed instead of aborting
+    assert names == [f"Test_project_{first}.docx", "export_errors.txt"]
+    assert f"(id {failing}): renderer crashed" in archive.read("export_errors.txt").decode("utf-8")
+    
+    assert client.get("/api/export/bulk", params={"project_ids": [first, 999999]}).status_code == 404
+    assert client.get("/api/export/bulk", params={"project_ids": [empty]}).status_code == 400
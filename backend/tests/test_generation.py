@@ -0,0 +1,31 @@
+import generation
+
+def generate(client, project_id, **options):
+    response = client.post("/api/generation/generate", json={"project_id": project_id, **options})
+    assert response.status_code == 200
+    return response.json()
+
+def test_only_stale_sections_are_regenerated(client, make_project, fake_model, monkeypatch):
+    project_id = make_project(["Introduction", "Benefits", "Outlook"])
+    assert generate(client, project_id)["sections_generated"] == [0, 1, 2]
+    
+    unchanged = generate(client, project_id, only_stale=True)
+    assert unchanged["sections_generated"] == []
+    assert unchanged["sections_skipped"] == [0, 1, 2]
+    assert len(fake_model.prompts) == 3
+    
+    client.post(f"/api/projects/{project_id}/structure", json={"structure_data": ["Introduction", "Costs", "Outlook"]})
+    renamed = generate(client, project_id, only_stale=True)
+    assert renamed["sections_generated"] == [1]
+    assert renamed["sections_skipped"] == [0, 2]
+    assert "Costs" in fake_model.prompts[-1]
+    sections = client.get(f"/api/documents/{project_id}/sections").json()
+    assert [s["title"] for s in sections] == ["Introduction", "Costs", "Outlook"]
+    
+    # A new prompt template makes every earlier section stale
+    monkeypatch.setattr(generation, "PROMPT_TEMPLATE_VERSION", generation.PROMPT_TEMPLATE_VERSION + 1)
+    assert generate(client, project_id, only_stale=True)["sections_generated"] == [0, 1, 2]
+    
+    # Without only_stale everything is regenerated regardless
+    assert generate(client, project_id)["sections_generated"] == [0, 1, 2]
+    assert len(fake_model.prompts) == 10
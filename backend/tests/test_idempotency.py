@@ -0,0 +1,67 @@
+import threading
+import time
+
+import idempotency
+import token_budget
+from idempotency import REPLAYED_HEADER
+
+def generate_section(client, project_id, section_index=0, key=None):
+    return client.post(
+        "/api/generation/generate-section",
+        params={"project_id": project_id, "section_index": section_index},
+        headers={"Idempotency-Key": key} if key else {}
+    )
+
+def test_repeated_key_replays_without_calling_the_model(client, make_project, fake_model):
+    project_id = make_project(["Intro", "Body"])
+    
+    first = generate_section(client, project_id, key="gen-1")
+    calls = len(fake_model.prompts)
+    again = generate_section(client, project_id, key="gen-1")
+    
+    assert first.status_code == again.status_code == 200
+    assert again.json() == first.json()
+    assert again.headers.get(REPLAYED_HEADER) == "true"
+    assert len(fake_model.prompts) == calls
+
+def test_key_reused_for_another_request_is_rejected(client, make_project):
+    project_id = make_project(["Intro", "Body"])
+    
+    assert generate_section(client, project_id, 0, key="gen-2").status_code == 200
+    response = generate_section(client, project_id, 1, key="gen-2")
+    
+    assert response.status_code == 422
+
+def test_duplicate_of_a_running_request_gets_409_after_waiting(client, make_project, fake_model, monkeypatch):
+    monkeypatch.setattr(idempotency, "IDEMPOTENCY_WAIT_SECONDS", 0.3)
+    fake_model.delay = 1.5
+    project_id = make_project(["Intro"])
+    
+    results = []
+    first = threading.Thread(target=lambda: results.append(generate_section(client, project_id, key="gen-3")))
+    first.start()
+    time.sleep(0.5)
+    duplicate = generate_section(client, project_id, key="gen-3")
+    first.join()
+    
+    assert duplicate.status_code == 409
+    assert results[0].status_code == 200
+    assert len(fake_model.prompts) == 1
+
+def test_refinement_replay_skips_budget_checks(client, make_project, fake_model, monkeypatch):
+    project_id = make_project(["Intro"])
+    section_id = generate_section(client, project_id).json()["section_id"]
+    body = {"project_id": project_id, "section_id": section_id, "refinement_prompt": "Shorter"}
+    
+    first = client.post("/api/refinement/refine", json=body, headers={"Idempotency-Key": "ref-1"})
+    assert first.status_code == 200
+    
+    # The daily budget is used up now: new work is refused, the stored result is not
+    monkeypatch.setattr(token_budget, "USER_DAILY_TOKEN_BUDGET", 1)
+    replay = client.post("/api/refinement/refine", json=body, headers={"Idempotency-Key": "ref-1"})
+    assert replay.status_code == 200
+    assert replay.headers.get(REPLAYED_HEADER) == "true"
+    assert replay.json() == first.json()
+    
+    fresh = client.post("/api/refinement/refine", json=body, headers={"Idempotency-Key": "ref-2"})
+    assert fresh.status_code == 429
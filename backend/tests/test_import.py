@@ -0,0 +1,87 @@
+import io
+import zipfile
+
+import pytest
+from starlette.requests import Request
+
+import importer
+
+SECTIONS = ["Introduction", "Benefits", "Outlook"]
+# Our exports lay content out one paragraph per blank-line block
+REPLY = "Solar panels convert sunlight into electricity."
+
+def exported(client, fake_model, make_project, document_type):
+    fake_model.reply = REPLY
+    project_id = make_project(SECTIONS, document_type=document_type)
+    client.post("/api/generation/generate", json={"project_id": project_id})
+    response = client.get(f"/api/export/{project_id}/download")
+    assert response.status_code == 200
+    return response.content
+
+def upload(client, data, filename="document.docx"):
+    return client.post("/api/import", files={"file": (filename, data)})
+
+@pytest.mark.parametrize("document_type", ["docx", "pptx"])
+def test_exports_import_back_as_the_same_project(client, fake_model, make_project, document_type):
+    data = exported(client, fake_model, make_project, document_type)
+    
+    response = upload(client, data, f"document.{document_type}")
+    
+    assert response.status_code == 200
+    imported = client.get(f"/api/projects/{response.json()['id']}").json()
+    assert imported["title"] == "Test project"
+    assert imported["document_type"] == document_type
+    assert imported["topic"] == "Renewable energy"
+    assert imported["structure"]["structure_data"] == SECTIONS
+    assert [s["title"] for s in imported["sections"]] == SECTIONS
+    assert [s["content"] for s in imported["sections"]] == [REPLY] * len(SECTIONS)
+
+def test_damaged_documents_are_refused(client, fake_model, make_project):
+    data = exported(client, fake_model, make_project, "docx")
+    
+    # Member data corrupted in place: the archive still opens, inflating fails
+    info = zipfile.ZipFile(io.BytesIO(data)).getinfo("word/document.xml")
+    start = info.header_offset + 30 + len(info.filename) + len(info.extra)
+    corrupted = bytearray(data)
+    for i in range(start + 50, start + 80):
+        corrupted[i] ^= 0xFF
+    
+    missing = io.BytesIO()
+    with zipfile.ZipFile(io.BytesIO(data)) as source, zipfile.ZipFile(missing, "w") as target:
+        for item in source.infolist():
+            if item.filename != "word/document.xml":
+                target.writestr(item, source.read(item))
+    
+    for damaged in (data[:len(data) // 2], bytes(corrupted), missing.getvalue(), b"not a document"):
+        response = upload(client, damaged)
+        assert response.status_code == 400
+    
+    projects = client.get("/api/projects").json()
+    assert len(projects) == 1
+
+def test_uploads_over_the_limit_are_refused(client, fake_model, make_project, monkeypatch):
+    data = exported(client, fake_model, make_project, "docx")
+    monkeypatch.setattr(importer, "IMPORT_MAX_BYTES", len(data) - 1)
+    
+    assert upload(client, data).status_code == 413
+    
+    monkeypatch.setattr(importer, "IMPORT_MAX_BYTES", len(data))
+    assert upload(client, data).status_code == 200
+
+def test_oversized_bodies_are_refused_before_parsing(client, monkeypatch):
+    monkeypatch.setattr(importer, "IMPORT_MAX_BYTES", 1000)
+    parsed = []
+    form = Request.form
+    monkeypatch.setattr(Request, "form", lambda self, **kwargs: parsed.append(True) or form(self, **kwargs))
+    body = b"x" * (1000 + importer.IMPORT_BODY_OVERHEAD + 1)
+    
+    assert upload(client, body).status_code == 413
+    assert not parsed
+    
+    # Without a Content-Length the body is cut off while it arrives
+    chunked = client.post(
+        "/api/import",
+        content=iter([body[:4096]] * (len(body) // 4096 + 1)),
+        headers={"Content-Type": "multipart/form-data; boundary=x"}
+    )
+    assert chunked.status_code == 413
@@ -0,0 +1,46 @@
+from outline_cache import OutlineCache
+
+OUTLINE = ["Diagnosis", "Treatment plan", "Follow-up"]
+
+def test_similar_topics_are_served_to_their_own_user_only():
+    cache = OutlineCache(capacity=10, threshold=0.9)
+    cache.put("docx", "Patient John Smith treatment summary", 1, OUTLINE)
+    
+    assert cache.get("docx", "Patient John Smyth treatment summary", 1) == (OUTLINE, "Patient John Smith treatment summary")
+    assert cache.get("docx", "Patient John Smyth treatment summary", 2) == (None, None)
+
+def test_topics_that_differ_in_numbers_are_not_near_duplicates():
+    cache = OutlineCache(capacity=10, threshold=0.9)
+    cache.put("docx", "Marketing plan for 2024", 1, OUTLINE)
+    cache.put("docx", "Sales review Q3 2024", 1, OUTLINE)
+    
+    assert cache.get("docx", "Marketing plan for 2025", 1) == (None, None)
+    assert cache.get("docx", "Sales review Q4 2024", 1) == (None, None)
+    assert cache.get("docx", "The marketing plan for 2024", 1) == (OUTLINE, "Marketing plan for 2024")
+
+def test_identical_topics_are_shared_between_users():
+    cache = OutlineCache(capacity=10, threshold=0.9)
+    cache.put("pptx", "Introduction to machine learning", 1, OUTLINE)
+    
+    assert cache.get("pptx", "Intro to ML", 2) == (OUTLINE, "Introduction to machine learning")
+    assert cache.get("docx", "Intro to ML", 2) == (None, None)
+
+def test_replaced_entries_are_no_longer_shared():
+    cache = OutlineCache(capacity=1, threshold=0.9)
+    cache.put("docx", "Renewable energy", 1, OUTLINE)
+    cache.put("docx", "Ancient Rome", 1, ["Republic", "Empire"])
+    
+    assert cache.get("docx", "Renewable energy", 2) == (None, None)
+    assert cache.get("docx", "Ancient Rome", 2) == (["Republic", "Empire"], "Ancient Rome")
+
+def test_template_endpoint_reuses_the_cached_outline(client, make_project, fake_model):
+    fake_model.reply = "Overview\nHistory of solar\nOutlook"
+    first = make_project([], "docx", topic="Solar panels on public schools")
+    second = make_project([], "docx", topic="Solar panels on public schools")
+    
+    generated = client.post("/api/generation/generate-template", params={"project_id": first})
+    cached = client.post("/api/generation/generate-template", params={"project_id": second})
+    
+    assert generated.json() == {"structure_data": ["Overview", "History of solar", "Outlook"], "cached": False}
+    assert cached.json() == {"structure_data": ["Overview", "History of solar", "Outlook"], "cached": True}
+    assert len(fake_model.prompts) == 1
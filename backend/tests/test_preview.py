@@ -0,0 +1,40 @@
+from database import SessionLocal, DocumentSection
+
+def set_sections(project_id, rows):
+    """Give the project's sections these (section_index, title, content) values, in id order"""
+    db = SessionLocal()
+    try:
+        sections = db.query(DocumentSection).filter(
+            DocumentSection.project_id == project_id
+        ).order_by(DocumentSection.id).all()
+        for section, (section_index, title, content) in zip(sections, rows):
+            section.section_index = section_index
+            section.title = title
+            section.content = content
+        db.commit()
+    finally:
+        db.close()
+
+def test_range_selects_by_section_index(client, make_project):
+    project_id = make_project(["A", "B", "C"])
+    client.post("/api/generation/generate", json={"project_id": project_id})
+    # Indices with a gap, as left by older outline edits
+    set_sections(project_id, [(0, "First", "one"), (2, "Second", "two"), (5, "Third", "three")])
+    
+    response = client.get(f"/api/preview/{project_id}", params={"format": "markdown", "start": 2, "end": 5})
+    
+    assert response.status_code == 200
+    assert response.headers["X-Total-Sections"] == "3"
+    assert response.text == "## 2. Second\n\ntwo\n\n"
+
+def test_markdown_escapes_user_content_like_html(client, make_project):
+    project_id = make_project(["A"])
+    client.post("/api/generation/generate", json={"project_id": project_id})
+    set_sections(project_id, [(0, "# Title *bold*", "1. not a list <script>x</script> [click](javascript:alert(1))")])
+    
+    markdown = client.get(f"/api/preview/{project_id}", params={"format": "markdown", "start": 0}).text
+    html = client.get(f"/api/preview/{project_id}", params={"format": "html"}).text
+    
+    assert "## 1. \\# Title \\*bold\\*\n\n" in markdown
+    assert "1\\. not a list \\<script\\>x\\</script\\> \\[click\\](javascript:alert(1))\n\n" in markdown
+    assert "<script>" not in html and "&lt;script&gt;" in html
@@ -0,0 +1,33 @@
+import threading
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+import profiling
+
+def test_profile_is_saved_off_the_event_loop(monkeypatch, tmp_path):
+    monkeypatch.setattr(profiling, "PROFILE_SECRET", "secret")
+    monkeypatch.setattr(profiling, "PROFILE_DIR", str(tmp_path))
+    threads = {}
+    save_profile = profiling._save_profile
+    
+    def recording_save(name, profiler):
+        threads["save"] = threading.get_ident()
+        save_profile(name, profiler)
+    
+    monkeypatch.setattr(profiling, "_save_profile", recording_save)
+    
+    app = FastAPI()
+    
+    @app.get("/work")
+    async def work():
+        threads["loop"] = threading.get_ident()
+        return {"ok": True}
+    
+    app.add_middleware(profiling.ServerTimingMiddleware)
+    with TestClient(app) as client:
+        response = client.get("/work", params={"profile": "true"}, headers={"X-Profile-Token": "secret"})
+    
+    assert response.status_code == 200
+    assert (tmp_path / response.headers["X-Profile"]).exists()
+    assert threads["save"] != threads["loop"]
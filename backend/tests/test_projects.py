@@ -0,0 +1,116 @@
+import asyncio
+import time
+
+import projects
+import responses
+from database import SessionLocal, DocumentSection
+from documents import SectionResponse
+from projects import ProjectDetailResponse
+
+def generate_all(client, project_id):
+    response = client.post("/api/generation/generate", json={"project_id": project_id})
+    assert response.status_code == 200
+
+def sections_by_index(project_id):
+    db = SessionLocal()
+    try:
+        return db.query(
+            DocumentSection.section_index, DocumentSection.title, DocumentSection.id, DocumentSection.updated_at
+        ).filter(DocumentSection.project_id == project_id).order_by(DocumentSection.section_index).all()
+    finally:
+        db.close()
+
+def test_operations_never_leave_two_sections_at_one_index(client, make_project):
+    project_id = make_project(["A", "B", "C"])
+    generate_all(client, project_id)
+    # The outline drops C; its section row stays, outside the outline at index 2
+    client.post(f"/api/projects/{project_id}/structure", json={"structure_data": ["A", "B"]})
+    before = {row.title: row for row in sections_by_index(project_id)}
+    
+    response = client.post(f"/api/projects/{project_id}/structure/operations", json={"operations": [
+        {"op": "insert", "index": 0, "title": "New"},
+        {"op": "move", "index": 2, "to_index": 1}
+    ]})
+    assert response.status_code == 200
+    assert response.json()["structure_data"] == ["New", "B", "A"]
+    
+    after = sections_by_index(project_id)
+    indices = [row.section_index for row in after]
+    assert len(indices) == len(set(indices))
+    assert [(row.section_index, row.title) for row in after] == [(1, "B"), (2, "A"), (3, "C")]
+    # Moved rows get a new version, so cached previews and ETags are refreshed
+    for row in after:
+        if row.section_index != before[row.title].section_index:
+            assert row.updated_at > before[row.title].updated_at
+        else:
+            assert row.updated_at == before[row.title].updated_at
+
+def test_sections_keep_their_content_when_renumbered(client, make_project, fake_model):
+    fake_model.reply = lambda prompt: "Content for " + prompt.split('Section Title: "')[1].split('"')[0]
+    project_id = make_project(["A", "B", "C", "D"])
+    generate_all(client, project_id)
+    
+    response = client.post(f"/api/projects/{project_id}/structure/operations", json={"operations": [
+        {"op": "delete", "index": 1},
+        {"op": "move", "index": 2, "to_index": 0},
+        {"op": "rename", "index": 2, "title": "C revised"},
+        {"op": "insert", "index": 1, "title": "New"}
+    ]})
+    
+    assert response.status_code == 200
+    result = response.json()
+    assert result["structure_data"] == ["D", "New", "A", "C revised"]
+    assert (result["sections_deleted"], result["sections_renamed"]) == (1, 1)
+    sections = client.get(f"/api/documents/{project_id}/sections").json()
+    # The inserted entry has no section yet; the others carry their content along
+    assert [(s["section_index"], s["title"], s["content"]) for s in sections] == [
+        (0, "D", "Content for D"),
+        (2, "A", "Content for A"),
+        (3, "C revised", "Content for C")
+    ]
+    assert len(fake_model.prompts) == 4
+
+def test_detail_and_section_list_match_the_response_models(client, make_project, monkeypatch):
+    project_id = make_project(["Einführung", "Kosten", "Ausblick"])
+    for index in (2, 0):
+        client.post("/api/generation/generate-section", params={"project_id": project_id, "section_index": index})
+    # A section row without content, as left by an interrupted write
+    db = SessionLocal()
+    try:
+        db.add(DocumentSection(project_id=project_id, section_index=1, title="Kosten", current_revision=0))
+        db.commit()
+    finally:
+        db.close()
+    
+    detail = client.get(f"/api/projects/{project_id}")
+    sections = client.get(f"/api/documents/{project_id}/sections")
+    
+    assert detail.status_code == sections.status_code == 200
+    body = detail.json()
+    assert ProjectDetailResponse.model_validate(body).model_dump(mode="json") == body
+    assert body["structure"] == {"structure_data": ["Einführung", "Kosten", "Ausblick"]}
+    assert [s["section_index"] for s in body["sections"]] == [0, 1, 2]
+    assert body["sections"][1]["content"] is None
+    assert [SectionResponse.model_validate(s).model_dump(mode="json") for s in sections.json()] == body["sections"]
+    
+    # The stdlib fallback encodes the same bytes as orjson
+    monkeypatch.setattr(responses, "orjson", None)
+    assert client.get(f"/api/projects/{project_id}").content == detail.content
+    assert client.get(f"/api/documents/{project_id}/sections").content == sections.content
+
+def test_startup_purge_runs_in_one_worker_at_a_time(monkeypatch):
+    runs = []
+    
+    def slow_purge():
+        runs.append(time.monotonic())
+        time.sleep(0.5)
+    
+    monkeypatch.setattr(projects, "purge_deleted_projects", slow_purge)
+    
+    async def start_workers():
+        return await asyncio.gather(*(projects.purge_deleted_projects_once() for _ in range(3)))
+    
+    assert sorted(asyncio.run(start_workers())) == [False, False, True]
+    assert len(runs) == 1
+    # Released afterwards, so the next start purges again
+    assert asyncio.run(projects.purge_deleted_projects_once()) is True
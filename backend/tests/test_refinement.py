@@ -0,0 +1,101 @@
+from database import SessionLocal, DocumentSection
+from token_budget import REFINE_CONTEXT_TOKENS, CHARS_PER_TOKEN, split_context
+
+def section_with_content(client, make_project, content):
+    project_id = make_project(["Overview"])
+    response = client.post("/api/generation/generate-section", params={"project_id": project_id, "section_index": 0})
+    assert response.status_code == 200
+    db = SessionLocal()
+    try:
+        section = db.query(DocumentSection).filter(DocumentSection.project_id == project_id).one()
+        section.content = content
+        db.commit()
+        return project_id, section.id
+    finally:
+        db.close()
+
+def test_split_context_keeps_everything():
+    text = "\n\n".join(f"Paragraph {i}. " + "word " * 200 for i in range(40))
+    kept, separator, window = split_context(text, 1000)
+    
+    assert kept + separator + window == text
+    assert "\n\n" in separator and not separator.strip()
+    assert len(window) <= 1000 * CHARS_PER_TOKEN
+    assert window.startswith("Paragraph ")
+
+def test_short_section_is_refined_whole(client, make_project, fake_model):
+    project_id, section_id = section_with_content(client, make_project, "Short original text.")
+    fake_model.reply = "Short refined text."
+    
+    response = client.post("/api/refinement/refine", json={
+        "project_id": project_id, "section_id": section_id, "refinement_prompt": "Improve it"
+    })
+    
+    assert response.status_code == 200
+    assert response.json()["refined_content"] == "Short refined text."
+    assert "not shown" not in fake_model.prompts[-1]
+
+def test_long_section_only_replaces_the_refined_window(client, make_project, fake_model):
+    paragraphs = [f"Paragraph {i} " + "lorem ipsum " * 60 for i in range(60)]
+    original = "\n\n".join(paragraphs)
+    assert len(original) > REFINE_CONTEXT_TOKENS * CHARS_PER_TOKEN * 2
+    project_id, section_id = section_with_content(client, make_project, original)
+    fake_model.reply = "Refined ending."
+    
+    response = client.post("/api/refinement/refine", json={
+        "project_id": project_id, "section_id": section_id, "refinement_prompt": "Tighten the ending"
+    })
+    assert response.status_code == 200
+    
+    kept, separator, window = split_context(original, REFINE_CONTEXT_TOKENS)
+    refined = response.json()["refined_content"]
+    # Nothing before the window is lost and no placeholder ends up in the document
+    assert refined == kept + separator + "Refined ending."
+    assert refined.startswith(paragraphs[0])
+    assert "omitted" not in refined
+    
+    prompt = fake_model.prompts[-1]
+    assert "not shown and will be kept unchanged" in prompt
+    assert window in prompt
+    assert paragraphs[0] not in prompt
+    
+    db = SessionLocal()
+    try:
+        assert db.get(DocumentSection, section_id).content == refined
+    finally:
+        db.close()
+
+def test_history_pages_through_every_entry_newest_first(client, make_project, fake_model):
+    project_id, section_id = section_with_content(client, make_project, "Original text.")
+    fake_model.reply = lambda prompt: f"Refined text {len(fake_model.prompts)}."
+    section = {"project_id": project_id, "section_id": section_id}
+    
+    expected = []
+    for i in range(4):
+        refined = client.post("/api/refinement/refine", json={**section, "refinement_prompt": f"Variant {i}"}).json()
+        expected.append(("refinement", refined["refined_content"]))
+        if i == 1:
+            client.post("/api/refinement/feedback", json={**section, "feedback": "like"})
+            expected.append(("like", refined["refined_content"]))
+    
+    pages = []
+    cursor = None
+    while True:
+        params = {"limit": 2, "include_content": True}
+        if cursor:
+            params["cursor"] = cursor
+        page = client.get(f"/api/refinement/{project_id}/history", params=params).json()
+        pages.append(page["items"])
+        cursor = page["next_cursor"]
+        if not cursor:
+            break
+    
+    assert [len(items) for items in pages] == [2, 2, 1]
+    items = [item for items in pages for item in items]
+    assert [item["id"] for item in items] == sorted((item["id"] for item in items), reverse=True)
+    assert [(item["feedback"] or "refinement", item["content"]) for item in items] == expected[::-1]
+    
+    liked = client.get(f"/api/refinement/{project_id}/history", params={"feedback": "like"}).json()
+    assert [item["feedback"] for item in liked["items"]] == ["like"]
+    assert "content" not in liked["items"][0]
+    assert client.get(f"/api/refinement/{project_id}/history", params={"cursor": "not-a-cursor"}).status_code == 400
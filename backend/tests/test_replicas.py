@@ -0,0 +1,96 @@
+import time
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from starlette.requests import Request
+
+import replicas
+from database import engine
+from replicas import ReadYourWritesMiddleware, Replica, LAST_WRITE_HEADER, last_write, write_stamp, pick_replica
+
+def request_with(headers):
+    return Request({
+        "type": "http",
+        "method": "GET",
+        "path": "/",
+        "headers": [(name.lower().encode(), value.encode()) for name, value in headers.items()]
+    })
+
+def stamping_client():
+    app = FastAPI()
+    app.add_middleware(ReadYourWritesMiddleware)
+    
+    @app.post("/write")
+    async def write():
+        return {}
+    
+    @app.get("/read")
+    async def read():
+        return {}
+    
+    return TestClient(app)
+
+def test_writes_are_stamped_and_the_stamp_reads_back(monkeypatch):
+    client = stamping_client()
+    monkeypatch.setattr(replicas, "write_position", lambda: 123456)
+    
+    response = client.post("/write", headers={"Authorization": "Bearer one"})
+    stamp = response.headers[LAST_WRITE_HEADER]
+    
+    assert last_write(request_with({"Authorization": "Bearer one", LAST_WRITE_HEADER: stamp})) == 123456
+    assert LAST_WRITE_HEADER not in client.get("/read", headers={"Authorization": "Bearer one"}).headers
+    assert LAST_WRITE_HEADER not in client.post("/write").headers
+
+def test_stamps_only_count_for_their_own_client():
+    client = stamping_client()
+    stamp = client.post("/write", headers={"Authorization": "Bearer one"}).headers[LAST_WRITE_HEADER]
+    position, signature = stamp.split(".", 1)
+    
+    assert last_write(request_with({"Authorization": "Bearer two", LAST_WRITE_HEADER: stamp})) is None
+    forged = f"{int(position) + 1}.{signature}"
+    assert last_write(request_with({"Authorization": "Bearer one", LAST_WRITE_HEADER: forged})) is None
+    assert last_write(request_with({"Authorization": "Bearer one", LAST_WRITE_HEADER: "garbage"})) is None
+    assert last_write(request_with({"Authorization": "Bearer one"})) is None
+
+def stand_in_replica(replayed):
+    """Replica on the test database that claims to have replayed up to replayed"""
+    replica = Replica(engine.url.render_as_string(hide_password=False))
+    replica.lag, replica.replayed = 0.0, replayed
+    replica.checked_at = time.time() + 3600  # No refresh during the test
+    return replica
+
+def test_reads_stay_on_the_primary_until_a_replica_has_the_clients_write(monkeypatch):
+    replica = stand_in_replica(replayed=1000)
+    monkeypatch.setattr(replicas, "replicas", [replica])
+    
+    def routed(position=None):
+        headers = {"Authorization": "Bearer one"}
+        if position is not None:
+            headers[LAST_WRITE_HEADER] = write_stamp(replicas._client_key(request_with(headers)), position)
+        return pick_replica(request_with(headers))
+    
+    recent_writes = replicas.routing_counts["primary_recent_write"]
+    assert routed(1001) is None
+    assert replicas.routing_counts["primary_recent_write"] == recent_writes + 1
+    
+    assert routed(1000) is replica
+    assert routed(999) is replica
+    assert routed() is replica
+    
+    # Low lag alone is not enough: the replica must have replayed the write
+    replica.replayed = 500
+    assert routed(1000) is None
+
+@pytest.mark.skipif(engine.dialect.name != "postgresql", reason="WAL positions need PostgreSQL")
+def test_wal_positions_read_back_from_postgres(monkeypatch):
+    # The primary standing in for its own replica has replayed every write
+    replica = Replica(engine.url.render_as_string(hide_password=False))
+    monkeypatch.setattr(replicas, "replicas", [replica])
+    
+    position = replicas.write_position()
+    replica.refresh()
+    
+    assert position > 0
+    assert replica.usable()
+    assert replica.has_replayed(position)
@@ -0,0 +1,59 @@
+import importlib.util
+
+def project_with_content(client, make_project, fake_model):
+    fake_model.reply = "Wind and solar power. " * 100
+    project_id = make_project(["Introduction", "Benefits"])
+    client.post("/api/generation/generate", json={"project_id": project_id})
+    return project_id
+
+def test_reads_answer_304_until_the_project_changes(client, make_project, fake_model):
+    project_id = project_with_content(client, make_project, fake_model)
+    
+    for path in (f"/api/projects/{project_id}", f"/api/documents/{project_id}/sections"):
+        first = client.get(path)
+        etag = first.headers["ETag"]
+        assert etag.startswith('W/"')
+        
+        cached = client.get(path, headers={"If-None-Match": etag})
+        assert cached.status_code == 304
+        assert cached.content == b""
+        assert cached.headers["ETag"] == etag
+        # Strong form and lists of candidates match too, weak comparison
+        assert client.get(path, headers={"If-None-Match": f'"other", {etag[2:]}'}).status_code == 304
+        assert client.get(path, headers={"If-None-Match": '"other"'}).status_code == 200
+    
+    etag = client.get(f"/api/projects/{project_id}").headers["ETag"]
+    section = client.get(f"/api/documents/{project_id}/sections").json()[0]
+    client.patch(f"/api/documents/{project_id}/sections/{section['id']}/content", json={
+        "base_version": section["version"],
+        "operations": [{"start": 0, "end": 0, "text": "Edited. "}]
+    })
+    
+    changed = client.get(f"/api/projects/{project_id}", headers={"If-None-Match": etag})
+    assert changed.status_code == 200
+    assert changed.headers["ETag"] != etag
+    assert changed.json()["sections"][0]["content"].startswith("Edited. ")
+
+def test_responses_are_compressed_as_the_client_accepts(client, make_project, fake_model):
+    project_id = project_with_content(client, make_project, fake_model)
+    path = f"/api/projects/{project_id}"
+    plain = client.get(path, headers={"Accept-Encoding": "identity"})
+    assert "content-encoding" not in plain.headers
+    
+    gzipped = client.get(path, headers={"Accept-Encoding": "gzip"})
+    assert gzipped.headers["content-encoding"] == "gzip"
+    assert "Accept-Encoding" in gzipped.headers["vary"]
+    assert gzipped.json() == plain.json()
+    
+    if importlib.util.find_spec("brotli_asgi"):
+        brotli = client.get(path, headers={"Accept-Encoding": "gzip, br"})
+        assert brotli.headers["content-encoding"] == "br"
+        assert brotli.json() == plain.json()
+        # Exports are already deflated and go out as they are
+        export = client.get(f"/api/export/{project_id}/download", headers={"Accept-Encoding": "br"})
+        assert "content-encoding" not in export.headers
+    
+    # Bodies under COMPRESSION_MINIMUM_SIZE are not worth compressing
+    small = client.get("/api/auth/me", headers={"Accept-Encoding": "gzip, br"})
+    assert small.status_code == 200
+    assert "content-encoding" not in small.headers
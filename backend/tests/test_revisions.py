@@ -0,0 +1,46 @@
+import pytest
+
+import revisions
+from revisions import encode_delta, apply_delta
+
+BASE = "".join(f"Line {i} of the section, with enough words to be worth a delta.\n" for i in range(40))
+
+@pytest.mark.parametrize("new", [
+    BASE,
+    BASE.replace("Line 20 ", "Changed line 20 "),
+    "Inserted first line.\n" + BASE,
+    BASE + "Appended last line without a newline",
+    BASE.replace("Line 5 of", "Line five of").replace("Line 30 of the section, with enough words to be worth a delta.\n", ""),
+    "",
+])
+def test_delta_rebuilds_the_new_text(new):
+    assert apply_delta(BASE, encode_delta(BASE, new)) == new
+    assert apply_delta(new, encode_delta(new, BASE)) == BASE
+
+def test_revisions_read_back_across_snapshot_boundaries(client, make_project, fake_model, monkeypatch):
+    monkeypatch.setattr(revisions, "SNAPSHOT_INTERVAL", 3)
+    fake_model.reply = BASE
+    project_id = make_project(["Introduction"])
+    section = client.post("/api/generation/generate-section", params={"project_id": project_id, "section_index": 0}).json()
+    section_id = section["section_id"]
+    
+    history = [BASE]
+    for i in range(7):
+        new = history[-1].replace(f"Line {i * 5} ", f"Edit {i} of line {i * 5} ")
+        response = client.patch(f"/api/documents/{project_id}/sections/{section_id}/content", json={
+            "base_version": len(history),
+            "operations": [{"start": 0, "end": len(history[-1]), "text": new}]
+        })
+        assert response.status_code == 200
+        history.append(new)
+    
+    listed = client.get(f"/api/refinement/{project_id}/sections/{section_id}/revisions").json()
+    snapshots = sorted(r["revision_number"] for r in listed if r["is_snapshot"])
+    assert snapshots == [1, 4, 7]
+    deltas = [r for r in listed if not r["is_snapshot"]]
+    assert deltas and all(r["stored_bytes"] < len(BASE) // 4 for r in deltas)
+    
+    for number, expected in enumerate(history, start=1):
+        response = client.get(f"/api/refinement/{project_id}/sections/{section_id}/revisions/{number}")
+        assert response.json()["content"] == expected
+    assert client.get(f"/api/refinement/{project_id}/sections/{section_id}/revisions/{len(history) + 1}").status_code == 404
@@ -0,0 +1,77 @@
+import asyncio
+
+from scheduler import ModelScheduler, INTERACTIVE, TEMPLATE, BULK
+
+async def started(scheduler, priority, user_id, log):
+    """Task that acquires a slot and logs (priority, user_id) once admitted"""
+    async def run():
+        await scheduler.acquire(priority, user_id)
+        log.append((priority, user_id))
+    task = asyncio.ensure_future(run())
+    await asyncio.sleep(0)
+    return task
+
+def test_bulk_calls_leave_the_reserved_slot_to_interactive_ones():
+    async def main():
+        scheduler = ModelScheduler(3, interactive_reserved=1)
+        log = []
+        for user_id in (1, 2, 3):
+            await started(scheduler, BULK, user_id, log)
+        # Only two bulk calls run, the third waits although a slot is free
+        assert log == [(BULK, 1), (BULK, 2)]
+        assert scheduler.running == 2
+        
+        await started(scheduler, INTERACTIVE, 4, log)
+        assert log[-1] == (INTERACTIVE, 4)
+        assert scheduler.running == 3
+        
+        # With every slot taken, a freed slot goes to the most urgent class
+        await started(scheduler, TEMPLATE, 5, log)
+        await started(scheduler, INTERACTIVE, 6, log)
+        scheduler.release()
+        await asyncio.sleep(0)
+        assert log[-1] == (INTERACTIVE, 6)
+        
+        # Non-interactive calls may only take slots beyond the reserved one
+        scheduler.release()
+        await asyncio.sleep(0)
+        assert log[-1] == (INTERACTIVE, 6)
+        scheduler.release()
+        await asyncio.sleep(0)
+        assert log[-1] == (TEMPLATE, 5)
+        scheduler.release()
+        await asyncio.sleep(0)
+        assert log[-1] == (BULK, 3)
+        assert scheduler.stats()["classes"]["bulk"]["queued"] == 0
+    
+    asyncio.run(main())
+
+def test_users_take_turns_within_a_class():
+    async def main():
+        scheduler = ModelScheduler(1)
+        log = []
+        await started(scheduler, BULK, 0, log)
+        for user_id in ("a", "a", "a", "b"):
+            await started(scheduler, BULK, user_id, log)
+        for _ in range(4):
+            scheduler.release()
+            await asyncio.sleep(0)
+        assert [user_id for _, user_id in log] == [0, "a", "b", "a", "a"]
+    
+    asyncio.run(main())
+
+def test_cancelled_waiters_give_up_their_place():
+    async def main():
+        scheduler = ModelScheduler(1)
+        log = []
+        await started(scheduler, INTERACTIVE, 1, log)
+        gone = await started(scheduler, INTERACTIVE, 2, log)
+        await started(scheduler, INTERACTIVE, 3, log)
+        gone.cancel()
+        await asyncio.sleep(0)
+        scheduler.release()
+        await asyncio.sleep(0)
+        assert log == [(INTERACTIVE, 1), (INTERACTIVE, 3)]
+        assert scheduler.running == 1
+    
+    asyncio.run(main())
@@ -0,0 +1,114 @@
+from contextlib import contextmanager
+import zlib
+
+import pytest
+from sqlalchemy import create_engine, select, text
+
+import database
+from database import CODEC_RAW, CODEC_ZLIB, CODEC_ZSTD, DocumentSection, Project, Refinement, engine, upgrade_schema
+
+# Tables as the first release created them
+LEGACY_TABLES = (
+    """CREATE TABLE projects (
+        id INTEGER PRIMARY KEY, title VARCHAR NOT NULL, document_type VARCHAR NOT NULL,
+        topic TEXT NOT NULL, user_id INTEGER NOT NULL, created_at TIMESTAMP, updated_at TIMESTAMP
+    )""",
+    """CREATE TABLE document_sections (
+        id INTEGER PRIMARY KEY, project_id INTEGER NOT NULL, section_index INTEGER NOT NULL,
+        title VARCHAR NOT NULL, content TEXT, generated_at TIMESTAMP, updated_at TIMESTAMP
+    )""",
+)
+LEGACY_REFINEMENTS = """CREATE TABLE refinements (
+    id INTEGER PRIMARY KEY, project_id INTEGER NOT NULL, section_id INTEGER NOT NULL,
+    refinement_prompt TEXT, refined_content TEXT NOT NULL, feedback VARCHAR, comment TEXT, created_at TIMESTAMP
+)"""
+
+LONG_TEXT = "Compressed section content. " * 40
+
+@contextmanager
+def legacy_database(tmp_path, *tables):
+    """A connection to an empty database holding only the given old tables, rolled back afterwards"""
+    if engine.dialect.name == "postgresql":
+        with engine.connect() as conn:
+            transaction = conn.begin()
+            conn.execute(text("CREATE SCHEMA legacy"))
+            conn.execute(text("SET LOCAL search_path TO legacy"))
+            for ddl in tables:
+                conn.execute(text(ddl))
+            try:
+                yield conn
+            finally:
+                transaction.rollback()
+    else:
+        legacy_engine = create_engine("sqlite:///" + str(tmp_path / "legacy.db"))
+        with legacy_engine.connect() as conn:
+            for ddl in tables:
+                conn.execute(text(ddl))
+            yield conn
+        legacy_engine.dispose()
+
+def stored_section(db, section_id):
+    """(raw bytes or text as stored, content as read through the model)"""
+    raw = db.execute(text("SELECT content FROM document_sections WHERE id = :id"), {"id": section_id}).scalar()
+    db.expire_all()
+    return raw, db.get(DocumentSection, section_id).content
+
+@pytest.mark.parametrize("codec", ["zstd", "zlib"])
+def test_compressed_content_round_trips(client, make_project, monkeypatch, codec):
+    if codec == "zstd" and database.zstandard is None:
+        pytest.skip("zstandard is not installed")
+    if codec == "zlib":
+        monkeypatch.setattr(database, "zstandard", None)
+    project_id = make_project(["Overview"])
+    client.post("/api/generation/generate", json={"project_id": project_id})
+    db = database.SessionLocal()
+    try:
+        section = db.query(DocumentSection).filter(DocumentSection.project_id == project_id).one()
+        section.content = LONG_TEXT
+        db.commit()
+        raw, content = stored_section(db, section.id)
+        
+        assert bytes(raw)[:1] == (CODEC_ZSTD if codec == "zstd" else CODEC_ZLIB)
+        assert len(raw) < len(LONG_TEXT)
+        assert content == LONG_TEXT
+        
+        section.content = "Short"
+        db.commit()
+        raw, content = stored_section(db, section.id)
+        assert bytes(raw) == CODEC_RAW + b"Short"
+        assert content == "Short"
+    finally:
+        db.close()
+
+def test_upgrade_converts_legacy_sections(tmp_path):
+    with legacy_database(tmp_path, *LEGACY_TABLES) as conn:
+        conn.execute(text(
+            "INSERT INTO projects (id, title, document_type, topic, user_id) VALUES (1, 'Old', 'docx', 'Topic', 1)"
+        ))
+        conn.execute(text(
+            "INSERT INTO document_sections (id, project_id, section_index, title, content) "
+            "VALUES (1, 1, 0, 'Intro', :legacy), (2, 1, 1, 'Empty', NULL)"
+        ), {"legacy": LONG_TEXT})
+        
+        upgrade_schema(conn)
+        upgrade_schema(conn)  # Nothing left to do the second time
+        rows = conn.execute(
+            select(DocumentSection.id, DocumentSection.content, DocumentSection.current_revision)
+            .order_by(DocumentSection.id)
+        ).all()
+        deleted = conn.execute(select(Project.deleted_at)).scalar()
+        
+        assert [tuple(row) for row in rows] == [(1, LONG_TEXT, 0), (2, None, 0)]
+        assert deleted is None
+        conn.execute(DocumentSection.__table__.update().values(content="New " * 50))
+        assert conn.execute(select(DocumentSection.content).where(DocumentSection.id == 2)).scalar() == "New " * 50
+
+def test_upgrade_relaxes_or_refuses_not_null_columns(tmp_path):
+    with legacy_database(tmp_path, LEGACY_REFINEMENTS) as conn:
+        if conn.dialect.name != "postgresql":
+            with pytest.raises(RuntimeError, match="refinements.refined_content must allow NULL"):
+                upgrade_schema(conn)
+            return
+        upgrade_schema(conn)
+        conn.execute(Refinement.__table__.insert().values(id=1, project_id=1, section_id=1, refinement_prompt="p"))
+        assert conn.execute(select(Refinement.refined_content)).scalar() is None
@@ -0,0 +1,43 @@
+import uuid
+
+from search import KIND_SECTION, remove_project_documents, search_supported, upsert_document
+
+def search(client, q):
+    response = client.get("/api/search", params={"q": q})
+    assert response.status_code == 200
+    return response.json()["results"]
+
+def test_generated_sections_are_found_until_the_project_is_deleted(client, make_project, fake_model):
+    word = "zephyr" + uuid.uuid4().hex[:8]
+    fake_model.reply = f"Wind turbines and {word} farms.\n\nMore text about the grid."
+    project_id = make_project(["Wind power"], topic="Offshore wind")
+    assert client.post("/api/generation/generate", json={"project_id": project_id}).status_code == 200
+    
+    results = search(client, word)
+    
+    assert [(r["kind"], r["project_id"], r["section_index"]) for r in results] == [("section", project_id, 0)]
+    assert f"<mark>{word}</mark>" in results[0]["snippet"]
+    
+    assert client.delete(f"/api/projects/{project_id}").status_code in (200, 204)
+    assert search(client, word) == []
+
+def test_project_topics_are_searchable(client, make_project):
+    word = "quasar" + uuid.uuid4().hex[:8]
+    project_id = make_project([], topic=f"Notes on {word} observations")
+    
+    results = search(client, word)
+    
+    assert [(r["kind"], r["project_id"]) for r in results] == [("project", project_id)]
+
+class FakeBind:
+    def __init__(self, name, version=None):
+        self.dialect = type("Dialect", (), {"name": name, "server_version_info": version})()
+
+def test_index_is_only_maintained_where_supported():
+    assert search_supported(FakeBind("sqlite"))
+    assert search_supported(FakeBind("postgresql", (16, 2)))
+    assert not search_supported(FakeBind("postgresql", (11, 9)))
+    assert not search_supported(FakeBind("mysql", (8, 0)))
+    # Writes go through without touching an index that does not exist
+    upsert_document(FakeBind("mysql"), KIND_SECTION, 1, 1, 1, "", "text")
+    remove_project_documents(FakeBind("mysql"), 1)
@@ -0,0 +1,67 @@
+import asyncio
+import threading
+import time
+
+import singleflight
+from database import engine
+from singleflight import cross_process_lock
+
+class HeldLock:
+    """Holds key's cross-process lock from another thread, as another worker would"""
+
+    def __init__(self, key):
+        self.key = key
+        self.held = threading.Event()
+        self.release = threading.Event()
+        self.thread = threading.Thread(target=lambda: asyncio.run(self.hold()))
+
+    async def hold(self):
+        async with cross_process_lock(self.key) as acquired:
+            assert acquired
+            self.held.set()
+            while not self.release.is_set():
+                await asyncio.sleep(0.01)
+
+    def __enter__(self):
+        self.thread.start()
+        assert self.held.wait(10)
+        return self
+
+    def __exit__(self, *exc):
+        self.release.set()
+        self.thread.join()
+
+def test_generation_answers_503_while_another_process_holds_the_section(client, fake_model, make_project, monkeypatch):
+    project_id = make_project(["Introduction"])
+    monkeypatch.setattr(singleflight, "LOCK_WAIT_SECONDS", 0.2)
+    
+    with HeldLock(f"section:{project_id}:0"):
+        response = client.post(f"/api/generation/generate-section?project_id={project_id}&section_index=0")
+    
+    assert response.status_code == 503
+    assert response.headers["Retry-After"]
+    assert not fake_model.prompts
+    
+    response = client.post(f"/api/generation/generate-section?project_id={project_id}&section_index=0")
+    assert response.status_code == 200
+
+def test_generation_holds_at_most_two_connections(client, fake_model, make_project):
+    project_id = make_project(["Introduction"])
+    fake_model.delay = 0.5
+    responses = []
+
+    def generate():
+        responses.append(client.post(f"/api/generation/generate-section?project_id={project_id}&section_index=0"))
+    
+    request = threading.Thread(target=generate)
+    request.start()
+    deadline = time.monotonic() + 10
+    while not fake_model.prompts and time.monotonic() < deadline:
+        time.sleep(0.01)
+    # Sampled while the model runs: the request's session and the flight's own
+    checked_out = engine.pool.checkedout()
+    request.join()
+    
+    assert fake_model.prompts
+    assert responses[0].status_code == 200
+    assert checked_out <= 2
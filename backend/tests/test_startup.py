@@ -0,0 +1,16 @@
+from import_check import startup_problems
+from main import HEAVY_MODULES
+
+def test_main_imports_within_budget_without_heavy_modules():
+    import_ms, problems = startup_problems(HEAVY_MODULES)
+    
+    assert problems == [], f"import main: {import_ms:.0f} ms"
+
+def test_eager_imports_are_reported():
+    import_ms, problems = startup_problems(("sqlalchemy",), budget_ms=0)
+    
+    assert import_ms > 0
+    assert problems == [
+        f"import main took {import_ms:.0f} ms, over the 0 ms budget",
+        "sqlalchemy is imported at startup, it should load on first use"
+    ]
@@ -0,0 +1,70 @@
+from datetime import datetime, timedelta
+
+import token_budget
+from database import SessionLocal, Refinement, TokenUsage
+from generation import build_prompt
+from token_budget import REFINE_CONTEXT_TOKENS, count_tokens, get_user_token_usage, split_context
+from test_refinement import section_with_content
+
+def usage_of(project_id):
+    """(user_id, tokens) recorded for a project's generation calls"""
+    db = SessionLocal()
+    try:
+        rows = db.query(TokenUsage).filter(TokenUsage.project_id == project_id).all()
+        user_id = rows[0].user_id
+        return user_id, get_user_token_usage(db, user_id, datetime.utcnow() - timedelta(days=1))
+    finally:
+        db.close()
+
+def test_generation_counts_towards_the_daily_budget(client, make_project, fake_model, monkeypatch):
+    project_id = make_project(["S1"])
+    assert client.post("/api/generation/generate-section", params={"project_id": project_id, "section_index": 0}).status_code == 200
+    
+    _, used = usage_of(project_id)
+    prompt_tokens = count_tokens(build_prompt("Renewable energy", "S1", "docx"))
+    assert used == prompt_tokens + count_tokens(fake_model.reply)
+    
+    monkeypatch.setattr(token_budget, "USER_DAILY_TOKEN_BUDGET", used)
+    calls = len(fake_model.prompts)
+    single = client.post("/api/generation/generate-section", params={"project_id": project_id, "section_index": 0})
+    bulk = client.post("/api/generation/generate", json={"project_id": project_id})
+    
+    assert single.status_code == 429
+    assert bulk.status_code == 429
+    assert len(fake_model.prompts) == calls
+
+def test_bulk_generation_stops_when_the_budget_runs_out(client, make_project, fake_model, monkeypatch):
+    first = make_project(["S1"])
+    client.post("/api/generation/generate-section", params={"project_id": first, "section_index": 0})
+    _, per_section = usage_of(first)
+    prompt_tokens = count_tokens(build_prompt("Renewable energy", "S2", "docx"))
+    
+    # Room for exactly one more section
+    monkeypatch.setattr(token_budget, "USER_DAILY_TOKEN_BUDGET", 2 * per_section + prompt_tokens - 1)
+    project_id = make_project(["S1", "S2", "S3"])
+    result = client.post("/api/generation/generate", json={"project_id": project_id}).json()
+    
+    assert result["sections_generated"] == [0]
+    assert result["cancelled"] is True
+    assert result["sections_pending"] == [1, 2]
+
+def test_refinement_is_charged_for_the_window_only(client, make_project, fake_model):
+    original = "\n\n".join(f"Paragraph {i} " + "lorem ipsum " * 60 for i in range(60))
+    project_id, section_id = section_with_content(client, make_project, original)
+    fake_model.reply = "Refined ending."
+    
+    response = client.post("/api/refinement/refine", json={
+        "project_id": project_id, "section_id": section_id, "refinement_prompt": "Tighten the ending"
+    })
+    
+    assert response.status_code == 200
+    kept, _, _ = split_context(original, REFINE_CONTEXT_TOKENS)
+    assert count_tokens(kept) > 1000
+    assert response.json()["output_tokens"] == count_tokens("Refined ending.")
+    db = SessionLocal()
+    try:
+        refinement = db.query(Refinement).filter(Refinement.section_id == section_id).one()
+        assert refinement.output_tokens == count_tokens("Refined ending.")
+        assert refinement.input_tokens < count_tokens(original)
+    finally:
+        db.close()
@@ -0,0 +1,119 @@
+from fastapi import HTTPException
+from sqlalchemy import func, delete
+from sqlalchemy.orm import Session
+from datetime import datetime, timedelta
+import os
+import time
+
+from database import Project, Refinement, TokenUsage
+
+# Gemini averages roughly four characters per token for English prose. A local
+# estimate keeps accounting free of an extra count_tokens round trip per call.
+CHARS_PER_TOKEN = 4
+
+# Hard cap on the prompt sent for a single request
+MAX_REQUEST_TOKENS = int(os.getenv("MAX_REQUEST_TOKENS", "8000"))
+# Share of the request budget the existing section content may take in a refinement
+REFINE_CONTEXT_TOKENS = int(os.getenv("REFINE_CONTEXT_TOKENS", "3000"))
+# Rolling 24h input + output tokens per user, 0 disables the check
+USER_DAILY_TOKEN_BUDGET = int(os.getenv("USER_DAILY_TOKEN_BUDGET", "200000"))
+
+# Generation usage older than this no longer counts and is deleted
+USAGE_RETENTION_HOURS = 48
+USAGE_PRUNE_INTERVAL_SECONDS = 3600
+_last_usage_prune = 0.0
+
+def count_tokens(text: str) -> int:
+    """Estimate the number of tokens in a piece of text"""
+    if not text:
+        return 0
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+def split_context(text: str, max_tokens: int):
+    """Split text into a kept beginning and a window of roughly max_tokens at its end.
+
+    Only the window is sent for refinement and replaced by the result; the
+    beginning is kept as it is. The end of a section carries its most recent
+    refinement, so that is what gets refined. Returns (kept, separator, window)
+    with kept + separator + window == text, cut at a paragraph, line or
+    sentence break where there is one so the model never starts mid-sentence.
+    """
+    if count_tokens(text) <= max_tokens:
+        return "", "", text
+    
+    budget_chars = max_tokens * CHARS_PER_TOKEN
+    earliest = len(text) - budget_chars
+    latest = len(text) - budget_chars // 2
+    for boundary in ("\n\n", "\n", ". ", " "):
+        cut = text.find(boundary, earliest, latest)
+        if cut != -1:
+            break
+    else:
+        cut = earliest
+    if boundary == ". ":
+        cut += 1  # The full stop stays with the kept text
+    
+    kept = text[:cut].rstrip()
+    window = text[cut:].lstrip()
+    return kept, text[len(kept):len(text) - len(window)], window
+
+def get_user_token_usage(db: Session, user_id: int, since: datetime) -> int:
+    """Total tokens recorded for a user's generations and refinements since the given time"""
+    refined = db.query(
+        func.coalesce(func.sum(Refinement.input_tokens), 0) +
+        func.coalesce(func.sum(Refinement.output_tokens), 0)
+    ).join(Project, Project.id == Refinement.project_id).filter(
+        Project.user_id == user_id,
+        Refinement.created_at >= since
+    ).scalar()
+    generated = db.query(
+        func.coalesce(func.sum(TokenUsage.input_tokens), 0) +
+        func.coalesce(func.sum(TokenUsage.output_tokens), 0)
+    ).filter(
+        TokenUsage.user_id == user_id,
+        TokenUsage.created_at >= since
+    ).scalar()
+    return int(refined or 0) + int(generated or 0)
+
+def record_generation_usage(db: Session, user_id: int, project_id: int, kind: str, input_tokens: int, output_tokens: int):
+    """Add a generation model call to the user's usage, committed with the caller's transaction"""
+    global _last_usage_prune
+    db.add(TokenUsage(
+        user_id=user_id,
+        project_id=project_id,
+        kind=kind,
+        input_tokens=input_tokens,
+        output_tokens=output_tokens
+    ))
+    if time.monotonic() - _last_usage_prune >= USAGE_PRUNE_INTERVAL_SECONDS:
+        _last_usage_prune = time.monotonic()
+        db.execute(delete(TokenUsage).where(
+            TokenUsage.created_at < datetime.utcnow() - timedelta(hours=USAGE_RETENTION_HOURS)
+        ))
+
+def check_request_budget(prompt_tokens: int):
+    """Reject a prompt that exceeds the per-request token budget"""
+    if prompt_tokens > MAX_REQUEST_TOKENS:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Request needs ~{prompt_tokens} tokens, limit is {MAX_REQUEST_TOKENS}. Shorten the refinement prompt."
+        )
+
+def within_user_budget(db: Session, user_id: int, prompt_tokens: int) -> bool:
+    """Whether a prompt still fits in the user's daily token budget"""
+    if USER_DAILY_TOKEN_BUDGET <= 0:
+        return True
+    used = get_user_token_usage(db, user_id, datetime.utcnow() - timedelta(days=1))
+    return used + prompt_tokens <= USER_DAILY_TOKEN_BUDGET
+
+def check_user_budget(db: Session, user_id: int, prompt_tokens: int):
+    """Reject a request that would take the user over their daily token budget"""
+    if USER_DAILY_TOKEN_BUDGET <= 0:
+        return
+
+    used = get_user_token_usage(db, user_id, datetime.utcnow() - timedelta(days=1))
+    if used + prompt_tokens > USER_DAILY_TOKEN_BUDGET:
+        raise HTTPException(
+            status_code=429,
+            detail=f"Daily token budget of {USER_DAILY_TOKEN_BUDGET} exhausted ({used} used). Try again later."
+        )
@@ -11,6 +11,11 @@ const api = axios.create({
 api.interceptors.request.use(
   (config) => {
     const token = localStorage.getItem('token');
+    // Lets the backend read from a replica only once it has our last write
+    const lastWrite = localStorage.getItem('lastWrite');
+    if (lastWrite) {
+      config.headers['X-Last-Write'] = lastWrite;
+    }
     if (token) {
       config.headers.Authorization = `Bearer ${token}`;
       console.log('API Request with token:', config.url, token.substring(0, 20) + '...');
@@ -26,13 +31,20 @@ api.interceptors.request.use(
 
 // Add response interceptor to handle 401 errors
 api.interceptors.response.use(
-  (response) => response,
+  (response) => {
+    const lastWrite = response.headers['x-last-write'];
+    if (lastWrite) {
+      localStorage.setItem('lastWrite', lastWrite);
+    }
+    return response;
+  },
   (error) => {
     if (error.response?.status === 401) {
       // Token expired or invalid - clear storage and redirect to login
       localStorage.removeItem('token');
       localStorage.removeItem('userId');
       localStorage.removeItem('username');
+      localStorage.removeItem('lastWrite');
       delete api.defaults.headers.common['Authorization'];
       // Redirect to login if not already there
       if (window.location.pathname !== '/login') {